@@ -0,0 +1,27 @@
+# Pure numpy, so the lines drawn by the dashboard can be checked without a server.
+import numpy as np
+
+
+def min_max_envelope(positions: np.ndarray, samples: np.ndarray, buckets: int, window=None):
+    """
+    Downsample a channel to the min and max of each of buckets runs of samples, enough to draw it buckets pixels wide
+    without losing its peaks. Only the samples in the window [x0,x1] are kept, plus one on each side so the line reaches
+    the edges of the figure
+    ----
+    Return
+    (np.ndarray, np.ndarray): the sample positions and the samples, at full resolution when there are at most 2 * buckets
+    """
+    lo, hi = 0, len(samples)
+    if window is not None:
+        lo = max(int(np.searchsorted(positions, window[0], side="right")) - 1, 0)
+        hi = min(int(np.searchsorted(positions, window[1], side="left")) + 1, len(samples))
+    positions, samples = positions[lo:hi], samples[lo:hi]
+    if len(samples) <= 2 * buckets:
+        return positions, samples
+
+    # every run holds at least two samples, each one is drawn as a vertical segment from its min to its max
+    starts = np.linspace(0, len(samples), buckets, endpoint=False).astype(np.int64)
+    envelope = np.empty(2 * buckets, dtype=samples.dtype)
+    envelope[0::2] = np.minimum.reduceat(samples, starts)
+    envelope[1::2] = np.maximum.reduceat(samples, starts)
+    return np.repeat(positions[starts], 2), envelope
@@ -0,0 +1,109 @@
+# The dashboard serves every session from one process, values loaded here are shared by all of them.
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class SceneCache:
+    """
+    A byte-bounded LRU of loaded values, shared by every session of the dashboard process
+
+    Values are loaded once however many sessions ask for them: a session asking for a key that is being loaded waits for
+    that load instead of starting another one. Values are shared, so they must not be modified once loaded.
+
+    Attributes
+    ----------
+    max_bytes(int): the bytes the cached values may take before the least recently used ones are dropped
+    on_evict(callable|None): called with every value dropped from the cache
+
+    Methods
+    -------
+    get(key, load): the value of a key, loading it if missing
+    size(): the bytes taken by the cached values
+    clear(): drop every cached value
+    """
+
+    def __init__(self, max_bytes: int, on_evict=None):
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        """
+        The value of a key, loading it if missing
+        ----------------------------
+        Parameters
+        ----------
+        key(hashable): the key of the value, i.e, a mid
+        load(callable): loads the value, returns the value and the bytes it takes. Values bigger than max_bytes are
+                        returned without being cached, and are not passed to on_evict since the caller still uses them
+
+        Returns
+        -------
+        the cached value
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            future = self._loading.get(key)
+            loader = future is None
+            if loader:
+                future = self._loading[key] = Future()
+
+        if not loader:
+            return future.result()
+
+        try:
+            value, nbytes = load()
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._loading[key]
+            evicted = self._insert(key, value, nbytes)
+        future.set_result(value)
+        self._evicted(evicted)
+        return value
+
+    def size(self) -> int:
+        with self._lock:
+            return self._size
+
+    def clear(self):
+        with self._lock:
+            evicted = [value for value, _ in self._entries.values()]
+            self._entries.clear()
+            self._size = 0
+        self._evicted(evicted)
+
+    def _insert(self, key, value, nbytes: int) -> list:
+        """
+        Cache a value and drop the least recently used ones past max_bytes, holding the lock
+        ----------------------------
+        Returns
+        -------
+        list: the dropped values
+        """
+        if nbytes > self.max_bytes:
+            return []
+
+        self._entries[key] = (value, nbytes)
+        self._size += nbytes
+        evicted = []
+        while self._size > self.max_bytes:
+            _, (old, old_nbytes) = self._entries.popitem(last=False)
+            self._size -= old_nbytes
+            evicted.append(old)
+        return evicted
+
+    def _evicted(self, values: list):
+        if self.on_evict is not None:
+            for value in values:
+                self.on_evict(value)
@@ -4,28 +4,39 @@ import sys
 from typing import DefaultDict, List
 import os
 from collections import defaultdict
+import asyncio
 import csv
+import threading
+import time
 from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from functools import partial
 
 import OpenVisus as ov
 import panel as pn
+from bokeh.events import RangesUpdate
 from bokeh.plotting import figure
 from bokeh.models import (
     GlyphRenderer,
     HoverTool,
     BoxZoomTool,
     PanTool,
+    Range1d,
     ResetTool,
     SaveTool,
     WheelZoomTool,
 )
 
 from utils import get_aws_bucket, check_if_key_exists, PREFIX
+from nsdf_dark_matter_cli.cache import Cache, CacheBusyError
+from downsample import min_max_envelope
+from scene_cache import SceneCache
 
 
 # detectors_map = {'10000_2_Phonon4096': False, '10000_1_Phonon4096': False}
 # channel_to_renderer = {'10000_2_Phonon4096_C1': GlyphRender(), '10000_1_Phonon4096_C1': GlyphRenderer()}
+# line_pool = {('2_Phonon4096', 0): GlyphRenderer(), ('1_Phonon4096', 0): GlyphRenderer()}
 
 INFO = "INFO"
 ERROR = "ERROR"
@@ -56,6 +67,27 @@ RIGHT_DOUBLE_ARROW = """
 """
 
 FILES_VOLUME = "./idx/"
+# the bytes the downloaded mids may take before the least recently used ones are evicted
+CACHE_QUOTA = int(os.getenv("IDX_CACHE_QUOTA", 20 * 1024 ** 3))
+CACHE = Cache(FILES_VOLUME, quota=CACHE_QUOTA)
+# the bytes the scenes and channel rows shared by every session may take in memory
+SCENE_CACHE_BYTES = int(os.getenv("SCENE_CACHE_BYTES", 2 * 1024 ** 3))
+# parsed metadata takes a few times the size of its text files as python objects
+METADATA_OVERHEAD = 4
+# scenes are downloaded and parsed off the server thread, so sessions stay responsive while one loads
+SCENE_LOADERS = ThreadPoolExecutor(max_workers=int(os.getenv("SCENE_LOADERS", 4)))
+# seconds between the progress messages of a scene load
+PROGRESS_INTERVAL = 0.5
+# the events on each side of the shown one, and the mids on each side of the loaded one (in uploaded_files.txt order),
+# prepared in the background so stepping through them does not wait on reads or downloads
+PREFETCH_EVENTS = int(os.getenv("PREFETCH_EVENTS", 3))
+PREFETCH_MIDS = int(os.getenv("PREFETCH_MIDS", 1))
+# kept apart from SCENE_LOADERS so prefetching never delays a load a user waits for
+PREFETCHERS = ThreadPoolExecutor(max_workers=2)
+# mid downloads take seconds, they get their own worker so they never hold up the event prefetch
+MID_PREFETCHERS = ThreadPoolExecutor(max_workers=1)
+# the pixels waveforms are downsampled to until the browser reports the width of the figure
+DEFAULT_PLOT_WIDTH = 1600
 COLORS = [
     "#ff0000",  # Red
     "#ffff00",  # Yellow
@@ -97,6 +129,13 @@ def create_channel_metadata_map(filepath: str) -> DefaultDict[str, List]:
     return mp
 
 
+def create_event_detectors_map(detector_to_channels: DefaultDict[str, List]) -> DefaultDict[str, List[str]]:
+    mp = defaultdict(list)
+    for channel_name in detector_to_channels.keys():
+        mp[channel_name.split("_")[0]].append(channel_name)
+    return mp
+
+
 def create_event_metadata_map(filepath: str) -> DefaultDict[str, EventMetadata]:
     mp = defaultdict(EventMetadata)
     i = 0
@@ -115,6 +154,18 @@ def create_event_metadata_map(filepath: str) -> DefaultDict[str, EventMetadata]:
     return mp
 
 
+def read_channel_rows(dataset, lo: int, hi: int):
+    """
+    Read the channel rows [lo,hi) at full resolution
+    ----
+    Return
+    (np.ndarray, np.ndarray): the sample positions and the channel data
+    """
+    (x0, _), (x1, _) = dataset.getLogicBox()
+    data = dataset.read(field="data", logic_box=[[x0, lo], [x1, hi]])
+    return np.arange(x0, x1), data
+
+
 def generate_palette(hex_color, steps=8):
     """Generate a palette of 20 colors from a given hex color"""
     cmap = mcolors.LinearSegmentedColormap.from_list(
@@ -138,15 +189,62 @@ def get_mid_files(remote_url: str):
     return mid_files
 
 
-def download_processed_files(midfile: str):
+class LoadCancelled(Exception):
+    """
+    Raised in a scene load superseded by another load of the same session
+    """
+
+
+def download_processed_files(midfile: str, progress=None, cancelled: threading.Event | None = None):
     """
     Download processed files from storage (idx, channel metadata, event metadata)
     -----------------------------------------------------------------------------
     Parameters
     ----------
     file(str): the mid file to download in the the format 07180808_1558_F0001
+    progress(callable|None): called with a status message as the download goes
+    cancelled(threading.Event|None): stops the download with LoadCancelled once set
     """
     s3 = get_aws_bucket()
+    # written to a staging directory and published once complete, so other sessions never load a partial mid
+    while True:
+        try:
+            staging = CACHE.stage(midfile, blocking=False)
+            break
+        except CacheBusyError:
+            # another session or the CLI is downloading the mid, wait for it without losing the chance to cancel
+            _check_cancelled(midfile, cancelled)
+            if progress is not None:
+                progress(f"Waiting for {midfile} to be downloaded...")
+            time.sleep(PROGRESS_INTERVAL)
+
+    try:
+        if not CACHE.contains(midfile):
+            _download_to(s3, midfile, staging.path, progress, cancelled)
+            staging.publish()
+    finally:
+        staging.release()
+
+
+def _check_cancelled(midfile: str, cancelled: threading.Event | None):
+    if cancelled is not None and cancelled.is_set():
+        raise LoadCancelled(f"loading {midfile} was cancelled")
+
+
+def _download_to(s3, midfile: str, local_path: str, progress=None, cancelled: threading.Event | None = None):
+    """
+    Download the processed files of a mid into local_path, skipping the ones already there
+    """
+    downloaded, last_progress = 0, 0.0
+
+    def transferred(nbytes: int):
+        nonlocal downloaded, last_progress
+        # raising aborts the transfer, the partial file is not kept
+        _check_cancelled(midfile, cancelled)
+        downloaded += nbytes
+        if progress is not None and time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+            last_progress = time.monotonic()
+            progress(f"Downloading {midfile}... {downloaded / 1024 ** 2:.1f}MiB")
 
     filenames = [f"{midfile}.idx", f"0000.bin",
                  f"{midfile}.txt", f"{midfile}.csv"]
@@ -158,32 +256,210 @@ def download_processed_files(midfile: str):
     ]
 
     for i, file in enumerate(download_files):
-        dst = os.path.join(FILES_VOLUME, midfile, filenames[i])
+        dst = os.path.join(local_path, filenames[i])
         if filenames[i].split(".")[1] == "bin":
-            dst = os.path.join(FILES_VOLUME, midfile, midfile, filenames[i])
+            dst = os.path.join(local_path, midfile, filenames[i])
 
         if not os.path.exists(dst):
+            _check_cancelled(midfile, cancelled)
             if check_if_key_exists(file, True):
                 os.makedirs(os.path.dirname(dst), exist_ok=True)
-                s3.download_file(file, dst)
+                s3.download_file(file, dst, Callback=transferred)
             else:
                 raise FileNotFoundError(f"{midfile} not in storage")
 
 
+class Scene:
+    """
+    The metadata of a mid and its open idx dataset, shared read-only by every session showing the mid
+
+    A scene keeps the mid in use, so it is not evicted from disk while channel rows can still be read from it. SCENES
+    releases the mid when it drops the scene, a scene too big to be cached releases it once its last user drops it.
+
+    Attributes
+    ----------
+    mid(str): the mid in the format 07180808_1558_F0001
+    detector_to_channels(dict): the [lo, hi] channel rows of every detector
+    event_to_detectors(dict): the detectors of every event
+    event_to_metadata(dict): the EventMetadata of every event
+    events(list[str]): the sorted event ids
+    nbytes(int): an estimate of the memory the metadata takes
+
+    Methods
+    -------
+    read_rows(lo, hi): the channel rows [lo,hi), cached for every session
+    envelopes(lo, hi, width, window): the downsampled channel rows [lo,hi), cached for every session
+    release(): stop keeping the mid in use
+    """
+
+    def __init__(self, mid: str):
+        self.mid = mid
+        txt = os.path.join(FILES_VOLUME, mid, f"{mid}.txt")
+        csv_path = os.path.join(FILES_VOLUME, mid, f"{mid}.csv")
+        self.detector_to_channels = dict(create_channel_metadata_map(txt))
+        self.event_to_detectors = dict(create_event_detectors_map(self.detector_to_channels))
+        self.event_to_metadata = dict(create_event_metadata_map(csv_path))
+        self.events = sorted(self.event_to_detectors.keys())
+        self.nbytes = METADATA_OVERHEAD * (os.path.getsize(txt) + os.path.getsize(csv_path))
+        # rows are read per event instead of decoding the whole file, reads on the shared handle are serialized
+        self._dataset = ov.LoadDataset(os.path.join(FILES_VOLUME, mid, f"{mid}.idx"))
+        self._dataset_lock = threading.Lock()
+        self._lease = CACHE.use(mid)
+
+    def read_rows(self, lo: int, hi: int):
+        """
+        Read the channel rows [lo,hi), once for every session
+        ----
+        Return
+        (np.ndarray, np.ndarray): the sample positions and the channel data, read-only
+        """
+        return SCENES.get(("rows", self.mid, lo, hi), lambda: self._read_rows(lo, hi))
+
+    def envelopes(self, lo: int, hi: int, width: int, window=None):
+        """
+        Downsample the channel rows [lo,hi) to width pixels in the sample range window, once for every session
+        ----
+        Return
+        list[(np.ndarray, np.ndarray)]: the sample positions and samples to draw of every row, read-only
+        """
+        def load():
+            positions, data = self.read_rows(lo, hi)
+            lines = [min_max_envelope(positions, row, width, window) for row in data]
+            for x, y in lines:
+                x.setflags(write=False)
+                y.setflags(write=False)
+            return lines, sum(x.nbytes + y.nbytes for x, y in lines)
+
+        return SCENES.get(("envelopes", self.mid, lo, hi, width, window), load)
+
+    def release(self):
+        self._lease.release()
+
+    def _read_rows(self, lo: int, hi: int):
+        with self._dataset_lock:
+            positions, data = read_channel_rows(self._dataset, lo, hi)
+        positions.setflags(write=False)
+        data.setflags(write=False)
+        return (positions, data), positions.nbytes + data.nbytes
+
+
+def load_scene(mid_file: str) -> Scene:
+    """
+    The scene of a downloaded mid, parsed once for every session
+    """
+    def load():
+        scene = Scene(mid_file)
+        return scene, scene.nbytes
+
+    return SCENES.get(mid_file, load)
+
+
+def fetch_scene(mid_file: str, progress, cancelled: threading.Event):
+    """
+    Download a mid if needed and load its scene, run on SCENE_LOADERS
+    -----------------------------------------------------------------------------
+    Parameters
+    ----------
+    mid_file(str): the mid file in the format 07180808_1558_F0001
+    progress(callable): called with a status message as the load goes
+    cancelled(threading.Event): stops the load with LoadCancelled once set
+
+    Returns
+    -------
+    (Lease, Scene): the lease keeping the mid in use for the session, and its scene
+    """
+    # the mid is not evicted while the session shows it, even if its scene is dropped from memory. The lease is taken
+    # before anything else, a mid evicted since it was downloaded is downloaded again
+    while True:
+        _check_cancelled(mid_file, cancelled)
+        try:
+            lease = CACHE.use(mid_file)
+            break
+        except FileNotFoundError:
+            download_processed_files(mid_file, progress, cancelled)
+
+    try:
+        progress(f"Opening {mid_file}...")
+        return lease, load_scene(mid_file)
+    except BaseException:
+        lease.release()
+        raise
+
+
+def prefetch_envelopes(scene: Scene, rows: list, width: int, window, current):
+    """
+    Prepare the lines of the channel rows of upcoming events, run on PREFETCHERS
+    -----------------------------------------------------------------------------
+    Parameters
+    ----------
+    scene(Scene): the scene of the events
+    rows(list[(int, int)]): the [lo, hi) channel rows, most likely to be shown first
+    width(int), window: the figure width and visible range the lines are downsampled to
+    current(callable): whether the prefetch is still wanted, the session moved on otherwise
+    """
+    for lo, hi in rows:
+        if not current():
+            return
+        try:
+            scene.envelopes(lo, hi, width, window)
+        except Exception:
+            # a prefetch failing is not an error, the rows are read again when shown
+            return
+
+
+def prefetch_mid(mid_file: str, cancelled: threading.Event):
+    """
+    Download a mid into the local cache ahead of it being picked, run on MID_PREFETCHERS
+    -----------------------------------------------------------------------------
+    Parameters
+    ----------
+    mid_file(str): the mid file in the format 07180808_1558_F0001
+    cancelled(threading.Event): set once the session moved to another mid, the prefetch is dropped or stopped
+    """
+    if cancelled.is_set() or CACHE.contains(mid_file):
+        return
+    try:
+        download_processed_files(mid_file, cancelled=cancelled)
+    except Exception:
+        return
+
+
+def _evict_scene(value):
+    if isinstance(value, Scene):
+        value.release()
+
+
+SCENES = SceneCache(SCENE_CACHE_BYTES, on_evict=_evict_scene)
+
+
 class AppState:
     def __init__(self, url):
         self.palettes = {color: generate_palette(color) for color in COLORS}
-        self.gradient_idx = 0
         self.mid_files = []
-        self.scene_data: np.ndarray
+        self.scene = None
+        self.scene_lease = None
+        # every scene load gets a generation, only the latest one may update the session
+        self.load_generation = 0
+        self.load_cancelled = threading.Event()
+        # every move to another event or mid supersedes the prefetch in flight
+        self.prefetch_generation = 0
+        self.mid_prefetch_cancelled = threading.Event()
         self.event_idx = 0
         self.events = []
         self.detectors = []
         self.detectors_map = {}
         self.channels_data = []
-        self.channel_to_renderer = defaultdict(GlyphRenderer)
+        # the visible sample range [x0,x1] of the figure, everything if None
+        self.view_window = None
+        # the lines of the current event, taken from the pool
+        self.channel_to_renderer = {}
+        # the lines of the figure by (detector, channel slot) and the legend items by detector number, created
+        # once and reused by every event so switching events only sends new samples to the browser
+        self.line_pool = {}
+        self.legend_pool = {}
         self.figure_title = ""
         self.detector_to_channels = defaultdict(List)
+        self.event_to_detectors = defaultdict(list)
         self.event_to_metadata = defaultdict(EventMetadata)
         self.event_metadata: EventMetadata
 
@@ -212,9 +488,6 @@ class AppState:
         )
         self.app_info_text = pn.pane.Markdown("""""")
 
-    def reset_gradient_idx(self):
-        self.gradient_idx = 0
-
     def update_event_idx(self, idx):
         self.event_idx = idx
 
@@ -233,6 +506,8 @@ class AppState:
                     tooltips=[("x", "@x"), ("y", "@y"), ("Channel", "$name")],
                 ),
             ],
+            # the range always spans the full record, the lines only hold the visible part of it
+            x_range=Range1d(0, 1),
             sizing_mode="stretch_both",
         )
 
@@ -243,50 +518,62 @@ class AppState:
         fig.yaxis.major_label_text_font_size = '22px'
 
         fig.toolbar.active_scroll = fig.select_one(WheelZoomTool)
+        # zooming and panning re-fetch the visible range, at full resolution once it fits the figure
+        fig.on_event(RangesUpdate, self.update_view_window)
         return fig
 
     def load_mid_files(self, remote_url):
         self.mid_files = get_mid_files(remote_url)
 
-    def load_scene_data(self, mid_file):
-        cached_files = os.listdir(FILES_VOLUME)
-        if cached_files and len(cached_files) > 20:
-            os.remove(os.path.join(FILES_VOLUME, cached_files[0]))
+    def start_load(self):
+        """
+        Supersede the scene load in flight, if any
+        ----
+        Return
+        (int, threading.Event): the generation of the new load and the event cancelling it
+        """
+        self.load_cancelled.set()
+        self.load_cancelled = threading.Event()
+        self.load_generation += 1
+        return self.load_generation, self.load_cancelled
 
-        if mid_file not in cached_files:
-            download_processed_files(mid_file)
+    def is_current_load(self, generation: int) -> bool:
+        return generation == self.load_generation
 
-        self.detector_to_channels = create_channel_metadata_map(
-            os.path.join(FILES_VOLUME, mid_file, f"{mid_file}.txt")
-        )
-        self.event_to_metadata = create_event_metadata_map(
-            os.path.join(FILES_VOLUME, mid_file, f"{mid_file}.csv")
-        )
-        self.scene_data = ov.LoadDataset(
-            os.path.join(FILES_VOLUME, mid_file, f"{mid_file}.idx")
-        ).read(field="data")
+    def close(self):
+        """
+        Give up what the session holds once its browser tab is closed, so its mid can be evicted again
+        """
+        self.load_cancelled.set()
+        self.mid_prefetch_cancelled.set()
+        # a load or prefetch still in flight finds itself superseded and drops its result
+        self.load_generation += 1
+        self.prefetch_generation += 1
+        if self.scene_lease is not None:
+            self.scene_lease.release()
+            self.scene_lease = None
+
+    def show_scene(self, lease, scene: Scene):
+        if self.scene_lease is not None:
+            self.scene_lease.release()
+        self.scene_lease = lease
+
+        self.scene = scene
+        self.detector_to_channels = self.scene.detector_to_channels
+        self.event_to_detectors = self.scene.event_to_detectors
+        self.event_to_metadata = self.scene.event_to_metadata
 
     def load_events(self):
-        if self.scene_data.any():
-            st = set()
-            for k in self.detector_to_channels.keys():
-                evt = k.split("_")[0]
-                if evt not in st:
-                    st.add(evt)
-            events = list(st)
-            events.sort()
-            self.events = events
+        if self.scene is not None:
+            self.events = self.scene.events
 
     def load_detectors(self, event_id):
-        if self.scene_data.any():
+        if self.scene is not None:
             detectors, detectors_map = [], defaultdict(bool)
-            for k in self.detector_to_channels.keys():
-                if event_id in k:
-                    multichoice_detectors = k.split("_")[1]
-                    detectors.append(f"D{multichoice_detectors}")
-                    detectors_map[f"{event_id}_{multichoice_detectors}_Phonon_4096"] = (
-                        True
-                    )
+            for k in self.event_to_detectors.get(event_id, []):
+                multichoice_detectors = k.split("_")[1]
+                detectors.append(f"D{multichoice_detectors}")
+                detectors_map[k] = True
 
             self.detectors, self.detectors_map = detectors, detectors_map
 
@@ -299,21 +586,58 @@ class AppState:
                 self.detectors_map[k] = True
 
     def load_channel_data(self, detectors):
-        if self.scene_data.any() and len(detectors) > 0:
+        if self.scene is not None and len(detectors) > 0:
             channels = []
             for k in self.detectors_map.keys():
                 lo, hi = self.detector_to_channels[k]
-                data = self.scene_data[lo:hi]
+                # rows are read per event at full resolution instead of decoding the whole file, and downsampled to
+                # the figure before they are sent to the browser
+                positions, data = self.scene.read_rows(lo, hi)
+                self.update_record_range(positions)
                 channels.append((k, data))
             self.channels_data = channels
         else:
             self.channels_data = []
 
-    def load_event_metadata(self, eventID):
-        self.event_metadata = self.event_to_metadata[eventID]
+    def prefetch_events(self):
+        """
+        Prepare the lines of the PREFETCH_EVENTS events on each side of the shown one, closest first
+        """
+        if self.scene is None:
+            return
+        self.prefetch_generation += 1
+        generation = self.prefetch_generation
+
+        neighbours = []
+        for step in range(1, PREFETCH_EVENTS + 1):
+            # next is the most likely move
+            for idx in (self.event_idx + step, self.event_idx - step):
+                if 0 <= idx < len(self.events):
+                    neighbours.append(self.events[idx])
+        rows = [self.detector_to_channels[k] for event in neighbours for k in self.event_to_detectors.get(event, [])]
+
+        width = self.fig.inner_width or DEFAULT_PLOT_WIDTH
+        PREFETCHERS.submit(prefetch_envelopes, self.scene, rows, width, self.view_window,
+                           lambda: generation == self.prefetch_generation)
+
+    def prefetch_mids(self, mid_file):
+        """
+        Download the PREFETCH_MIDS mids on each side of mid_file in the list of mids
+        """
+        # the prefetches queued for the previous mid are not wanted anymore
+        self.mid_prefetch_cancelled.set()
+        self.mid_prefetch_cancelled = threading.Event()
+        if mid_file not in self.mid_files:
+            return
+        idx = self.mid_files.index(mid_file)
+        for step in range(1, PREFETCH_MIDS + 1):
+            for neighbour in (idx + step, idx - step):
+                if 0 <= neighbour < len(self.mid_files):
+                    MID_PREFETCHERS.submit(prefetch_mid, self.mid_files[neighbour], self.mid_prefetch_cancelled)
 
-    def add_channel(self, channel_name, line: GlyphRenderer):
-        self.channel_to_renderer[channel_name] = line
+    def load_event_metadata(self, eventID):
+        # the scene is shared, missing events must not be added to it
+        self.event_metadata = self.event_to_metadata.get(eventID, EventMetadata())
 
     def send_notification(self, ntype, text):
         match ntype:
@@ -335,10 +659,12 @@ class AppState:
             if channel_name in k and self.detectors_map[k.split("_C")[0]]:
                 self.channel_to_renderer[k].visible = state
 
-    def fig_deep_clean(self):
-        for renderer in self.channel_to_renderer.values():
-            self.fig.renderers.remove(renderer)
-        self.channel_to_renderer = defaultdict(GlyphRenderer)
+    def reset_channels(self):
+        """
+        Hide the lines of the previous event, they stay in the figure to be reused by the next one
+        """
+        self.clean_channels()
+        self.channel_to_renderer = {}
 
     def clean_channels(self):
         for renderer in self.channel_to_renderer.values():
@@ -353,27 +679,78 @@ class AppState:
     def toggle_loading_spinner(self, state):
         self.loading_dataset_spinner.value = self.loading_dataset_spinner.visible = state
 
-    def add_line_glyph(self, data, label):
-        d_num = label.split("_")[1]
-        self.add_channel(
-            label,
-            self.fig.line(
-                x=list(range(len(data))),
-                y=data,
-                name=label,
-                color=self.palettes[COLORS[int(d_num)]][self.gradient_idx],
-                line_width=3,
-            ),
-        )
-        self.gradient_idx += 1 if self.gradient_idx + 1 < 20 else 0
+    def downsample(self, channel_name):
+        """
+        The samples of the channels of a detector to draw in the visible range of the figure, at most two per pixel
+        """
+        lo, hi = self.detector_to_channels[channel_name]
+        width = self.fig.inner_width or DEFAULT_PLOT_WIDTH
+        return self.scene.envelopes(lo, hi, width, self.view_window)
+
+    def update_record_range(self, positions):
+        """
+        Bound the x range of the figure to the sample positions of the record, resetting the view when they change
+        """
+        if len(positions) == 0:
+            return
+        record = (int(positions[0]), int(positions[-1]))
+        x_range = self.fig.x_range
+        if x_range.bounds != record:
+            x_range.update(start=record[0], end=record[1], reset_start=record[0], reset_end=record[1], bounds=record)
+            self.view_window = None
+
+    def update_view_window(self, event: RangesUpdate):
+        if event.x0 is None or event.x1 is None:
+            return
+        bounds = self.fig.x_range.bounds
+        # the whole record is the view lines are prefetched for
+        full = bounds is not None and event.x0 <= bounds[0] and event.x1 >= bounds[1]
+        self.view_window = None if full else (event.x0, event.x1)
+        self.refresh_channels()
+
+    def refresh_channels(self):
+        """
+        Send the downsampled samples of the visible range to the lines already in the figure
+        """
+        for channel_name, _ in self.channels_data:
+            for i, (x, y) in enumerate(self.downsample(channel_name)):
+                renderer = self.channel_to_renderer.get(f"{channel_name}_C{str(i+1)}")
+                if renderer is not None:
+                    renderer.data_source.data = {"x": x, "y": y}
+
+    def pooled_line(self, detector: str, channel: int) -> GlyphRenderer:
+        """
+        The line of a channel slot of a detector (i.e, 2_Phonon4096), created the first time the slot is shown
+        """
+        key = (detector, channel)
+        if key not in self.line_pool:
+            palette = self.palettes[COLORS[int(detector.split("_")[0])]]
+            self.line_pool[key] = self.fig.line(
+                x=np.empty(0), y=np.empty(0), color=palette[channel % len(palette)], line_width=3
+            )
+        return self.line_pool[key]
+
+    def show_line(self, line, label, channel: int):
+        # the label is the channel of a detector of an event, i.e, 10000_2_Phonon4096_C1
+        detector = label.split("_", 1)[1].rsplit("_C", 1)[0]
+        renderer = self.pooled_line(detector, channel)
+        x, y = line
+        # numpy arrays are sent to the browser as binary buffers
+        renderer.data_source.data = {"x": x, "y": y}
+        renderer.name = label
+        renderer.visible = True
+        self.channel_to_renderer[label] = renderer
 
     def render_legend_glyph(self):
-        for d in self.detectors_map.keys():
-            d_num = d.split("_")[1]
+        d_nums = {d.split("_")[1] for d in self.detectors_map.keys()}
+        for d_num in d_nums - self.legend_pool.keys():
             self.fig.line(
                 legend_label=f"D{d_num}", line_color=COLORS[int(d_num)], line_width=3
             )
             self.fig.legend.label_text_font_size = '18pt'
+            self.legend_pool[d_num] = self.fig.legend.items[-1]
+        for d_num, item in self.legend_pool.items():
+            item.visible = d_num in d_nums
 
     def render_event_metadata(self):
         self.event_metadata_widget.object = f"""
@@ -432,14 +809,13 @@ class AppState:
 
     def render_channels(self, detectors):
         detectors = set([d[1] for d in detectors])
-        # create renderers for new detectors, if any
+        # show the lines of new detectors, if any
         for channel in self.channels_data:
-            channel_name, datarows = channel
-            self.reset_gradient_idx()
-            for i, data in enumerate(datarows):
+            channel_name, _ = channel
+            for i, line in enumerate(self.downsample(channel_name)):
                 channel_ID = f"{channel_name}_C{str(i+1)}"
                 if channel_ID not in self.channel_to_renderer:
-                    self.add_line_glyph(data, channel_ID)
+                    self.show_line(line, channel_ID, i)
                 else:
                     self.channel_to_renderer[channel_ID].visible = True
 
@@ -458,6 +834,7 @@ def main():
         remote_url = sys.argv[1]
 
     app_state = AppState(remote_url)
+    pn.state.on_session_destroyed(lambda _: app_state.close())
     pn.extension(design="material", sizing_mode="stretch_width", notifications=True)
 
     # ---------------- WIDGETS ---------------------------
@@ -529,14 +906,47 @@ def main():
             "default" if evt.obj.button_type == "primary" else "primary"
         )
 
-    def update_events(mid_file):
-        app_state.toggle_loading_spinner(True)
-        app_state.render_app_info_text(f"Loading {mid_file}...")
-        toggle_all_component_interactivity(True)
-        app_state.load_scene_data(mid_file)
+    def show_load_progress(generation, text):
+        if app_state.is_current_load(generation):
+            app_state.render_app_info_text(text)
+
+    def finish_load():
         toggle_all_component_interactivity(False)
         app_state.render_app_info_text("")
         app_state.toggle_loading_spinner(False)
+
+    async def update_events(mid_file):
+        generation, cancelled = app_state.start_load()
+        doc = pn.state.curdoc
+        app_state.toggle_loading_spinner(True)
+        app_state.render_app_info_text(f"Loading {mid_file}...")
+        toggle_all_component_interactivity(True)
+        # picking another mid cancels the load
+        select_scene.disabled = False
+
+        def progress(text):
+            # called from a loader thread, the session is only updated from its own event loop
+            doc.add_next_tick_callback(partial(show_load_progress, generation, text))
+
+        try:
+            lease, scene = await asyncio.wrap_future(
+                SCENE_LOADERS.submit(fetch_scene, mid_file, progress, cancelled)
+            )
+        except LoadCancelled:
+            return
+        except Exception as e:
+            if app_state.is_current_load(generation):
+                finish_load()
+                app_state.send_notification(ERROR, f"Could not load {mid_file}: {e}")
+            return
+
+        if not app_state.is_current_load(generation):
+            lease.release()
+            return
+
+        app_state.show_scene(lease, scene)
+        app_state.prefetch_mids(mid_file)
+        finish_load()
         app_state.send_notification(SUCCESS, f"Loaded {mid_file} successfully")
 
         app_state.load_events()
@@ -547,7 +957,7 @@ def main():
 
     def update_detectors(eventID):
         if eventID != "":
-            app_state.fig_deep_clean()
+            app_state.reset_channels()
             app_state.load_detectors(eventID)
             app_state.render_legend_glyph()
             app_state.load_event_metadata(eventID)
@@ -563,6 +973,8 @@ def main():
             multichoice_detectors.value = []
             multichoice_detectors.value = app_state.detectors
             checkbox_toggle_detectors.value = True
+            # once the event is shown, so its reads go first
+            app_state.prefetch_events()
 
     def toggle_detectors(state):
         multichoice_detectors.value = app_state.detectors if state else []
@@ -0,0 +1,155 @@
+import threading
+import numpy as np
+import pytest
+from downsample import min_max_envelope
+from scene_cache import SceneCache
+
+
+class TestSceneCache:
+    def test_hit(self):
+        cache = SceneCache(100)
+        loads = []
+
+        def load():
+            loads.append(1)
+            return "scene", 10
+
+        assert cache.get("a", load) == "scene"
+        assert cache.get("a", load) == "scene"
+        assert len(loads) == 1
+        assert cache.size() == 10
+
+    def test_loads_are_coalesced(self):
+        """Sessions asking for a key being loaded wait for that load instead of starting another one"""
+        cache = SceneCache(100)
+        started, release = threading.Event(), threading.Event()
+        loads = []
+
+        def load():
+            loads.append(1)
+            started.set()
+            release.wait(5)
+            return object(), 10
+
+        results = []
+        loaders = [threading.Thread(target=lambda: results.append(cache.get("a", load))) for _ in range(4)]
+        loaders[0].start()
+        assert started.wait(5)
+        for loader in loaders[1:]:
+            loader.start()
+        release.set()
+        for loader in loaders:
+            loader.join(5)
+
+        assert len(loads) == 1
+        assert len(results) == 4 and all(result is results[0] for result in results)
+
+    def test_errors_reach_waiters(self):
+        """A failed load is raised in every waiting session and is not cached"""
+        cache = SceneCache(100)
+        started, release = threading.Event(), threading.Event()
+
+        def failing():
+            started.set()
+            release.wait(5)
+            raise FileNotFoundError("a")
+
+        errors = []
+
+        def get():
+            try:
+                cache.get("a", failing)
+            except FileNotFoundError as e:
+                errors.append(e)
+
+        loaders = [threading.Thread(target=get) for _ in range(3)]
+        loaders[0].start()
+        assert started.wait(5)
+        for loader in loaders[1:]:
+            loader.start()
+        release.set()
+        for loader in loaders:
+            loader.join(5)
+
+        assert len(errors) == 3
+        assert cache.size() == 0
+        assert cache.get("a", lambda: ("scene", 10)) == "scene"
+
+    def test_evicts_least_recently_used(self):
+        evicted = []
+        cache = SceneCache(30, on_evict=evicted.append)
+        for key in "abc":
+            cache.get(key, lambda key=key: (key, 10))
+        cache.get("a", lambda: pytest.fail("a is cached"))
+
+        cache.get("d", lambda: ("d", 15))
+        assert evicted == ["b", "c"]
+        assert cache.size() == 25
+
+    def test_oversized_value_is_not_cached(self):
+        """A value bigger than the cache is returned to its caller, which still uses it, and never evicted"""
+        evicted = []
+        cache = SceneCache(30, on_evict=evicted.append)
+        cache.get("a", lambda: ("a", 10))
+
+        assert cache.get("big", lambda: ("big", 31)) == "big"
+        assert evicted == []
+        assert cache.size() == 10
+        loads = []
+        cache.get("big", lambda: loads.append(1) or ("big", 31))
+        assert loads == [1]
+
+    def test_clear(self):
+        evicted = []
+        cache = SceneCache(30, on_evict=evicted.append)
+        cache.get("a", lambda: ("a", 10))
+        cache.get("b", lambda: ("b", 10))
+
+        cache.clear()
+        assert sorted(evicted) == ["a", "b"]
+        assert cache.size() == 0
+
+
+class TestMinMaxEnvelope:
+    positions = np.arange(1000, 2000)
+
+    def test_peaks_are_kept(self):
+        samples = np.zeros(1000, dtype=np.int16)
+        samples[123], samples[877] = 500, -7
+        xs, ys = min_max_envelope(self.positions, samples, 10)
+
+        assert len(xs) == len(ys) == 20
+        # the spikes land in the max of the second bucket and the min of the ninth
+        assert ys[3] == 500 and ys[16] == -7
+        assert (np.delete(ys, [3, 16]) == 0).all()
+        # every bucket is drawn as a vertical segment at its first position
+        assert (xs[0::2] == xs[1::2]).all()
+        assert xs[0] == 1000 and (np.diff(xs[0::2]) > 0).all()
+
+    def test_fewer_samples_than_pixels(self):
+        samples = np.arange(1000, dtype=np.uint16)
+        xs, ys = min_max_envelope(self.positions, samples, 500)
+        assert (xs == self.positions).all()
+        assert (ys == samples).all()
+
+    def test_window(self):
+        """Only the samples in the window are kept, plus one on each side"""
+        samples = np.arange(1000, dtype=np.uint16)
+        xs, ys = min_max_envelope(self.positions, samples, 500, window=(1100.5, 1199.5))
+        assert xs[0] == 1100 and xs[-1] == 1200
+        assert (ys == samples[100:201]).all()
+
+    def test_empty_range(self):
+        xs, ys = min_max_envelope(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint16), 10)
+        assert len(xs) == len(ys) == 0
+
+        xs, ys = min_max_envelope(self.positions, np.arange(1000, dtype=np.uint16), 10, window=(1500, 1400))
+        assert len(xs) == len(ys) == 0
+
+    @pytest.mark.parametrize("window", [(0, 500), (5000, 6000)])
+    def test_window_outside_the_record(self, window):
+        """A window past either end of the record keeps the sample at that end only"""
+        samples = np.arange(1000, dtype=np.uint16)
+        xs, ys = min_max_envelope(self.positions, samples, 10, window=window)
+        assert len(xs) == len(ys) == 1
+        assert xs[0] == (1000 if window[1] < 1000 else 1999)
@@ -0,0 +1,53 @@
+import os
+import numpy
+import pytest
+import OpenVisus as ov
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("nsdf-bench", "synthetic mid file size")
+    group.addoption("--bench-events", type=int, default=2000, help="number of events of the synthetic mid file")
+    group.addoption("--bench-detectors", type=int, default=2, help="number of detectors per event")
+    group.addoption("--bench-channels", type=int, default=4, help="number of channels per detector")
+    group.addoption("--bench-samples", type=int, default=4096, help="number of samples per channel")
+
+
+def create_synthetic_mid_dir(root, mid="07180808_1558_F0001", events=2000, detectors=2, channels=4, samples=4096, seed=0):
+    """Writes a synthetic mid directory (idx, txt, csv) shaped like a processed mid file, with noisy pulses as channel data"""
+    mid_dir = os.path.join(str(root), mid)
+    os.makedirs(mid_dir, exist_ok=True)
+
+    rng = numpy.random.default_rng(seed)
+    rows = events * detectors * channels
+    t = numpy.arange(samples)
+    pulse = (2000 * numpy.exp(-numpy.maximum(t - samples // 4, 0) / (samples / 8)) * (t >= samples // 4)).astype(numpy.int32)
+    data = (8000 + pulse[None, :] + rng.integers(-30, 30, size=(rows, samples))).astype(numpy.uint16)
+
+    db = ov.CreateIdx(url=os.path.join(mid_dir, f"{mid}.idx"), dims=[samples, rows], fields=[ov.Field("data", "uint16")], compression=["zip"])
+    db.write(data)
+
+    with open(os.path.join(mid_dir, f"{mid}.txt"), "w") as f:
+        for e in range(events):
+            for d in range(detectors):
+                lo = (e * detectors + d) * channels
+                f.write(f"{10000 + e}_{d}_Phonon_{samples} {lo} {lo + channels}\n")
+    with open(os.path.join(mid_dir, f"{mid}.csv"), "w") as f:
+        f.write("event,trigger_type,readout_type,global_timestamp\n")
+        for e in range(events):
+            f.write(f"{10000 + e},{'Physics' if e % 10 else 'Random'},None,{1533761883 + e // 20}\n")
+    return mid_dir
+
+
+@pytest.fixture(scope="session")
+def bench_size(request):
+    return {
+        "events": request.config.getoption("--bench-events"),
+        "detectors": request.config.getoption("--bench-detectors"),
+        "channels": request.config.getoption("--bench-channels"),
+        "samples": request.config.getoption("--bench-samples"),
+    }
+
+
+@pytest.fixture(scope="session")
+def mid_dir(tmp_path_factory, bench_size):
+    return create_synthetic_mid_dir(tmp_path_factory.mktemp("idx"), **bench_size)
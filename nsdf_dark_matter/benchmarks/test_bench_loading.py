@@ -0,0 +1,116 @@
+import os
+import tracemalloc
+import pytest
+from nsdf_dark_matter import idx
+from nsdf_dark_matter.idx import load_all_data
+
+MID = "07180808_1558_F0001"
+
+
+def _remove_sidecars(mid_dir):
+    for ext in ["txt", "csv"]:
+        sidecar = idx._sidecar_path(os.path.join(mid_dir, f"{MID}.{ext}"))
+        if os.path.exists(sidecar):
+            os.remove(sidecar)
+
+
+def _peak_memory(fn):
+    """Returns the result of fn and the peak of the memory traced while it runs (numpy buffers included)"""
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+class TestLoadAllData:
+    def test_load_all_data(self, benchmark, mid_dir):
+        data = benchmark(load_all_data, mid_dir)
+        assert len(data.get_event_ids()) > 0
+
+    def test_load_all_data_lazy(self, benchmark, mid_dir):
+        data = benchmark(load_all_data, mid_dir, True)
+        assert data.dataset is not None
+
+    def test_load_all_data_cold_sidecars(self, benchmark, mid_dir):
+        data = benchmark.pedantic(load_all_data, args=(mid_dir, True), setup=lambda: _remove_sidecars(mid_dir), rounds=5)
+        assert data.dataset is not None
+
+    @pytest.mark.parametrize("lazy", [False, True], ids=["eager", "lazy"])
+    def test_memory_high_water(self, benchmark, mid_dir, lazy):
+        data, peak = benchmark.pedantic(_peak_memory, args=(lambda: load_all_data(mid_dir, lazy),), rounds=1)
+        benchmark.extra_info["peak_bytes"] = peak
+        assert data is not None
+
+
+class TestMetadataBuilders:
+    def test_parse_channel_index(self, benchmark, mid_dir):
+        index = benchmark(idx._parse_channel_index, os.path.join(mid_dir, f"{MID}.txt"))
+        assert len(index) > 0
+
+    def test_parse_event_index(self, benchmark, mid_dir):
+        index = benchmark(idx._parse_event_index, os.path.join(mid_dir, f"{MID}.csv"))
+        assert len(index) > 0
+
+    def test_load_channel_index_sidecar(self, benchmark, mid_dir):
+        path = os.path.join(mid_dir, f"{MID}.txt")
+        idx._load_channel_index(path)
+        index = benchmark(idx._load_channel_index, path)
+        assert len(index) > 0
+
+    def test_create_channel_maps(self, benchmark, mid_dir):
+        index = idx._load_channel_index(os.path.join(mid_dir, f"{MID}.txt"))
+        detector_to_bounds, _ = benchmark(idx._create_channel_maps, index)
+        assert len(detector_to_bounds) == len(index)
+
+    def test_event_table(self, benchmark, mid_dir):
+        index = idx._load_event_index(os.path.join(mid_dir, f"{MID}.csv"))
+        table = benchmark(idx.EventTable.from_index, index)
+        assert len(table) == len(index)
+
+
+@pytest.fixture(scope="module")
+def cdms(mid_dir):
+    return load_all_data(mid_dir)
+
+
+@pytest.fixture(scope="module")
+def lazy_cdms(mid_dir):
+    return load_all_data(mid_dir, lazy=True)
+
+
+class TestQueries:
+    def test_get_detectors_by_event_all_events(self, benchmark, cdms):
+        def run():
+            return [cdms.get_detectors_by_event(e) for e in cdms.get_event_ids()]
+
+        detectors = benchmark(run)
+        assert len(detectors) == len(cdms.get_event_ids())
+
+    def test_get_detector_channels(self, benchmark, cdms):
+        detector_ids = cdms.get_detector_ids()[:500]
+        benchmark(lambda: [cdms.get_detector_channels(d) for d in detector_ids])
+
+    def test_get_detector_channels_lazy(self, benchmark, lazy_cdms):
+        detector_ids = lazy_cdms.get_detector_ids()[:50]
+        benchmark(lambda: [lazy_cdms.get_detector_channels(d) for d in detector_ids])
+
+    def test_get_detector_channels_lazy_coarse(self, benchmark, lazy_cdms):
+        detector_ids = lazy_cdms.get_detector_ids()[:50]
+        benchmark(lambda: [lazy_cdms.get_detector_channels(d, quality=-3) for d in detector_ids])
+
+    def test_get_channels_for(self, benchmark, cdms):
+        event_ids = cdms.get_event_ids()[::2]
+        channels, _ = benchmark(cdms.get_channels_for, event_ids)
+        assert len(channels) > 0
+
+    def test_get_channels_for_lazy(self, benchmark, lazy_cdms):
+        event_ids = lazy_cdms.get_event_ids()[:200]
+        channels, _ = benchmark(lazy_cdms.get_channels_for, event_ids)
+        assert len(channels) > 0
+
+    def test_filter_events(self, benchmark, cdms):
+        event_ids = benchmark(cdms.filter_events, "Physics", None, 1533761883, 1533761893)
+        assert len(event_ids) > 0
@@ -0,0 +1,281 @@
+"""
+catalog dark matter lib
+=======================
+
+This module offers a catalog over many processed mid files, i.e, the idx directory written by the NSDF Dark Matter CLI.
+"""
+
+import os
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Tuple, Union
+import numpy
+import OpenVisus as ov
+
+from .idx import CDMS, EventTable, _load_channel_index, _load_event_index, _load_channel_data, _read_sidecar
+
+EVENT_REF_DTYPE = numpy.dtype([("file", "<i4"), ("event", "<i8")])
+
+
+class Catalog:
+    """Catalog indexes every mid directory under a root directory. The metadata of all the files is loaded in parallel
+    and merged into a single event table, so queries run once across all the files.
+
+    Attributes
+    ----------
+        root: str
+            The root directory, i.e, ./idx
+        mid_ids: List[str]
+            The mid ids found under root, sorted
+        events: EventTable
+            The merged metadata table of the events of every file
+        event_files: numpy.ndarray
+            The file (an index into mid_ids) of every row of events
+        channel_indexes: Dict[str, numpy.ndarray]
+            The channel index of every file
+
+    Methods
+    -------
+        get(mid_id, lazy):
+            Returns the CDMS object of a mid id, the channel data is only opened on first access
+        filter_events(trigger_type, readout_type, start, end):
+            Returns the (file, event) pairs that match the provided metadata filters across all the files
+        get_event_metadata(mid_id, event_id):
+            Returns the metadata associated with an event of a mid id
+    """
+
+    def __init__(self, root: str, max_workers: Union[int, None] = None, executor: str = "process"):
+        """
+        Parameters
+        ----------
+        root: str
+            The root directory with one directory per mid id, i.e, ./idx
+        max_workers: int | None
+            The number of workers that load the metadata, defaults to the number of cores
+        executor: str
+            The kind of pool that loads the metadata, process (default) or thread
+        """
+        if executor not in ("process", "thread"):
+            raise ValueError(f"executor must be process or thread, got {executor}")
+
+        self.root = root
+        self.mid_ids: List[str] = discover_mid_dirs(root)
+        self.channel_indexes: Dict[str, numpy.ndarray] = {}
+        self.events = EventTable()
+        self.event_files = numpy.empty(0, dtype="<i4")
+        self._event_indexes: Dict[str, numpy.ndarray] = {}
+        self._event_tables: Dict[str, EventTable] = {}
+        self._cdms: Dict[Tuple[str, bool], CDMS] = {}
+        # CDMS objects being built, callers asking for the same one wait for it instead of building it again
+        self._building: Dict[Tuple[str, bool], Future] = {}
+        self._lock = threading.Lock()
+
+        if len(self.mid_ids) > 0:
+            self._load(max_workers or os.cpu_count() or 1, executor)
+
+    def __len__(self):
+        return len(self.mid_ids)
+
+    def __str__(self):
+        return f"files: {len(self.mid_ids)}, events: {len(self.events)}"
+
+    def _load(self, max_workers: int, executor: str):
+        pool: Executor = (
+            ProcessPoolExecutor(max_workers=max_workers) if executor == "process" else ThreadPoolExecutor(max_workers=max_workers)
+        )
+        with pool:
+            paths = [os.path.join(self.root, mid_id) for mid_id in self.mid_ids]
+            chunksize = max(1, len(paths) // (max_workers * 4))
+            results = pool.map(_load_indexes, paths, chunksize=chunksize)
+            for mid_id, (channel_index, event_index) in zip(self.mid_ids, results):
+                self.channel_indexes[mid_id] = channel_index
+                self._event_indexes[mid_id] = event_index
+
+        event_indexes = [self._event_indexes[mid_id] for mid_id in self.mid_ids]
+        self.events = EventTable.from_index(_concatenate_indexes(event_indexes))
+        self.event_files = numpy.repeat(numpy.arange(len(self.mid_ids), dtype="<i4"), [len(e) for e in event_indexes])
+
+    def get(self, mid_id: str, lazy: bool = True) -> Union[CDMS, None]:
+        """
+        Returns the CDMS object of a mid id built from the loaded metadata
+
+        Parameters
+        ----------
+        mid_id: str
+            The mid id, i.e, 07180808_1558_F0001
+        lazy: bool
+            When True (default), the idx dataset is kept open and rows are read on demand, see load_all_data
+
+        Returns
+        -------
+        CDMS | None
+            The CDMS object or None if the mid id is not in the catalog
+        """
+        if mid_id not in self.channel_indexes:
+            return None
+
+        key = (mid_id, lazy)
+        with self._lock:
+            if key in self._cdms:
+                return self._cdms[key]
+            future = self._building.get(key)
+            builder = future is None
+            if builder:
+                future = self._building[key] = Future()
+
+        if not builder:
+            return future.result()
+
+        # built without the lock, opening or decoding one mid does not hold back callers of the others
+        try:
+            data = self._build(mid_id, lazy)
+        except BaseException as e:
+            with self._lock:
+                del self._building[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._cdms[key] = data
+            del self._building[key]
+        future.set_result(data)
+        return data
+
+    def _build(self, mid_id: str, lazy: bool) -> CDMS:
+        """
+        Builds the CDMS object of a mid id from the loaded metadata
+        """
+        data = CDMS()
+        data._set_channel_index(self.channel_indexes[mid_id])
+        data._set_event_index(self._event_indexes[mid_id])
+        idx_path = os.path.join(self.root, mid_id, f"{mid_id}.idx")
+        if os.path.exists(idx_path):
+            # the channel store of a transcoded mid is memory mapped in both modes, see transcode_channels
+            store = _read_sidecar(idx_path)
+            if store is not None:
+                data.channels = store
+            elif lazy:
+                data.dataset = ov.LoadDataset(idx_path)
+            else:
+                data.channels = _load_channel_data(idx_path)
+        return data
+
+    def get_event_metadata(self, mid_id: str, event_id: str):
+        """
+        Returns the metadata associated with an event of a mid id
+
+        Parameters
+        ----------
+        mid_id: str
+            The mid id, i.e, 07180808_1558_F0001
+        event_id: str
+            The event ID, i.e, 10000
+
+        Returns
+        -------
+        EventMetadata | None
+            The EventMetadata object or None if the mid id or the event ID is invalid
+        """
+        if mid_id not in self._event_indexes:
+            return None
+
+        # read from the loaded event index, the channel data of the mid is not opened
+        table = self._event_tables.get(mid_id)
+        if table is None:
+            table = self._event_tables.setdefault(mid_id, EventTable.from_index(self._event_indexes[mid_id]))
+        return table.get(event_id)
+
+    def filter_events(
+        self,
+        trigger_type: Union[str, None] = None,
+        readout_type: Union[str, None] = None,
+        start: Union[int, datetime, None] = None,
+        end: Union[int, datetime, None] = None,
+    ) -> numpy.ndarray:
+        """
+        Returns the events of all the files that match the provided metadata filters, i.e, all Physics triggers across 500 files
+
+        Parameters
+        ----------
+        trigger_type: str | None
+            Only keep events with this trigger type, i.e, Physics
+        readout_type: str | None
+            Only keep events with this readout type
+        start: int | datetime | None
+            Only keep events recorded at or after this time (epoch seconds or datetime)
+        end: int | datetime | None
+            Only keep events recorded before this time (epoch seconds or datetime)
+
+        Returns
+        -------
+        numpy.ndarray
+            The matching events with the fields file (an index into mid_ids) and event, sorted by mid id
+        """
+        mask = self.events.mask(trigger_type, readout_type, start, end)
+        refs = numpy.empty(int(mask.sum()), dtype=EVENT_REF_DTYPE)
+        refs["file"] = self.event_files[mask]
+        refs["event"] = self.events.event_ids[mask]
+        return refs
+
+
+def discover_mid_dirs(root: str) -> List[str]:
+    """
+    Returns the mid ids of the processed mid directories under root, a directory is a mid directory when it contains mid_id.txt
+
+    Parameters
+    ----------
+    root: str
+        The root directory, i.e, ./idx
+
+    Returns
+    -------
+    List[str]
+        The sorted mid ids
+    """
+    if not os.path.isdir(root):
+        return []
+
+    mid_ids = []
+    for entry in os.scandir(root):
+        if entry.is_dir() and os.path.exists(os.path.join(entry.path, f"{entry.name}.txt")):
+            mid_ids.append(entry.name)
+    return sorted(mid_ids)
+
+
+def _load_indexes(mid_dir: str) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Loads the channel index and the event index of a mid directory, runs in the catalog workers
+
+    Parameters
+    ----------
+    mid_dir: str
+        The mid directory, i.e, ./idx/07180808_1558_F0001
+
+    Returns
+    -------
+    Tuple[numpy.ndarray, numpy.ndarray]
+        The channel index and the event index (empty if the mid directory has no csv)
+    """
+    mid_id = os.path.basename(os.path.normpath(mid_dir))
+    channel_index = numpy.array(_load_channel_index(os.path.join(mid_dir, f"{mid_id}.txt")))
+    csv_path = os.path.join(mid_dir, f"{mid_id}.csv")
+    if os.path.exists(csv_path):
+        event_index = numpy.array(_load_event_index(csv_path))
+    else:
+        event_index = _concatenate_indexes([])
+    return channel_index, event_index
+
+
+def _concatenate_indexes(indexes: List[numpy.ndarray]) -> numpy.ndarray:
+    """
+    Concatenates event indexes whose byte string fields may have different widths
+    """
+    trigger_width = max([e.dtype["trigger_type"].itemsize for e in indexes] + [1])
+    readout_width = max([e.dtype["readout_type"].itemsize for e in indexes] + [1])
+    dtype = numpy.dtype(
+        [("event", "<i8"), ("trigger_type", f"S{trigger_width}"), ("readout_type", f"S{readout_width}"), ("global_timestamp", "<i8")]
+    )
+    if len(indexes) == 0:
+        return numpy.empty(0, dtype=dtype)
+    return numpy.concatenate([e.astype(dtype) for e in indexes])
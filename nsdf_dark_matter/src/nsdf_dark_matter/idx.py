@@ -7,12 +7,20 @@ This module offers a pool of operations that enable users to manipulate dark mat
 
 import csv
 import os
-from typing import List, DefaultDict, Union
+import threading
+import warnings
+from typing import Dict, Iterator, List, DefaultDict, Sequence, Tuple, Union
 from collections import defaultdict
 from datetime import datetime, timezone
 import numpy
 import OpenVisus as ov
 
+SIDECAR_VERSION = 1
+MISSING_TIMESTAMP = -1
+# rows transcoded per idx read, rounded up to whole idx blocks
+TRANSCODE_ROWS = 4096
+CHANNEL_ROW_DTYPE = numpy.dtype([("event", "<i8"), ("detector", "<i4"), ("channel", "<i4"), ("row", "<i8")])
+
 
 class EventMetadata:
     """EventMetadata stores all the metadata associated with a particular event
@@ -27,10 +35,10 @@ class EventMetadata:
             the global timestamp when the data was recorded
     """
 
-    def __init__(self):
-        self.trigger_type = "Unknown"
-        self.readout_type = "None"
-        self.global_timestamp = "None"
+    def __init__(self, trigger_type: str = "Unknown", readout_type: str = "None", global_timestamp: str = "None"):
+        self.trigger_type = trigger_type
+        self.readout_type = readout_type
+        self.global_timestamp = global_timestamp
 
     def __str__(self):
         return f"Trigger Type: {self.trigger_type}, Readout Type: {self.readout_type}, Global Timestamp: {self.global_timestamp}"
@@ -43,27 +51,203 @@ class EventMetadata:
             elif metadata_header == "readout_type":
                 self.readout_type = metadata[i].strip()
             elif metadata_header == "global_timestamp":
-                dt = datetime.fromtimestamp(int(metadata[i].strip()), tz=timezone.utc)
-                self.global_timestamp = dt.strftime("%A, %B %d, %Y %I:%M:%S %p UTC")
+                self.global_timestamp = _format_timestamp(int(metadata[i].strip()))
             else:
                 continue
 
 
+class EventTable:
+    """EventTable stores the metadata of all the events of a mid file as columns. The trigger and readout types are stored as
+    categorical codes and the global timestamps as epoch seconds, EventMetadata views are created on demand.
+
+    Attributes
+    ----------
+        event_ids: numpy.ndarray
+            The event ids (int64) in file order
+        trigger_codes: numpy.ndarray
+            The code of the trigger type of each event, an index into trigger_types
+        readout_codes: numpy.ndarray
+            The code of the readout type of each event, an index into readout_types
+        global_timestamps: numpy.ndarray
+            The global timestamp (int64 epoch seconds) of each event, MISSING_TIMESTAMP if unknown
+        trigger_types: List[str]
+            The trigger type categories (Physics, Unknown, etc)
+        readout_types: List[str]
+            The readout type categories
+
+    Methods
+    -------
+        from_index(index):
+            Builds the table from an event index (see _load_event_index)
+        row(event_id):
+            Returns the row of an event id
+        get(event_id):
+            Returns the EventMetadata view of an event id
+        filter(trigger_type, readout_type, start, end):
+            Returns the event ids that match all the provided filters
+    """
+
+    def __init__(self):
+        self.event_ids = numpy.empty(0, dtype="<i8")
+        self.trigger_codes = numpy.empty(0, dtype=numpy.uint8)
+        self.readout_codes = numpy.empty(0, dtype=numpy.uint8)
+        self.global_timestamps = numpy.empty(0, dtype="<i8")
+        self.trigger_types: List[str] = []
+        self.readout_types: List[str] = []
+        self._order = numpy.empty(0, dtype=numpy.intp)
+
+    def __len__(self):
+        return len(self.event_ids)
+
+    @classmethod
+    def from_index(cls, index: numpy.ndarray) -> "EventTable":
+        """
+        Builds the table from an event index
+
+        Parameters
+        ----------
+        index: numpy.ndarray
+            The event index with the fields event, trigger_type, readout_type, global_timestamp
+
+        Returns
+        -------
+        EventTable
+            The columnar event table
+        """
+        table = cls()
+        table.event_ids = numpy.ascontiguousarray(index["event"])
+        table.global_timestamps = numpy.ascontiguousarray(index["global_timestamp"])
+        table.trigger_types, table.trigger_codes = _categorize(index["trigger_type"])
+        table.readout_types, table.readout_codes = _categorize(index["readout_type"])
+        table._order = numpy.argsort(table.event_ids, kind="stable")
+        return table
+
+    def row(self, event_id: Union[str, int]) -> Union[int, None]:
+        """
+        Returns the row of an event id
+
+        Parameters
+        ----------
+        event_id: str | int
+            The event ID, i.e, 10000
+
+        Returns
+        -------
+        int | None
+            The row of the event in the table or None if the provided ID is invalid
+        """
+        try:
+            key = int(event_id)
+        except ValueError:
+            return None
+
+        i = int(numpy.searchsorted(self.event_ids, key, sorter=self._order))
+        if i >= len(self._order) or self.event_ids[self._order[i]] != key:
+            return None
+        return int(self._order[i])
+
+    def get(self, event_id: Union[str, int]) -> Union[EventMetadata, None]:
+        """
+        Returns the metadata view of an event id
+
+        Parameters
+        ----------
+        event_id: str | int
+            The event ID, i.e, 10000
+
+        Returns
+        -------
+        EventMetadata | None
+            The EventMetadata object (trigger_type, readout_type, global_timestamp) or None if the provided ID is invalid
+        """
+        i = self.row(event_id)
+        if i is None:
+            return None
+
+        timestamp = int(self.global_timestamps[i])
+        return EventMetadata(
+            self.trigger_types[self.trigger_codes[i]],
+            self.readout_types[self.readout_codes[i]],
+            _format_timestamp(timestamp) if timestamp != MISSING_TIMESTAMP else "None",
+        )
+
+    def filter(
+        self,
+        trigger_type: Union[str, None] = None,
+        readout_type: Union[str, None] = None,
+        start: Union[int, datetime, None] = None,
+        end: Union[int, datetime, None] = None,
+    ) -> numpy.ndarray:
+        """
+        Returns the event ids that match all the provided filters, i.e, all Physics triggers recorded in [start, end)
+
+        Parameters
+        ----------
+        trigger_type: str | None
+            Only keep events with this trigger type
+        readout_type: str | None
+            Only keep events with this readout type
+        start: int | datetime | None
+            Only keep events recorded at or after this time (epoch seconds or datetime)
+        end: int | datetime | None
+            Only keep events recorded before this time (epoch seconds or datetime)
+
+        Returns
+        -------
+        numpy.ndarray
+            The matching event ids (int64) in file order
+        """
+        return self.event_ids[self.mask(trigger_type, readout_type, start, end)]
+
+    def mask(
+        self,
+        trigger_type: Union[str, None] = None,
+        readout_type: Union[str, None] = None,
+        start: Union[int, datetime, None] = None,
+        end: Union[int, datetime, None] = None,
+    ) -> numpy.ndarray:
+        """
+        Returns the boolean row mask of the events that match all the provided filters, see filter
+        """
+        mask = numpy.ones(len(self.event_ids), dtype=bool)
+        if trigger_type is not None:
+            mask &= _category_mask(self.trigger_types, self.trigger_codes, trigger_type)
+        if readout_type is not None:
+            mask &= _category_mask(self.readout_types, self.readout_codes, readout_type)
+        if start is not None:
+            mask &= self.global_timestamps >= _to_epoch(start)
+        if end is not None:
+            mask &= self.global_timestamps < _to_epoch(end)
+        if start is not None or end is not None:
+            mask &= self.global_timestamps != MISSING_TIMESTAMP
+        return mask
+
+
 class CDMS:
     """CDMS class bundles all the data processed by the idx including the channel data, channel metadata map, and the event metadata map
 
     Attributes
     ----------
         channels: List
-            All the channel data of an specific mid
+            All the channel data of an specific mid. Memory mapped from the channel store when the mid was transcoded (see
+            transcode_channels), otherwise empty when the data was loaded lazily
+        dataset: ov.PyDataset | None
+            The open idx dataset handle used to read channel rows on demand when the data was loaded lazily. Reads on it are
+            serialized, so a CDMS can be shared by threads
         detector_ids: List[str]
             All the detector ids
         event_ids: List[str]
             All the event ids
         detector_to_bounds: DefaultDict[str, List]
             The mapping from detector to their associated bounds that give the position of the respective channels in the channels data
-        event_to_metadata: DefaultDict[str, EventMetadata]
-            The mapping from event ID to their associated metadata(trigger_type, readout_type, global_timestamp)
+        event_to_detectors: DefaultDict[str, List[str]]
+            The mapping from event ID to the detector ids of the event, built once at load time
+        channel_index: numpy.ndarray
+            The channel index (detector_id, event, detector, lo, hi) of every detector, see _load_channel_index
+        events: EventTable
+            The columnar table with the metadata (trigger_type, readout_type, global_timestamp) of every event
+        event_to_metadata: Dict[str, EventMetadata]
+            Deprecated, the mapping from event ID to their associated metadata built from events. Use get_event_metadata
 
     Methods
     -------
@@ -75,34 +259,58 @@ class CDMS:
             Return all the detector ids
         get_detector_channels(detector_id):
             Returns all channel data associated with an specific detector_id
+        get_channels_for(event_ids, detectors):
+            Returns the stacked channel data of several events and detectors in one call
         get_event_metadata(event_id):
             Returns the metadata associated with an specific event id
+        filter_events(trigger_type, readout_type, start, end):
+            Returns the event ids that match the provided metadata filters
     """
 
     def __init__(self):
         self.channels = []
+        self.dataset = None
+        self._dataset_lock = threading.Lock()
         self.eventIDs: List[str] = []
         self.detectorIDs: List[str] = []
         self.detector_to_bounds: DefaultDict[str, List] = defaultdict(List)
-        self.event_to_metadata: DefaultDict[str, EventMetadata] = defaultdict(
-            EventMetadata
-        )
+        self.event_to_detectors: DefaultDict[str, List[str]] = defaultdict(list)
+        self.channel_index = _parse_channel_index_rows([])
+        self.events = EventTable()
 
     def _reset(self):
         self.channels = []
+        self.dataset = None
+        self._dataset_lock = threading.Lock()
         self.eventIDs: List[str] = []
         self.detectorIDs: List[str] = []
         self.detector_to_bounds: DefaultDict[str, List] = defaultdict(List)
-        self.event_to_metadata: DefaultDict[str, EventMetadata] = defaultdict(
-            EventMetadata
-        )
+        self.event_to_detectors: DefaultDict[str, List[str]] = defaultdict(list)
+        self.channel_index = _parse_channel_index_rows([])
+        self.events = EventTable()
 
     def __str__(self):
-        return f"channels: {len(self.channels)}, detector->bound: {len(self.detector_to_bounds)}, event->metadata: {len(self.event_to_metadata)}"
+        return f"channels: {len(self.channels)}, detector->bound: {len(self.detector_to_bounds)}, events: {len(self.events)}"
+
+    @property
+    def event_to_metadata(self) -> Dict[str, EventMetadata]:
+        """
+        Deprecated, the mapping from event ID to their associated metadata(trigger_type, readout_type, global_timestamp).
+        The mapping is built from the event table on every access, use get_event_metadata or filter_events instead
+        """
+        warnings.warn(
+            "CDMS.event_to_metadata is deprecated, use CDMS.get_event_metadata or CDMS.filter_events instead",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        return {str(event_id): self.events.get(event_id) for event_id in self.events.event_ids.tolist()}
 
-    def _load_from_dir(self, filepath: str):
+    def _load_from_dir(self, filepath: str, lazy: bool = False):
         """
         Loads all CDMS data from a directory of processed data.
+        When lazy is set, the idx dataset is only opened and channel rows are read on demand.
+        When the mid was transcoded (see transcode_channels) and the channel store is up to date, the channel data is memory
+        mapped from it instead, in both modes.
         NOTE: when loading the data of all processed files, the directory that contains the idx must be organized as follows
 
         dir/
@@ -121,24 +329,37 @@ class CDMS:
                 sp = name.split(".")
                 ext = sp[1] if len(sp) == 2 else ""
                 if ext == "idx":
-                    self.channels = _load_channel_data(os.path.join(filepath, name))
+                    store = _read_sidecar(os.path.join(filepath, name))
+                    if store is not None:
+                        self.channels = store
+                    elif lazy:
+                        self.dataset = ov.LoadDataset(os.path.join(filepath, name))
+                    else:
+                        self.channels = _load_channel_data(os.path.join(filepath, name))
                 elif ext == "csv":
-                    self.event_to_metadata = _create_event_metadata_map(
-                        os.path.join(filepath, name)
-                    )
-                    # set the list of all the event ids
-                    for k in self.event_to_metadata.keys():
-                        self.eventIDs.append(k)
+                    self._set_event_index(_load_event_index(os.path.join(filepath, name)))
                 elif ext == "txt":
-                    self.detector_to_bounds = _create_channel_metadata_map(
-                        os.path.join(filepath, name)
-                    )
-                    # set the list of all detector ids
-                    for k in self.detector_to_bounds.keys():
-                        self.detectorIDs.append(k)
+                    self._set_channel_index(_load_channel_index(os.path.join(filepath, name)))
                 else:
                     continue
 
+    def _set_event_index(self, index: numpy.ndarray):
+        """
+        Sets the event metadata from an event index (see _load_event_index)
+        """
+        self.events = EventTable.from_index(index)
+        # set the list of all the event ids
+        self.eventIDs = [str(k) for k in self.events.event_ids.tolist()]
+
+    def _set_channel_index(self, index: numpy.ndarray):
+        """
+        Sets the channel metadata maps from a channel index (see _load_channel_index)
+        """
+        self.channel_index = index
+        self.detector_to_bounds, self.event_to_detectors = _create_channel_maps(index)
+        # set the list of all detector ids
+        self.detectorIDs = list(self.detector_to_bounds.keys())
+
     def get_event_ids(self) -> List[str]:
         """
         Returns all the event ids
@@ -171,9 +392,13 @@ class CDMS:
             A list of all channel data for all detectors across all events
         """
 
+        if self.dataset is not None:
+            with self._dataset_lock:
+                return self.dataset.read(field="data")
+
         return self.channels
 
-    def get_detector_channels(self, detector_id: str):
+    def get_detector_channels(self, detector_id: str, quality: int = 0, window: Union[Tuple[int, int], None] = None):
         """
         Returns all the channel data associated with an specific detector id. A detector id is composed of the following
         <event_id>_<detector_number>_<type>_<channel_num>
@@ -182,18 +407,105 @@ class CDMS:
         ----------
         detector_id
             The detector ID, i.e, 10000_0_Phonon_4096
+        quality: int
+            The resolution of the waveforms, 0 is full resolution and every step below halves the samples, i.e, -2 keeps every 4th sample.
+            In lazy mode the coarse levels of the idx hierarchy are read, so only a fraction of the data is decoded (see _resolution_plan)
+        window: Tuple[int, int] | None
+            The sample range [t0,t1) to return, all the samples when None
 
         Returns
         -------
         List
             A list containing all the channels associated with the detector id. An empty list is returned if the provided detector ID is invalid
+            The samples returned are located at sample_positions(t0, t1, quality)
         """
 
         if detector_id not in self.detector_to_bounds:
             return []
 
         bounds = self.detector_to_bounds[detector_id]
-        return self.channels[bounds[0]:bounds[1]]
+        if self.dataset is not None:
+            with self._dataset_lock:
+                return _read_channel_rows(self.dataset, bounds[0], bounds[1], quality, window)
+
+        if quality == 0 and window is None:
+            return self.channels[bounds[0]:bounds[1]]
+        return _decimate(self.channels[bounds[0]:bounds[1]], quality, window)
+
+    def get_channels_for(
+        self,
+        event_ids: Sequence[Union[str, int]],
+        detectors: Union[Sequence[int], None] = None,
+        quality: int = 0,
+        window: Union[Tuple[int, int], None] = None,
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Returns the channel data of all the detectors of several events stacked in a single array. The rows to gather are computed
+        from the channel index without a Python loop, and in lazy mode contiguous rows are read with a single box query.
+
+        Parameters
+        ----------
+        event_ids: Sequence[str | int]
+            The event IDs, i.e, ["10000", "10001"]
+        detectors: Sequence[int] | None
+            The detector numbers to keep, i.e, [0, 2]. All detectors are kept when None
+        quality: int
+            The resolution of the waveforms, see get_detector_channels
+        window: Tuple[int, int] | None
+            The sample range [t0,t1) to return, all the samples when None
+
+        Returns
+        -------
+        Tuple[numpy.ndarray, numpy.ndarray]
+            The channel data (one row per channel, in file order) and the index array with the fields event, detector, channel
+            (the channel number within the detector), and row (the row in the channel data of the mid file) for every returned row
+        """
+        mask = numpy.isin(self.channel_index["event"], numpy.asarray(event_ids).astype("<i8"))
+        if detectors is not None:
+            mask &= numpy.isin(self.channel_index["detector"], numpy.asarray(detectors).astype("<i4"))
+        selected = self.channel_index[mask]
+
+        lengths = selected["hi"] - selected["lo"]
+        offsets = numpy.cumsum(lengths) - lengths
+        channel = numpy.arange(int(lengths.sum()), dtype="<i8") - numpy.repeat(offsets, lengths)
+        rows = numpy.repeat(selected["lo"], lengths) + channel
+
+        index = numpy.empty(len(rows), dtype=CHANNEL_ROW_DTYPE)
+        index["event"] = numpy.repeat(selected["event"], lengths)
+        index["detector"] = numpy.repeat(selected["detector"], lengths)
+        index["channel"] = channel
+        index["row"] = rows
+
+        return self._read_rows(rows, quality, window), index
+
+    def _read_rows(self, rows: numpy.ndarray, quality: int = 0, window: Union[Tuple[int, int], None] = None) -> numpy.ndarray:
+        """
+        Returns the channel data of the given rows, in lazy mode contiguous rows are read with a single box query
+
+        Parameters
+        ----------
+        rows: numpy.ndarray
+            The row numbers in the channel data
+        quality: int
+            The resolution of the waveforms, see get_detector_channels
+        window: Tuple[int, int] | None
+            The sample range [t0,t1) to return, all the samples when None
+
+        Returns
+        -------
+        numpy.ndarray
+            The channel data of the rows, in the given order
+        """
+        if self.dataset is not None:
+            (x0, _), (x1, _) = self.dataset.getLogicBox()
+            with self._dataset_lock:
+                runs = [_read_channel_rows(self.dataset, lo, hi, quality, window) for lo, hi in _coalesce_rows(rows)]
+            if runs:
+                return numpy.concatenate(runs)
+            return numpy.empty((0, len(sample_positions(x0, x1, quality, window))), dtype=numpy.uint16)
+        if len(self.channels) == 0:
+            return numpy.empty((0, 0), dtype=numpy.uint16)
+        return _decimate(self.channels[rows], quality, window)
 
     def get_event_metadata(self, event_id: str) -> Union[EventMetadata, None]:
         """
@@ -209,10 +521,35 @@ class CDMS:
         EventMetadata | None
             The EventMetadata object (trigger_type, readout_type, global_timestamp) or None if the provided ID is invalid
         """
-        if event_id not in self.event_to_metadata:
-            return None
+        return self.events.get(event_id)
+
+    def filter_events(
+        self,
+        trigger_type: Union[str, None] = None,
+        readout_type: Union[str, None] = None,
+        start: Union[int, datetime, None] = None,
+        end: Union[int, datetime, None] = None,
+    ) -> numpy.ndarray:
+        """
+        Returns the event ids that match all the provided metadata filters, i.e, all Physics triggers between t0 and t1
 
-        return self.event_to_metadata[event_id]
+        Parameters
+        ----------
+        trigger_type: str | None
+            Only keep events with this trigger type, i.e, Physics
+        readout_type: str | None
+            Only keep events with this readout type
+        start: int | datetime | None
+            Only keep events recorded at or after this time (epoch seconds or datetime)
+        end: int | datetime | None
+            Only keep events recorded before this time (epoch seconds or datetime)
+
+        Returns
+        -------
+        numpy.ndarray
+            The matching event ids (int64)
+        """
+        return self.events.filter(trigger_type, readout_type, start, end)
 
     def get_detectors_by_event(self, event_id: str) -> List[str]:
         """
@@ -228,11 +565,84 @@ class CDMS:
         List[str]
             A list containing all the detector ids associated with the event ID
         """
-        detector_ids = []
-        for k in self.detector_to_bounds.keys():
-            if k.startswith(event_id):
-                detector_ids.append(k)
-        return detector_ids
+        if event_id not in self.event_to_detectors:
+            return []
+
+        return list(self.event_to_detectors[event_id])
+
+
+class EventChunk:
+    """EventChunk bundles a fixed number of consecutive events of a mid file, as yielded by iter_events
+
+    Attributes
+    ----------
+        channels: numpy.ndarray
+            The channel data of all the detectors of the events in the chunk
+        event_ids: List[str]
+            The event ids in the chunk, in file order
+        detector_ids: List[str]
+            The detector ids in the chunk, in file order
+        detector_to_bounds: Dict[str, List]
+            The mapping from detector to the bounds [lo,hi) of its channels in the chunk channels
+        events: EventTable
+            The metadata table of the mid file
+
+    Methods
+    -------
+        get_detector_channels(detector_id):
+            Returns all channel data associated with an specific detector_id of the chunk
+        get_event_metadata(event_id):
+            Returns the metadata associated with an specific event id
+    """
+
+    def __init__(self, channels: numpy.ndarray, index: numpy.ndarray, events: EventTable):
+        lo = int(index["lo"].min()) if len(index) > 0 else 0
+        self.channels = channels
+        self.detector_ids: List[str] = [d.decode() for d in index["detector_id"].tolist()]
+        self.event_ids: List[str] = list(dict.fromkeys(str(e) for e in index["event"].tolist()))
+        self.detector_to_bounds: Dict[str, List] = {
+            d: [b - lo, e - lo] for d, b, e in zip(self.detector_ids, index["lo"].tolist(), index["hi"].tolist())
+        }
+        self.events = events
+
+    def __str__(self):
+        return f"events: {len(self.event_ids)}, detectors: {len(self.detector_ids)}, channels: {len(self.channels)}"
+
+    def get_detector_channels(self, detector_id: str):
+        """
+        Returns all the channel data associated with an specific detector id of the chunk
+
+        Parameters
+        ----------
+        detector_id
+            The detector ID, i.e, 10000_0_Phonon_4096
+
+        Returns
+        -------
+        List
+            A list containing all the channels associated with the detector id. An empty list is returned if the detector is not in the chunk
+        """
+        if detector_id not in self.detector_to_bounds:
+            return []
+
+        bounds = self.detector_to_bounds[detector_id]
+        return self.channels[bounds[0]:bounds[1]]
+
+    def get_event_metadata(self, event_id: str) -> Union[EventMetadata, None]:
+        """
+        Returns the metadata associated with an event
+
+        Parameters
+        ----------
+        event_id: str
+            The event ID, i.e, 10000
+
+        Returns
+        -------
+        EventMetadata | None
+            The EventMetadata object (trigger_type, readout_type, global_timestamp) or None if the provided ID is invalid
+        """
+        return self.events.get(event_id)
 
 
 #################################
@@ -246,6 +656,7 @@ def _create_channel_metadata_map(filepath: str) -> DefaultDict[str, List]:
 
     This creates the detector to channel dictionary, i.e, 10000_0_Phonon_4096 refers to detector number 0 of event ID 10000.
     The entry on the dictionary would be as follows detector_to_bounds[10000_0_Phonon_4096] = [0,4] where the channels associated to detector number 0 of event ID 10000 are located in rows [0-4) of the channel data.
+    The map is built from the channel index (see _load_channel_index), so the text file is only parsed the first time it is seen.
 
     Parameters
     ----------
@@ -257,20 +668,120 @@ def _create_channel_metadata_map(filepath: str) -> DefaultDict[str, List]:
     DefaultDict[str, List]
         The dictionary associating detectors with the bounds [lo,hi) where its channels are located
     """
+    detector_to_bounds, _ = _create_channel_maps(_load_channel_index(filepath))
+    return detector_to_bounds
+
+
+def _create_channel_maps(index: numpy.ndarray) -> Tuple[DefaultDict[str, List], DefaultDict[str, List[str]]]:
+    """
+    Creates the detector to bounds map and the event to detectors map from a channel index in a single pass.
+
+    Parameters
+    ----------
+    index: numpy.ndarray
+        The channel index with the fields detector_id, event, detector, lo, hi
+
+    Returns
+    -------
+    Tuple[DefaultDict[str, List], DefaultDict[str, List[str]]]
+        The dictionary associating detectors with the bounds [lo,hi) where its channels are located, and the dictionary associating
+        an event ID with its detector ids in file order
+    """
     detector_to_bounds = defaultdict(list)
+    event_to_detectors = defaultdict(list)
+    for detector_name, event_id, lo, hi in zip(
+        index["detector_id"].tolist(), index["event"].tolist(), index["lo"].tolist(), index["hi"].tolist()
+    ):
+        detector_name = detector_name.decode()
+        detector_to_bounds[detector_name] = [lo, hi]
+        event_to_detectors[str(event_id)].append(detector_name)
+    return detector_to_bounds, event_to_detectors
+
+
+def _format_timestamp(timestamp: int) -> str:
+    """
+    Formats a global timestamp (epoch seconds), i.e, 1533761883 -> Wednesday, August 08, 2018 08:58:03 PM UTC
+    """
+    dt = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    return dt.strftime("%A, %B %d, %Y %I:%M:%S %p UTC")
+
+
+def _to_epoch(t: Union[int, datetime]) -> int:
+    """
+    Converts a time bound (epoch seconds or datetime) to epoch seconds
+    """
+    return int(t.timestamp()) if isinstance(t, datetime) else int(t)
+
+
+def _categorize(values: numpy.ndarray):
+    """
+    Encodes a column of byte strings as categorical codes
+
+    Parameters
+    ----------
+    values: numpy.ndarray
+        The byte string column, i.e, index["trigger_type"]
+
+    Returns
+    -------
+    Tuple[List[str], numpy.ndarray]
+        The categories and the code of each value (an index into the categories)
+    """
+    categories, codes = numpy.unique(values, return_inverse=True)
+    dtype = numpy.uint8 if len(categories) <= 256 else numpy.uint32
+    return [c.decode() for c in categories.tolist()], codes.reshape(-1).astype(dtype)
+
+
+def _category_mask(categories: List[str], codes: numpy.ndarray, value: str) -> numpy.ndarray:
+    """
+    Returns the boolean mask of the codes that encode a category value, all False if the value is not a category
+    """
+    if value not in categories:
+        return numpy.zeros(len(codes), dtype=bool)
+    return codes == categories.index(value)
+
+
+###############################
+### SIDECAR INDEX FUNCTIONS ###
+###############################
+
+
+def _parse_channel_index(filepath: str) -> numpy.ndarray:
+    """
+    Parses a channel metadata file (mid_id.txt) into a structured array with the fields detector_id, event, detector, lo, hi.
+
+    Parameters
+    ----------
+    filepath: str
+        The filepath to the channels metadata file, i.e, dir1/dir2/07180808_1558_F0001.txt
+
+    Returns
+    -------
+    numpy.ndarray
+        The channel index, one record per detector in file order
+    """
+    rows = []
     with open(filepath, "r") as f:
         for line in f:
             detector_name, lo, hi = line.split(" ")
-            detector_to_bounds[detector_name].append(int(lo))
-            detector_to_bounds[detector_name].append(int(hi))
-    f.close()
-    return detector_to_bounds
+            event_id, detector_num = detector_name.split("_")[:2]
+            rows.append((detector_name, int(event_id), int(detector_num), int(lo), int(hi)))
+    return _parse_channel_index_rows(rows)
 
 
-def _create_event_metadata_map(filepath: str) -> DefaultDict[str, EventMetadata]:
+def _parse_channel_index_rows(rows: List[Tuple[str, int, int, int, int]]) -> numpy.ndarray:
     """
-    Creates the event metadata map from a event metadata file (mid_id.csv).
-    Event metadata includes: Trigger Type, Readout Type, Global Timestamp
+    Builds a channel index from (detector_id, event, detector, lo, hi) rows
+    """
+    width = max((len(r[0]) for r in rows), default=1)
+    dtype = numpy.dtype([("detector_id", f"S{width}"), ("event", "<i8"), ("detector", "<i4"), ("lo", "<i8"), ("hi", "<i8")])
+    return numpy.array(rows, dtype=dtype)
+
+
+def _parse_event_index(filepath: str) -> numpy.ndarray:
+    """
+    Parses an event metadata file (mid_id.csv) into a structured array with the fields event, trigger_type, readout_type, global_timestamp.
+    The global timestamp is kept as the raw epoch in seconds, MISSING_TIMESTAMP marks events without one.
 
     Parameters
     ----------
@@ -279,25 +790,157 @@ def _create_event_metadata_map(filepath: str) -> DefaultDict[str, EventMetadata]
 
     Returns
     -------
-    DefaultDict[str, EventMetadata]
-        The dictionary associating an event with its metadata.
+    numpy.ndarray
+        The event index, one record per event in file order
     """
-
-    mp = defaultdict(EventMetadata)
-    i = 0
-    headers = []
+    rows = []
     with open(filepath, "r") as f:
         reader = csv.reader(f)
+        headers = [h.strip() for h in next(reader, [])]
+        trigger_col = headers.index("trigger_type") if "trigger_type" in headers else -1
+        readout_col = headers.index("readout_type") if "readout_type" in headers else -1
+        timestamp_col = headers.index("global_timestamp") if "global_timestamp" in headers else -1
         for line in reader:
-            if i == 0:
-                headers = line
-            else:
-                evt_metadata = EventMetadata()
-                evt_metadata.extract(headers, line)
-                mp[line[0]] = evt_metadata
-            i += 1
-    f.close()
-    return mp
+            rows.append(
+                (
+                    int(line[0]),
+                    line[trigger_col].strip() if trigger_col >= 0 else "Unknown",
+                    line[readout_col].strip() if readout_col >= 0 else "None",
+                    int(line[timestamp_col].strip()) if timestamp_col >= 0 else MISSING_TIMESTAMP,
+                )
+            )
+
+    trigger_width = max((len(r[1]) for r in rows), default=1)
+    readout_width = max((len(r[2]) for r in rows), default=1)
+    dtype = numpy.dtype(
+        [("event", "<i8"), ("trigger_type", f"S{trigger_width}"), ("readout_type", f"S{readout_width}"), ("global_timestamp", "<i8")]
+    )
+    return numpy.array(rows, dtype=dtype)
+
+
+def _sidecar_path(filepath: str) -> str:
+    """
+    Returns the path of the binary sidecar index of a metadata file, i.e, dir1/07180808_1558_F0001.txt -> dir1/07180808_1558_F0001.txt.npy
+    """
+    return f"{filepath}.npy"
+
+
+def _source_stamp(filepath: str) -> numpy.ndarray:
+    """
+    Returns the stamp (sidecar version, size, mtime in ns) of a metadata file that a sidecar index must match to be reused.
+    The stamp of an idx also holds the size and mtime of every data file next to it (mid_id/0000.bin), which are re-downloaded
+    on their own
+    """
+    st = os.stat(filepath)
+    stamp = [SIDECAR_VERSION, st.st_size, st.st_mtime_ns]
+    data_dir = os.path.splitext(filepath)[0]
+    if filepath.endswith(".idx") and os.path.isdir(data_dir):
+        for name in sorted(os.listdir(data_dir)):
+            st = os.stat(os.path.join(data_dir, name))
+            stamp += [st.st_size, st.st_mtime_ns]
+    return numpy.array(stamp, dtype="<i8")
+
+
+def _read_sidecar(filepath: str) -> Union[numpy.ndarray, None]:
+    """
+    Reads the sidecar index of a metadata file. The sidecar holds two npy arrays back to back, the source stamp and the index itself.
+    The index is memory mapped.
+
+    Parameters
+    ----------
+    filepath: str
+        The filepath to the metadata file (not the sidecar)
+
+    Returns
+    -------
+    numpy.ndarray | None
+        The read-only index or None if the sidecar is missing, unreadable, or stale
+    """
+    path = _sidecar_path(filepath)
+    try:
+        with open(path, "rb") as f:
+            stamp = numpy.lib.format.read_array(f)
+            if not numpy.array_equal(stamp, _source_stamp(filepath)):
+                return None
+            numpy.lib.format.read_magic(f)
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(f)
+            offset = f.tell()
+    except (OSError, ValueError):
+        return None
+
+    if fortran_order:
+        return None
+    if shape[0] == 0:
+        return numpy.empty(shape, dtype=dtype)
+    return numpy.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+
+def _write_sidecar(filepath: str, index: numpy.ndarray):
+    """
+    Writes the sidecar index of a metadata file. The sidecar is written to a temporary file and moved into place, failures
+    (i.e, a read-only directory) are ignored since the sidecar is only an accelerator.
+
+    Parameters
+    ----------
+    filepath: str
+        The filepath to the metadata file (not the sidecar)
+    index: numpy.ndarray
+        The parsed index of the metadata file
+    """
+    path = _sidecar_path(filepath)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            numpy.lib.format.write_array(f, _source_stamp(filepath), version=(1, 0))
+            numpy.lib.format.write_array(f, index, version=(1, 0))
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _load_channel_index(filepath: str) -> numpy.ndarray:
+    """
+    Loads the channel index of a channel metadata file (mid_id.txt) from its sidecar, parsing the text and writing the sidecar
+    when it is missing or stale (the size or mtime of the text file changed).
+
+    Parameters
+    ----------
+    filepath: str
+        The filepath to the channels metadata file, i.e, dir1/dir2/07180808_1558_F0001.txt
+
+    Returns
+    -------
+    numpy.ndarray
+        The channel index with the fields detector_id, event, detector, lo, hi
+    """
+    index = _read_sidecar(filepath)
+    if index is None:
+        index = _parse_channel_index(filepath)
+        _write_sidecar(filepath, index)
+    return index
+
+
+def _load_event_index(filepath: str) -> numpy.ndarray:
+    """
+    Loads the event index of an event metadata file (mid_id.csv) from its sidecar, parsing the csv and writing the sidecar
+    when it is missing or stale (the size or mtime of the csv file changed).
+
+    Parameters
+    ----------
+    filepath: str
+        The filepath to the event metadata file. i.e, dir1/dir2/07180808_1558_F0001.csv
+
+    Returns
+    -------
+    numpy.ndarray
+        The event index with the fields event, trigger_type, readout_type, global_timestamp
+    """
+    index = _read_sidecar(filepath)
+    if index is None:
+        index = _parse_event_index(filepath)
+        _write_sidecar(filepath, index)
+    return index
 
 
 #############################
@@ -305,6 +948,49 @@ def _create_event_metadata_map(filepath: str) -> DefaultDict[str, EventMetadata]
 #############################
 
 
+def _block_rows(dataset) -> int:
+    """
+    Returns the number of rows spanned by one idx block, given by the y bits in the last bitsperblock bits of the dataset bitmask.
+    Reading rows in multiples of this number decodes each block only once.
+
+    Parameters
+    ----------
+    dataset: ov.PyDataset
+        The open idx dataset
+
+    Returns
+    -------
+    int
+        The rows spanned by one block
+    """
+    bitmask = dataset.db.getBitmask().toString()[1:]
+    bitsperblock = dataset.db.getDefaultBitsPerBlock()
+    return 2 ** bitmask[-bitsperblock:].count("1")
+
+
+def _coalesce_rows(rows: numpy.ndarray) -> List[Tuple[int, int]]:
+    """
+    Coalesces row numbers into contiguous [lo,hi) runs, i.e, [0,1,2,3,8,9] -> [(0,4), (8,10)]
+
+    Parameters
+    ----------
+    rows: numpy.ndarray
+        The row numbers
+
+    Returns
+    -------
+    List[Tuple[int, int]]
+        The contiguous runs of rows
+    """
+    if len(rows) == 0:
+        return []
+
+    breaks = numpy.flatnonzero(numpy.diff(rows) != 1) + 1
+    starts = numpy.concatenate(([0], breaks))
+    ends = numpy.concatenate((breaks, [len(rows)]))
+    return list(zip(rows[starts].tolist(), (rows[ends - 1] + 1).tolist()))
+
+
 def _load_channel_data(filepath: str) -> numpy.ndarray:
     """
     Loads the channels data from an idx file. Usually is used in conjunction with create_channel_metadata_map to map detector to channels
@@ -330,7 +1016,122 @@ def _load_channel_data(filepath: str) -> numpy.ndarray:
     return dataset  # type: ignore
 
 
-def load_all_data(filepath: str) -> CDMS:
+def _read_channel_rows(
+    dataset, lo: int, hi: int, quality: int = 0, window: Union[Tuple[int, int], None] = None
+) -> numpy.ndarray:
+    """
+    Reads the channel rows [lo,hi) from an open idx dataset with a logic box query, only the blocks intersecting the rows are decoded.
+
+    Parameters
+    ----------
+    dataset: ov.PyDataset
+        The open idx dataset, i.e, ov.LoadDataset(dir1/dir2/07180808_1558_F0001.idx)
+    lo: int
+        The first row to read
+    hi: int
+        The row after the last row to read
+    quality: int
+        The resolution of the waveforms, 0 is full resolution and every step below halves the samples
+    window: Tuple[int, int] | None
+        The sample range [t0,t1) to read, all the samples when None
+
+    Returns
+    -------
+    numpy.ndarray
+        The channel data in rows [lo,hi), the samples are located at sample_positions(t0, t1, quality)
+    """
+
+    (x0, _), (x1, _) = dataset.getLogicBox()
+    if window is not None:
+        x0, x1 = max(x0, window[0]), min(x1, window[1])
+
+    levels = _resolution_plan(dataset.db.getBitmask().toString(), quality)
+    read_stride, stride = 2**levels, 2**-quality
+    first = -(-x0 // read_stride) * read_stride
+    if first >= x1:
+        # the window holds no sample at this resolution
+        return numpy.empty((hi - lo, 0), dtype=numpy.uint16)
+
+    data = dataset.read(field="data", logic_box=[[x0, lo], [x1, hi]], quality=-levels)
+    # the levels the idx hierarchy could not drop without dropping rows are decimated here
+    if stride > read_stride:
+        data = data[:, ((-first) % stride) // read_stride::stride // read_stride]
+    return data  # type: ignore
+
+
+def _resolution_plan(bitmask: str, quality: int) -> int:
+    """
+    Returns the number of levels of the idx hierarchy to drop to read waveforms at a given quality.
+
+    Each level of the hierarchy halves one axis, given by the bitmask from the end (0 halves the samples, 1 halves the rows).
+    Only the trailing sample levels can be dropped since dropping a row level would drop channels, i.e, with the bitmask V...0100
+    quality -3 drops 2 levels and the last halving is done after the read. The R76 layout (V...0111) ends with row levels, so its
+    waveforms are read at full resolution and decimated after the read.
+
+    Parameters
+    ----------
+    bitmask: str
+        The bitmask of the dataset, i.e, V01010101010101010101010111
+    quality: int
+        The resolution of the waveforms, 0 is full resolution and every step below halves the samples
+
+    Returns
+    -------
+    int
+        The number of levels to drop
+    """
+    if quality > 0:
+        raise ValueError(f"quality must be 0 or negative, got {quality}")
+
+    levels = 0
+    for bit in reversed(bitmask.lstrip("V")):
+        if levels == -quality or bit != "0":
+            break
+        levels += 1
+    return levels
+
+
+def _decimate(channels: numpy.ndarray, quality: int = 0, window: Union[Tuple[int, int], None] = None) -> numpy.ndarray:
+    """
+    Decimates channel data held in memory the same way the idx hierarchy does, see _read_channel_rows
+    """
+    if quality > 0:
+        raise ValueError(f"quality must be 0 or negative, got {quality}")
+
+    x0, x1 = 0, channels.shape[1]
+    if window is not None:
+        x0, x1 = max(x0, window[0]), min(x1, window[1])
+    stride = 2**-quality
+    return channels[:, x0:x1][:, (-x0) % stride::stride]
+
+
+def sample_positions(t0: int, t1: int, quality: int = 0, window: Union[Tuple[int, int], None] = None) -> numpy.ndarray:
+    """
+    Returns the sample positions (in 20ns intervals) of waveforms read at a given quality and window
+
+    Parameters
+    ----------
+    t0: int
+        The first sample of the waveforms, usually 0
+    t1: int
+        The number of samples of the waveforms at full resolution, i.e, 4096
+    quality: int
+        The resolution of the waveforms, 0 is full resolution and every step below halves the samples
+    window: Tuple[int, int] | None
+        The sample range [t0,t1) that was read, all the samples when None
+
+    Returns
+    -------
+    numpy.ndarray
+        The position of every returned sample
+    """
+    if window is not None:
+        t0, t1 = max(t0, window[0]), min(t1, window[1])
+    stride = 2**-quality
+    return numpy.arange(-(-t0 // stride) * stride, t1, stride)
+
+
+def load_all_data(filepath: str, lazy: bool = False) -> CDMS:
     """
     Returns the CDMS object that contains: channel data, channel metadata, and event metadata.
     NOTE: when loading the data of all processed files, the directory that contains the idx must be organized as follows
@@ -346,6 +1147,8 @@ def load_all_data(filepath: str) -> CDMS:
     ----------
     filepath
         The filepath to the directory with all the processed files
+    lazy
+        When True, the idx dataset is kept open and only the rows of the requested detectors are read, instead of loading all the channel data up front
 
     Returns
     -------
@@ -354,5 +1157,127 @@ def load_all_data(filepath: str) -> CDMS:
     """
 
     data = CDMS()
-    data._load_from_dir(filepath)
+    data._load_from_dir(filepath, lazy)
     return data
+
+
+def iter_events(filepath: str, chunk_size: int = 256) -> Iterator[EventChunk]:
+    """
+    Streams the events of a mid file in chunks of chunk_size events, so memory stays bounded no matter how large the file is.
+    The idx is read in row windows aligned to its block layout (see _block_rows), rows of a window that belong to the next chunk are
+    kept for it instead of being decoded again.
+    NOTE: the directory that contains the idx must be organized as described in load_all_data
+
+    Parameters
+    ----------
+    filepath: str
+        The filepath to the directory with all the processed files
+    chunk_size: int
+        The number of events per chunk
+
+    Returns
+    -------
+    Iterator[EventChunk]
+        The chunks of events in file order
+    """
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1, got {chunk_size}")
+
+    data = CDMS()
+    data._load_from_dir(filepath, lazy=True)
+    if len(data.channel_index) == 0:
+        return
+
+    # the channel index is grouped by event, find where each event starts
+    index = data.channel_index
+    starts = numpy.flatnonzero(numpy.concatenate(([True], index["event"][1:] != index["event"][:-1])))
+    bounds = numpy.concatenate((starts[::chunk_size], [len(index)]))
+
+    if data.dataset is None:
+        # the channel store is memory mapped, chunks are views of it
+        if len(data.channels) == 0:
+            return
+        for g0, g1 in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            chunk = index[g0:g1]
+            yield EventChunk(data.channels[int(chunk["lo"].min()):int(chunk["hi"].max())], chunk, data.events)
+        return
+
+    (x0, _), (x1, total_rows) = data.dataset.getLogicBox()
+    block_rows = _block_rows(data.dataset)
+
+    buffer = numpy.empty((0, x1 - x0), dtype=numpy.uint16)
+    buf_lo = 0
+    for g0, g1 in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        chunk = index[g0:g1]
+        lo, hi = int(chunk["lo"].min()), int(chunk["hi"].max())
+
+        # drop the buffered rows that come before this chunk
+        if lo >= buf_lo + len(buffer):
+            buffer, buf_lo = buffer[:0], lo
+        elif lo > buf_lo:
+            buffer, buf_lo = buffer[lo - buf_lo:], lo
+
+        buf_hi = buf_lo + len(buffer)
+        if hi > buf_hi:
+            read_hi = min(-(-hi // block_rows) * block_rows, total_rows)
+            buffer = numpy.concatenate((buffer, _read_channel_rows(data.dataset, buf_hi, read_hi)))
+
+        yield EventChunk(buffer[lo - buf_lo:hi - buf_lo], chunk, data.events)
+
+
+def transcode_channels(filepath: str) -> str:
+    """
+    Transcodes the channel data of a mid file into an uncompressed channel store next to its idx, i.e, dir1/mid_id/mid_id.idx.npy.
+    Once transcoded, load_all_data and iter_events memory map the channel data from the store instead of decompressing the idx,
+    so repeated jobs over the same mid read it without copies. The store is stamped with the idx it was transcoded from and is
+    ignored once the idx changes. The idx is read TRANSCODE_ROWS rows at a time, so memory stays bounded.
+    NOTE: the directory that contains the idx must be organized as described in load_all_data
+
+    Parameters
+    ----------
+    filepath: str
+        The filepath to the directory with all the processed files
+
+    Returns
+    -------
+    str
+        The path to the channel store
+    """
+    names = [name for name in os.listdir(filepath) if name.endswith(".idx")]
+    if not names:
+        raise FileNotFoundError(f"no idx file in {filepath}")
+
+    idx_path = os.path.join(filepath, names[0])
+    dataset = ov.LoadDataset(idx_path)
+    (x0, _), (x1, total_rows) = dataset.getLogicBox()
+    block_rows = _block_rows(dataset)
+    step = -(-TRANSCODE_ROWS // block_rows) * block_rows
+
+    first = _read_channel_rows(dataset, 0, min(step, total_rows))
+    shape = (total_rows, x1 - x0)
+
+    path = _sidecar_path(idx_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        # the same layout as the metadata sidecars, the source stamp followed by the channel data
+        with open(tmp_path, "wb") as f:
+            numpy.lib.format.write_array(f, _source_stamp(idx_path), version=(1, 0))
+            header = {"descr": numpy.lib.format.dtype_to_descr(first.dtype), "fortran_order": False, "shape": shape}
+            numpy.lib.format.write_array_header_1_0(f, header)
+            offset = f.tell()
+            f.truncate(offset + first.dtype.itemsize * shape[0] * shape[1])
+
+        if total_rows > 0:
+            store = numpy.memmap(tmp_path, dtype=first.dtype, mode="r+", offset=offset, shape=shape)
+            store[:len(first)] = first
+            for lo in range(len(first), total_rows, step):
+                hi = min(lo + step, total_rows)
+                store[lo:hi] = _read_channel_rows(dataset, lo, hi)
+            store.flush()
+            del store
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return path
@@ -0,0 +1,243 @@
+"""
+loader dark matter lib
+======================
+
+This module offers a map-style dataset over the detectors of many mid files and a prefetching batch loader for machine learning workflows.
+"""
+
+import random
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Iterator, List, Tuple, Union
+import numpy
+
+from .catalog import Catalog
+
+SAMPLE_DTYPE = numpy.dtype([("file", "<i4"), ("event", "<i8"), ("detector", "<i4"), ("lo", "<i8"), ("hi", "<i8")])
+
+
+class DetectorDataset:
+    """DetectorDataset is a map-style dataset with one sample per (mid file, event, detector). Samples are decoded lazily from the
+    idx files, so it can be wrapped by a torch.utils.data.Dataset or used with BatchLoader.
+
+    Attributes
+    ----------
+        catalog: Catalog
+            The catalog of the mid files
+        samples: numpy.ndarray
+            The samples with the fields file (an index into catalog.mid_ids), event, detector, lo, hi
+
+    Methods
+    -------
+        get_batch(indices):
+            Returns the channel data of several samples stacked in a single array
+    """
+
+    def __init__(
+        self,
+        source: Union[Catalog, str],
+        trigger_type: Union[str, None] = None,
+        detectors: Union[List[int], None] = None,
+    ):
+        """
+        Parameters
+        ----------
+        source: Catalog | str
+            The catalog or the root directory of the mid files, i.e, ./idx
+        trigger_type: str | None
+            Only keep the events with this trigger type, i.e, Physics
+        detectors: List[int] | None
+            Only keep these detector numbers, i.e, [0, 2]. All detectors are kept when None
+        """
+        self.catalog = source if isinstance(source, Catalog) else Catalog(source)
+
+        # the trigger filter runs on the event table of the catalog, no idx file is opened
+        triggered = self.catalog.filter_events(trigger_type=trigger_type) if trigger_type is not None else None
+        if triggered is not None:
+            # the matches are sorted by file, so the events of file i are triggered["event"][bounds[i]:bounds[i + 1]]
+            bounds = numpy.searchsorted(triggered["file"], numpy.arange(len(self.catalog.mid_ids) + 1))
+
+        samples = []
+        for file, mid_id in enumerate(self.catalog.mid_ids):
+            index = self.catalog.channel_indexes[mid_id]
+            mask = numpy.ones(len(index), dtype=bool)
+            if triggered is not None:
+                mask &= numpy.isin(index["event"], triggered["event"][bounds[file]:bounds[file + 1]])
+            if detectors is not None:
+                mask &= numpy.isin(index["detector"], numpy.asarray(detectors).astype("<i4"))
+
+            selected = index[mask]
+            file_samples = numpy.empty(len(selected), dtype=SAMPLE_DTYPE)
+            file_samples["file"] = file
+            for field in ("event", "detector", "lo", "hi"):
+                file_samples[field] = selected[field]
+            samples.append(file_samples)
+
+        self.samples = numpy.concatenate(samples) if samples else numpy.empty(0, dtype=SAMPLE_DTYPE)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, i: int) -> numpy.ndarray:
+        """
+        Returns the channel data of a sample
+
+        Parameters
+        ----------
+        i: int
+            The sample index
+
+        Returns
+        -------
+        numpy.ndarray
+            The channels of the detector of the sample
+        """
+        sample = self.samples[i]
+        data = self.catalog.get(self.catalog.mid_ids[sample["file"]])
+        return data._read_rows(numpy.arange(sample["lo"], sample["hi"]))
+
+    def get_batch(self, indices: Union[List[int], numpy.ndarray]) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Returns the channel data of several samples stacked in a single contiguous array. The rows of the samples of each file
+        are gathered together so contiguous rows are read with a single box query.
+
+        Parameters
+        ----------
+        indices: List[int] | numpy.ndarray
+            The sample indices
+
+        Returns
+        -------
+        Tuple[numpy.ndarray, numpy.ndarray]
+            The channel data with shape (samples, channels, samples per channel) and the samples records
+        """
+        samples = self.samples[numpy.asarray(indices, dtype=numpy.intp)]
+        lengths = samples["hi"] - samples["lo"]
+        if len(samples) > 0 and (lengths != lengths[0]).any():
+            raise ValueError("all the samples of a batch must have the same number of channels")
+
+        channels = int(lengths[0]) if len(samples) > 0 else 0
+        batch: Union[numpy.ndarray, None] = None
+        for file in numpy.unique(samples["file"]).tolist():
+            positions = numpy.flatnonzero(samples["file"] == file)
+            rows = (samples["lo"][positions][:, None] + numpy.arange(channels)).reshape(-1)
+            data = self.catalog.get(self.catalog.mid_ids[file])._read_rows(rows)
+            if batch is None:
+                batch = numpy.empty((len(samples), channels, data.shape[1]), dtype=data.dtype)
+            batch[positions] = data.reshape(len(positions), channels, -1)
+
+        if batch is None:
+            batch = numpy.empty((0, 0, 0), dtype=numpy.uint16)
+        return batch, samples
+
+
+class BatchLoader:
+    """BatchLoader iterates over a DetectorDataset in batches, decoding the next batches with a pool of workers while the
+    current one is consumed.
+
+    Samples are shuffled within buffers of consecutive samples (and the order of the buffers is shuffled), so each batch only
+    touches a few files and the reads stay local.
+
+    Attributes
+    ----------
+        dataset: DetectorDataset
+            The dataset to iterate over
+        batch_size: int
+            The number of samples per batch
+        shuffle: bool
+            Whether to shuffle the samples
+        buffer_size: int
+            The number of consecutive samples shuffled together
+        num_workers: int
+            The number of workers decoding batches
+        prefetch: int
+            The number of batches decoded ahead per worker
+        drop_last: bool
+            Whether to drop the last batch when it is smaller than batch_size
+        pin_memory: bool
+            Whether to return pinned torch tensors instead of numpy arrays, requires torch
+    """
+
+    def __init__(
+        self,
+        dataset: DetectorDataset,
+        batch_size: int = 32,
+        shuffle: bool = True,
+        buffer_size: int = 1024,
+        num_workers: int = 4,
+        prefetch: int = 2,
+        drop_last: bool = False,
+        pin_memory: bool = False,
+        seed: Union[int, None] = None,
+    ):
+        if batch_size < 1 or buffer_size < 1 or num_workers < 1 or prefetch < 1:
+            raise ValueError("batch_size, buffer_size, num_workers and prefetch must be at least 1")
+
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.num_workers = num_workers
+        self.prefetch = prefetch
+        self.drop_last = drop_last
+        self.pin_memory = pin_memory
+        self._rng = random.Random(seed)
+
+    def __len__(self):
+        n = len(self.dataset)
+        return n // self.batch_size if self.drop_last else -(-n // self.batch_size)
+
+    def _order(self) -> numpy.ndarray:
+        """
+        Returns the order of the samples for one epoch
+        """
+        order = numpy.arange(len(self.dataset))
+        if not self.shuffle:
+            return order
+
+        buffers = [order[i:i + self.buffer_size] for i in range(0, len(order), self.buffer_size)]
+        self._rng.shuffle(buffers)
+        for buffer in buffers:
+            self._rng.shuffle(buffer)
+        return numpy.concatenate(buffers) if buffers else order
+
+    def _batches(self) -> Iterator[numpy.ndarray]:
+        """
+        Returns the sample indices of every batch of one epoch
+        """
+        order = self._order()
+        for i in range(0, len(order), self.batch_size):
+            batch = order[i:i + self.batch_size]
+            if self.drop_last and len(batch) < self.batch_size:
+                return
+            yield batch
+
+    def _output(self, batch: numpy.ndarray):
+        """
+        Converts a decoded batch to the output format
+        """
+        batch = numpy.ascontiguousarray(batch)
+        if not self.pin_memory:
+            return batch
+
+        try:
+            import torch
+        except ImportError as e:
+            raise ImportError("pin_memory requires torch to be installed") from e
+        return torch.from_numpy(batch).pin_memory()
+
+    def __iter__(self) -> Iterator[Tuple[numpy.ndarray, numpy.ndarray]]:
+        pending: Deque[Future] = deque()
+        batches = self._batches()
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            for indices in batches:
+                pending.append(executor.submit(self.dataset.get_batch, indices))
+                if len(pending) >= self.num_workers * self.prefetch:
+                    break
+
+            while pending:
+                data, samples = pending.popleft().result()
+                indices = next(batches, None)
+                if indices is not None:
+                    pending.append(executor.submit(self.dataset.get_batch, indices))
+                yield self._output(data), samples
@@ -0,0 +1,53 @@
+import os
+import shutil
+import numpy
+import pytest
+import OpenVisus as ov
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "idx", "07180808_1558_F0001")
+
+
+def _copy_fixture_dir(root):
+    """Copies the checked-in mid directory under root, loading it writes sidecars and channel stores next to its files"""
+    mid_dir = os.path.join(str(root), os.path.basename(FIXTURE_DIR))
+    shutil.copytree(FIXTURE_DIR, mid_dir, ignore=shutil.ignore_patterns("*.npy"))
+    return mid_dir
+
+
+def _create_mid_dir(root, mid="07180808_1558_F0001", events=8, detectors=2, channels=4, samples=256, by_sample=False):
+    """Writes a synthetic mid directory (idx, txt, csv) where every sample encodes its row (or its position when by_sample is set)"""
+    mid_dir = os.path.join(str(root), mid)
+    os.makedirs(mid_dir, exist_ok=True)
+    rows = events * detectors * channels
+    if by_sample:
+        data = numpy.repeat(numpy.arange(samples, dtype=numpy.uint16)[None, :], rows, axis=0)
+    else:
+        data = numpy.repeat(numpy.arange(rows, dtype=numpy.uint16)[:, None], samples, axis=1)
+    db = ov.CreateIdx(url=os.path.join(mid_dir, f"{mid}.idx"), dims=[samples, rows], fields=[ov.Field("data", "uint16")], compression=["zip"])
+    db.write(data)
+
+    with open(os.path.join(mid_dir, f"{mid}.txt"), "w") as f:
+        for e in range(events):
+            for d in range(detectors):
+                lo = (e * detectors + d) * channels
+                f.write(f"{10000 + e}_{d}_Phonon_{samples} {lo} {lo + channels}\n")
+    with open(os.path.join(mid_dir, f"{mid}.csv"), "w") as f:
+        f.write("event,trigger_type,readout_type,global_timestamp\n")
+        for e in range(events):
+            f.write(f"{10000 + e},{'Physics' if e % 2 == 0 else 'Random'},None,{1533761883 + e}\n")
+    return mid_dir
+
+
+@pytest.fixture(scope="session")
+def create_mid_dir():
+    return _create_mid_dir
+
+
+@pytest.fixture(scope="session")
+def copy_fixture_dir():
+    return _copy_fixture_dir
+
+
+@pytest.fixture
+def fixture_dir(tmp_path):
+    return _copy_fixture_dir(tmp_path)
@@ -0,0 +1,102 @@
+import os
+import threading
+import numpy
+import pytest
+from nsdf_dark_matter.catalog import Catalog, discover_mid_dirs
+from nsdf_dark_matter.idx import transcode_channels
+
+
+@pytest.fixture(scope="module")
+def idx_root(tmp_path_factory, create_mid_dir):
+    root = tmp_path_factory.mktemp("idx")
+    for i in range(3):
+        create_mid_dir(root, mid=f"07180808_1558_F000{i + 1}", events=4 + i, samples=32)
+    os.makedirs(os.path.join(root, "not_a_mid"))
+    return str(root)
+
+
+class TestCatalog:
+    def test_discover_mid_dirs(self, idx_root):
+        assert discover_mid_dirs(idx_root) == ["07180808_1558_F0001", "07180808_1558_F0002", "07180808_1558_F0003"]
+        assert discover_mid_dirs(os.path.join(idx_root, "missing")) == []
+
+    @pytest.mark.parametrize("executor", ["thread", "process"])
+    def test_merged_events(self, idx_root, executor):
+        catalog = Catalog(idx_root, max_workers=2, executor=executor)
+        assert len(catalog) == 3
+        assert len(catalog.events) == 4 + 5 + 6
+        assert catalog.event_files.tolist() == [0] * 4 + [1] * 5 + [2] * 6
+
+    def test_filter_events_across_files(self, idx_root):
+        catalog = Catalog(idx_root, executor="thread")
+        refs = catalog.filter_events(trigger_type="Physics")
+
+        assert refs["file"].tolist() == [0, 0, 1, 1, 1, 2, 2, 2]
+        assert refs["event"].tolist() == [10000, 10002, 10000, 10002, 10004, 10000, 10002, 10004]
+        assert catalog.mid_ids[refs["file"][-1]] == "07180808_1558_F0003"
+
+    def test_get_cdms(self, idx_root):
+        catalog = Catalog(idx_root, executor="thread")
+        data = catalog.get("07180808_1558_F0002")
+
+        assert data is not None
+        assert data.dataset is not None
+        assert data.get_detector_channels("10004_1_Phonon_32")[0][0] == 36
+        assert catalog.get_event_metadata("07180808_1558_F0002", "10001").trigger_type == "Random"
+        assert catalog.get("07180808_1558_F0009") is None
+
+    def test_event_metadata_without_channel_data(self, idx_root):
+        """Event metadata is read from the loaded event index, without building the CDMS object"""
+        catalog = Catalog(idx_root, executor="thread")
+
+        assert catalog.get_event_metadata("07180808_1558_F0003", "10005").trigger_type == "Random"
+        assert catalog.get_event_metadata("07180808_1558_F0003", "20000") is None
+        assert catalog.get_event_metadata("07180808_1558_F0009", "10000") is None
+        assert catalog._cdms == {}
+
+    def test_get_builds_outside_the_lock(self, idx_root, monkeypatch):
+        """A mid being built does not hold back callers of other mids, and callers of the same mid share the build"""
+        catalog = Catalog(idx_root, executor="thread")
+        build = catalog._build
+        started, release = threading.Event(), threading.Event()
+        builds = []
+
+        def slow_build(mid_id, lazy):
+            builds.append(mid_id)
+            if mid_id == "07180808_1558_F0001":
+                started.set()
+                release.wait(5)
+            return build(mid_id, lazy)
+
+        monkeypatch.setattr(catalog, "_build", slow_build)
+        results = []
+        waiters = [threading.Thread(target=lambda: results.append(catalog.get("07180808_1558_F0001"))) for _ in range(2)]
+        waiters[0].start()
+        assert started.wait(5)
+        waiters[1].start()
+
+        assert catalog.get("07180808_1558_F0002") is not None
+        release.set()
+        for waiter in waiters:
+            waiter.join(5)
+        assert builds == ["07180808_1558_F0001", "07180808_1558_F0002"]
+        assert len(results) == 2 and results[0] is results[1]
+
+    def test_get_transcoded_cdms(self, tmp_path, create_mid_dir):
+        """The channel store of a transcoded mid is memory mapped instead of opening the idx"""
+        mid_dir = create_mid_dir(tmp_path, events=4, samples=32)
+        transcode_channels(mid_dir)
+        data = Catalog(str(tmp_path), executor="thread").get("07180808_1558_F0001")
+
+        assert data.dataset is None
+        assert isinstance(data.channels, numpy.memmap)
+        assert data.get_detector_channels("10002_1_Phonon_32")[0][0] == 20
+
+    def test_empty_root(self, tmp_path):
+        catalog = Catalog(str(tmp_path))
+        assert len(catalog) == 0
+        assert len(catalog.filter_events(trigger_type="Physics")) == 0
+
+    def test_invalid_executor(self, idx_root):
+        with pytest.raises(ValueError):
+            Catalog(idx_root, executor="gpu")
@@ -1,13 +1,14 @@
 import os
+import numpy
 import pytest
-from nsdf_dark_matter.idx import load_all_data, EventMetadata, CDMS
-
+from nsdf_dark_matter import idx
+from nsdf_dark_matter.idx import load_all_data, iter_events, sample_positions, transcode_channels, EventMetadata, EventTable, CDMS
 
 @pytest.fixture(scope="class")
-def setup_cdms(request):
+def setup_cdms(request, tmp_path_factory, copy_fixture_dir):
     request.cls.event_metadata = EventMetadata()
     request.cls.cdms = CDMS()
-    request.cls.cdms._load_from_dir(os.path.abspath(os.path.join(os.path.dirname(__file__), "fixtures/idx/07180808_1558_F0001/")))
+    request.cls.cdms._load_from_dir(copy_fixture_dir(tmp_path_factory.mktemp("idx")))
     request.cls.headers = ["event_id", "trigger_type", "readout_type", "global_timestamp"]
     request.cls.expected = {
         "eventID": "10000",
@@ -38,6 +39,14 @@ class TestClassMethods:
         metadata = self.cdms.get_event_metadata("-1")
         assert metadata is None
 
+    def test_cdms_event_to_metadata_deprecated(self):
+        with pytest.warns(DeprecationWarning):
+            event_to_metadata = self.cdms.event_to_metadata
+
+        assert list(event_to_metadata.keys()) == self.cdms.get_event_ids()
+        assert event_to_metadata["10000"].trigger_type == self.expected["trigger_type"]
+        assert event_to_metadata["10000"].global_timestamp == self.expected["global_timestamp"]
+
     def test_cdms_get_detector_channels(self):
         channels = self.cdms.get_detector_channels("10000_0_Phonon_4096")
         assert channels is not None
@@ -84,8 +93,8 @@ class TestClassMethods:
 
 
 class TestDataLoaderFunctions:
-    def test_load_all_data(self):
-        data = load_all_data(os.path.abspath(os.path.join(os.path.dirname(__file__), "fixtures/idx/07180808_1558_F0001/")))
+    def test_load_all_data(self, fixture_dir):
+        data = load_all_data(fixture_dir)
         assert data is not None
         assert data.channels is not None
 
@@ -115,3 +124,283 @@ class TestDataLoaderFunctions:
         event_ids = data.get_event_ids()
         assert event_ids is not None
         assert len(event_ids) != 0
+
+
+class TestLazyLoading:
+    def test_lazy_detector_channels_match_eager(self, fixture_dir):
+        eager = load_all_data(fixture_dir)
+        lazy = load_all_data(fixture_dir, lazy=True)
+
+        assert lazy.dataset is not None
+        assert len(lazy.channels) == 0
+
+        for detector_id in [lazy.get_detector_ids()[0], lazy.get_detector_ids()[-1]]:
+            chan = lazy.get_detector_channels(detector_id)
+            assert chan.shape == (4, 4096)
+            assert (chan == eager.get_detector_channels(detector_id)).all()
+
+    def test_lazy_invalid_detector_channels(self, fixture_dir):
+        lazy = load_all_data(fixture_dir, lazy=True)
+        assert len(lazy.get_detector_channels("20000")) == 0
+
+
+class TestSidecarIndex:
+    @pytest.fixture
+    def mid_dir(self, tmp_path, copy_fixture_dir):
+        # the metadata only, the channel data is not needed
+        dst = tmp_path / os.path.basename(copy_fixture_dir(tmp_path))
+        os.remove(dst / "07180808_1558_F0001.idx")
+        return dst
+
+    def test_sidecar_written_on_first_load(self, mid_dir):
+        data = CDMS()
+        data._load_from_dir(str(mid_dir))
+        assert (mid_dir / "07180808_1558_F0001.txt.npy").exists()
+        assert (mid_dir / "07180808_1558_F0001.csv.npy").exists()
+
+    def test_sidecar_skips_text_parsing(self, mid_dir, monkeypatch):
+        first = CDMS()
+        first._load_from_dir(str(mid_dir))
+
+        def fail(_):
+            raise AssertionError("text parsed despite a valid sidecar")
+
+        monkeypatch.setattr(idx, "_parse_channel_index", fail)
+        monkeypatch.setattr(idx, "_parse_event_index", fail)
+
+        second = CDMS()
+        second._load_from_dir(str(mid_dir))
+        assert dict(second.detector_to_bounds) == dict(first.detector_to_bounds)
+        assert second.get_event_ids() == first.get_event_ids()
+        assert str(second.get_event_metadata("10000")) == str(first.get_event_metadata("10000"))
+
+    def test_sidecar_invalidated_when_source_changes(self, mid_dir):
+        txt = mid_dir / "07180808_1558_F0001.txt"
+        idx._load_channel_index(str(txt))
+
+        with open(txt, "a") as f:
+            f.write("99999_0_Phonon_4096 0 4\n")
+
+        index = idx._load_channel_index(str(txt))
+        assert index["detector_id"][-1] == b"99999_0_Phonon_4096"
+        assert index["event"][-1] == 99999
+
+
+class TestEventTable:
+    @pytest.fixture
+    def table(self):
+        index = numpy.array(
+            [(10000, b"Physics", b"None", 100), (10001, b"Random", b"None", 101), (10002, b"Physics", b"Full", 102), (9999, b"Physics", b"None", -1)],
+            dtype=[("event", "<i8"), ("trigger_type", "S7"), ("readout_type", "S4"), ("global_timestamp", "<i8")],
+        )
+        return EventTable.from_index(index)
+
+    def test_categorical_codes(self, table):
+        assert table.trigger_types == ["Physics", "Random"]
+        assert table.trigger_codes.tolist() == [0, 1, 0, 0]
+
+    def test_get_metadata_view(self, table):
+        metadata = table.get("10002")
+        assert metadata.trigger_type == "Physics"
+        assert metadata.readout_type == "Full"
+        assert table.get(9999).global_timestamp == "None"
+        assert table.get("10003") is None
+        assert table.get("abc") is None
+
+    def test_filter(self, table):
+        assert table.filter(trigger_type="Physics").tolist() == [10000, 10002, 9999]
+        assert table.filter(trigger_type="Physics", start=100, end=102).tolist() == [10000]
+        assert table.filter(readout_type="Full").tolist() == [10002]
+        assert table.filter(trigger_type="Unknown").tolist() == []
+
+    def test_cdms_filter_events(self, fixture_dir):
+        data = load_all_data(fixture_dir)
+        physics = data.filter_events(trigger_type="Physics", start=1533761883, end=1533761884)
+        assert len(physics) == 20
+        assert physics[0] == 10000
+
+
+class TestEventDetectorsIndex:
+    def test_detectors_by_event_exact_match(self, tmp_path):
+        with open(tmp_path / "07180808_1558_F0001.txt", "w") as f:
+            f.write("1000_0_Phonon_4096 0 4\n10000_0_Phonon_4096 4 8\n10000_2_Phonon_4096 8 12\n")
+
+        data = CDMS()
+        data._load_from_dir(str(tmp_path))
+        assert data.get_detectors_by_event("1000") == ["1000_0_Phonon_4096"]
+        assert data.get_detectors_by_event("10000") == ["10000_0_Phonon_4096", "10000_2_Phonon_4096"]
+        assert data.get_detectors_by_event("100") == []
+
+    def test_every_detector_indexed_once(self, fixture_dir):
+        data = load_all_data(fixture_dir)
+        indexed = [d for e in data.event_to_detectors for d in data.get_detectors_by_event(e)]
+        assert sorted(indexed) == sorted(data.get_detector_ids())
+
+
+class TestBatchedChannels:
+    def test_get_channels_for_events(self, fixture_dir):
+        data = load_all_data(fixture_dir)
+        channels, index = data.get_channels_for(["10000", "10001"])
+
+        assert channels.shape == (16, 4096)
+        assert index["event"].tolist() == [10000] * 8 + [10001] * 8
+        assert index["detector"].tolist() == ([0] * 4 + [2] * 4) * 2
+        assert index["channel"].tolist() == [0, 1, 2, 3] * 4
+        assert index["row"].tolist() == list(range(16))
+
+    def test_get_channels_for_detectors(self, fixture_dir):
+        data = load_all_data(fixture_dir)
+        channels, index = data.get_channels_for([10000, 10001], detectors=[2])
+
+        assert channels.shape == (8, 4096)
+        assert index["row"].tolist() == [4, 5, 6, 7, 12, 13, 14, 15]
+        assert (channels[:4] == data.get_detector_channels("10000_2_Phonon_4096")).all()
+
+    def test_get_channels_for_lazy_matches_eager(self, fixture_dir):
+        eager, eager_index = load_all_data(fixture_dir).get_channels_for(["10000", "10005"], detectors=[0])
+        lazy, lazy_index = load_all_data(fixture_dir, lazy=True).get_channels_for(["10000", "10005"], detectors=[0])
+
+        assert (lazy_index == eager_index).all()
+        assert lazy.shape == eager.shape
+        assert (lazy == eager).all()
+
+    def test_get_channels_for_unknown_event(self, fixture_dir):
+        channels, index = load_all_data(fixture_dir, lazy=True).get_channels_for(["-1"])
+        assert channels.shape == (0, 4096)
+        assert len(index) == 0
+
+    def test_coalesce_rows(self):
+        assert idx._coalesce_rows(numpy.array([0, 1, 2, 3, 8, 9])) == [(0, 4), (8, 10)]
+        assert idx._coalesce_rows(numpy.array([], dtype=int)) == []
+
+
+class TestStreamingEvents:
+    def test_iter_events_covers_every_event(self, tmp_path, create_mid_dir):
+        mid_dir = create_mid_dir(tmp_path, events=50, samples=64)
+        chunks = list(iter_events(mid_dir, chunk_size=7))
+
+        assert [len(c.event_ids) for c in chunks] == [7] * 7 + [1]
+        assert [e for c in chunks for e in c.event_ids] == [str(10000 + e) for e in range(50)]
+
+        full = load_all_data(mid_dir)
+        for chunk in chunks:
+            for detector_id in chunk.detector_ids:
+                assert (chunk.get_detector_channels(detector_id) == full.get_detector_channels(detector_id)).all()
+            assert chunk.get_event_metadata(chunk.event_ids[0]).trigger_type in ["Physics", "Random"]
+
+    def test_iter_events_fixture(self, fixture_dir):
+        chunks = iter_events(fixture_dir, chunk_size=1000)
+        first = next(chunks)
+        assert len(first.event_ids) == 1000
+        assert first.channels.shape == (8000, 4096)
+
+    def test_iter_events_invalid_chunk_size(self, fixture_dir):
+        with pytest.raises(ValueError):
+            next(iter_events(fixture_dir, chunk_size=0))
+
+
+@pytest.fixture(scope="module")
+def by_sample_mid_dir(tmp_path_factory, create_mid_dir):
+    return create_mid_dir(tmp_path_factory.mktemp("idx"), events=4, samples=512, by_sample=True)
+
+
+class TestMultiResolution:
+    def test_resolution_plan(self):
+        assert idx._resolution_plan("V010101010101000000", -2) == 2
+        assert idx._resolution_plan("V0101000", -5) == 3
+        assert idx._resolution_plan("V01010101010101010101010111", -3) == 0
+        with pytest.raises(ValueError):
+            idx._resolution_plan("V0101", 1)
+
+    @pytest.mark.parametrize("quality", [0, -1, -3, -7])
+    def test_lazy_quality(self, by_sample_mid_dir, quality):
+        lazy = load_all_data(by_sample_mid_dir, lazy=True)
+        chan = lazy.get_detector_channels("10001_1_Phonon_512", quality=quality)
+
+        assert chan.shape == (4, 512 // 2**-quality)
+        assert (chan[0] == sample_positions(0, 512, quality)).all()
+        assert (chan == load_all_data(by_sample_mid_dir).get_detector_channels("10001_1_Phonon_512", quality=quality)).all()
+
+    @pytest.mark.parametrize("quality", [0, -2, -5])
+    @pytest.mark.parametrize("window", [(101, 300), (3, 9), (511, 512)])
+    def test_window(self, by_sample_mid_dir, quality, window):
+        lazy = load_all_data(by_sample_mid_dir, lazy=True)
+        chan = lazy.get_detector_channels("10000_0_Phonon_512", quality=quality, window=window)
+
+        assert chan.shape[1] == len(sample_positions(0, 512, quality, window=window))
+        assert (chan[3] == sample_positions(0, 512, quality, window=window)).all()
+        assert (chan == load_all_data(by_sample_mid_dir).get_detector_channels("10000_0_Phonon_512", quality=quality, window=window)).all()
+
+    def test_get_channels_for_quality(self, by_sample_mid_dir):
+        channels, index = load_all_data(by_sample_mid_dir, lazy=True).get_channels_for(["10000", "10003"], quality=-2)
+        assert channels.shape == (16, 128)
+        assert (channels[-1] == sample_positions(0, 512, -2)).all()
+
+    def test_fixture_layout_keeps_channels(self, fixture_dir):
+        lazy = load_all_data(fixture_dir, lazy=True)
+        chan = lazy.get_detector_channels("10000_0_Phonon_4096", quality=-3)
+        assert chan.shape == (4, 512)
+
+
+class TestChannelStore:
+    @pytest.fixture
+    def mid_dir(self, tmp_path, create_mid_dir):
+        return create_mid_dir(tmp_path, events=20, samples=64)
+
+    def test_transcode(self, mid_dir):
+        path = transcode_channels(mid_dir)
+        assert path == os.path.join(mid_dir, "07180808_1558_F0001.idx.npy")
+
+        store = load_all_data(mid_dir)
+        assert isinstance(store.channels, numpy.memmap)
+        assert (numpy.asarray(store.channels) == idx._load_channel_data(os.path.join(mid_dir, "07180808_1558_F0001.idx"))).all()
+
+    def test_transcode_in_windows(self, mid_dir, monkeypatch):
+        """The idx is read in windows of whole blocks"""
+        monkeypatch.setattr(idx, "TRANSCODE_ROWS", 1)
+        transcode_channels(mid_dir)
+        expected = idx._load_channel_data(os.path.join(mid_dir, "07180808_1558_F0001.idx"))
+        assert (numpy.asarray(load_all_data(mid_dir).channels) == expected).all()
+
+    def test_store_skips_idx(self, mid_dir, monkeypatch):
+        expected = load_all_data(mid_dir)
+        transcode_channels(mid_dir)
+
+        def fail(*_):
+            raise AssertionError("idx decoded despite a channel store")
+
+        monkeypatch.setattr(idx, "_load_channel_data", fail)
+        monkeypatch.setattr(idx.ov, "LoadDataset", fail)
+        for lazy in (False, True):
+            data = load_all_data(mid_dir, lazy=lazy)
+            assert data.dataset is None
+            assert (data.get_detector_channels("10003_1_Phonon_64") == expected.get_detector_channels("10003_1_Phonon_64")).all()
+            assert (data.get_detector_channels("10003_1_Phonon_64", quality=-1, window=(8, 40))
+                    == expected.get_detector_channels("10003_1_Phonon_64", quality=-1, window=(8, 40))).all()
+
+        chunks = list(iter_events(mid_dir, chunk_size=6))
+        assert [e for c in chunks for e in c.event_ids] == expected.get_event_ids()
+        for chunk in chunks:
+            for detector_id in chunk.detector_ids:
+                assert (chunk.get_detector_channels(detector_id) == expected.get_detector_channels(detector_id)).all()
+
+    def test_store_invalidated_when_idx_changes(self, mid_dir):
+        transcode_channels(mid_dir)
+        idx_path = os.path.join(mid_dir, "07180808_1558_F0001.idx")
+        os.utime(idx_path, ns=(0, 0))
+
+        data = load_all_data(mid_dir)
+        assert not isinstance(data.channels, numpy.memmap)
+        assert len(data.channels) == 20 * 2 * 4
+
+    def test_store_invalidated_when_data_changes(self, mid_dir):
+        """A re-downloaded data file invalidates the store even if the idx is untouched"""
+        transcode_channels(mid_dir)
+        os.utime(os.path.join(mid_dir, "07180808_1558_F0001", "0000.bin"), ns=(0, 0))
+
+        data = load_all_data(mid_dir)
+        assert not isinstance(data.channels, numpy.memmap)
+
+    def test_transcode_without_idx(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            transcode_channels(str(tmp_path))
@@ -0,0 +1,69 @@
+import numpy
+import pytest
+from nsdf_dark_matter.catalog import Catalog
+from nsdf_dark_matter.loader import BatchLoader, DetectorDataset
+
+
+@pytest.fixture(scope="module")
+def catalog(tmp_path_factory, create_mid_dir):
+    root = tmp_path_factory.mktemp("idx")
+    for i in range(2):
+        create_mid_dir(root, mid=f"07180808_1558_F000{i + 1}", events=6, samples=32)
+    return Catalog(str(root), executor="thread")
+
+
+class TestDetectorDataset:
+    def test_samples(self, catalog):
+        dataset = DetectorDataset(catalog)
+        assert len(dataset) == 2 * 6 * 2
+        assert dataset[0].shape == (4, 32)
+        assert dataset[3][0][0] == 12
+
+    def test_filters(self, catalog):
+        dataset = DetectorDataset(catalog, trigger_type="Physics", detectors=[1])
+        assert len(dataset) == 2 * 3
+        assert set(dataset.samples["detector"].tolist()) == {1}
+        assert set(dataset.samples["event"].tolist()) == {10000, 10002, 10004}
+
+    def test_trigger_filter_uses_event_table(self, catalog, monkeypatch):
+        """Filtering by trigger does not open the idx files"""
+        monkeypatch.setattr(catalog, "get", lambda *args, **kwargs: pytest.fail("idx file opened"))
+        dataset = DetectorDataset(catalog, trigger_type="Physics")
+        assert set(dataset.samples["event"].tolist()) == {10000, 10002, 10004}
+
+    def test_get_batch_matches_items(self, catalog):
+        dataset = DetectorDataset(catalog)
+        indices = [20, 1, 13, 0]
+        batch, samples = dataset.get_batch(indices)
+
+        assert batch.shape == (4, 4, 32)
+        assert samples["file"].tolist() == [1, 0, 1, 0]
+        for i, sample in enumerate(indices):
+            assert (batch[i] == dataset[sample]).all()
+
+
+class TestBatchLoader:
+    def test_epoch_covers_every_sample_once(self, catalog):
+        dataset = DetectorDataset(catalog)
+        loader = BatchLoader(dataset, batch_size=5, buffer_size=8, num_workers=2, seed=7)
+
+        seen = []
+        for batch, samples in loader:
+            assert batch.flags["C_CONTIGUOUS"]
+            assert batch.shape[1:] == (4, 32)
+            seen.extend(zip(samples["file"].tolist(), samples["lo"].tolist()))
+
+        assert len(loader) == 5
+        assert sorted(seen) == sorted(zip(dataset.samples["file"].tolist(), dataset.samples["lo"].tolist()))
+
+    def test_no_shuffle_keeps_order(self, catalog):
+        dataset = DetectorDataset(catalog)
+        loader = BatchLoader(dataset, batch_size=10, shuffle=False, drop_last=True)
+
+        batches = list(loader)
+        assert len(batches) == 2
+        assert (batches[0][0][:, 0, 0] == numpy.arange(0, 40, 4)).all()
+
+    def test_invalid_batch_size(self, catalog):
+        with pytest.raises(ValueError):
+            BatchLoader(DetectorDataset(catalog), batch_size=0)
@@ -0,0 +1,566 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from rich.progress import Progress
+from urllib.parse import urlparse
+
+try:
+    import httpx
+except ImportError as e:
+    raise ImportError("the async download engine requires httpx, install nsdf-dark-matter-cli[async]") from e
+
+from . import download
+from .cache import Cache, CacheBusyError
+from .checksum import BlockHasher, checksum_file, read_checksums, tree_digest, write_checksums
+from .telemetry import Telemetry
+from .defaults import MAX_CONNECTIONS, PER_HOST_CONNECTIONS, RESOLVE_WORKERS, RETRIES
+from .download import (BACKOFF, EXPIRY_MARGIN, MD5_ETAG_PATTERN, RETRY_STATUS, TIMEOUT, DownloadError, ExpiredUrlError,
+                       InterruptedTransferError, _content_range_size, _hash_range, _load_manifest, _MidTransfer, _ObjectTransfer, _split_parts,
+                       _write_manifest, isvalid_midfile, url_expiry)
+
+# chunks received but not yet written, bounds the memory held between the network and the disk
+WRITE_BUFFERS = 64
+PROGRESS_INTERVAL = 0.1
+
+
+class _RetryableStatusError(DownloadError):
+    """
+    Raised on throttled or 5xx responses, which are retried
+    """
+
+
+class _AsyncObjectTransfer(_ObjectTransfer):
+    """
+    The state of an object being downloaded, the fields past the transfer state are only touched by the writer
+    """
+
+    def __init__(self, mid_transfer: _MidTransfer, key: str):
+        super().__init__(mid_transfer, key)
+        self.fd = None
+        self.offset = 0
+        self.unsaved = 0
+        self.write_error = None
+
+
+class _Writer:
+    """
+    Write-behind disk I/O on a thread of its own
+
+    Jobs run in the order they are submitted, so the chunks of a range land in order and the manifest never records bytes
+    that are not written yet. Submitting waits once buffers jobs are pending, which holds back the network reads.
+    """
+
+    def __init__(self, buffers: int):
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._slots = asyncio.Semaphore(buffers)
+
+    async def submit(self, fn, *args):
+        await self._slots.acquire()
+        future = asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+
+    async def run(self, fn, *args):
+        """
+        Run a job once every job submitted before it is done
+        """
+        await self._slots.acquire()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class AsyncDownloader:
+    """
+    Download many mids on a single event loop
+
+    The asyncio counterpart of Downloader, with the same on-disk layout (ranges, manifests, checksums and cache staging) and
+    the same outcome per mid. Every mid, object and byte range is a coroutine rather than a thread task, so thousands of
+    small objects can be in flight while at most max_connections requests, and per_host against the same host, hold a
+    connection. Received chunks are handed to a single writer thread that writes them with pwrite at their offset into
+    the preallocated partial file and hashes them; at most WRITE_BUFFERS chunks wait for the disk before reads pause.
+    Progress is accumulated per file and pushed to rich every PROGRESS_INTERVAL seconds.
+
+    Attributes
+    ----------
+    progress(Progress): the rich Progress object to keep track of downloads
+    cache(Cache): the cache the mids are published to
+    telemetry(Telemetry): the metrics of every lookup and object transfer
+    max_connections(int): the number of concurrent requests
+    per_host(int): the number of concurrent requests against a single host
+    resolve_workers(int): the number of concurrent url lookups
+    lookahead(int): the number of mids being resolved or transferred at a time
+    retries(int): the number of times a request or range is retried
+    backoff(float): the base of the exponential backoff between retries, in seconds
+    buffers(int): the number of chunks waiting for the disk at most
+
+    Methods
+    -------
+    download(midfiles): download every mid and report the outcome of each
+    """
+
+    def __init__(self, progress: Progress, max_connections: int = MAX_CONNECTIONS, per_host: int = PER_HOST_CONNECTIONS,
+                 retries: int = RETRIES, backoff: float = BACKOFF, resolve_workers: int = RESOLVE_WORKERS,
+                 lookahead: int | None = None, cache: Cache | None = None, buffers: int = WRITE_BUFFERS,
+                 telemetry: Telemetry | None = None):
+        if max_connections < 1 or per_host < 1 or resolve_workers < 1 or buffers < 1:
+            raise ValueError(f"connection limits must be at least 1, got max_connections={max_connections} "
+                             f"per_host={per_host} resolve_workers={resolve_workers} buffers={buffers}")
+
+        self.progress = progress
+        self.cache = cache if cache is not None else Cache(download.IDX_FILES_DIR)
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.max_connections = max_connections
+        self.per_host = per_host
+        self.resolve_workers = resolve_workers
+        self.lookahead = lookahead if lookahead is not None else 2 * max_connections + resolve_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.buffers = buffers
+
+    def download(self, midfiles: list[str]) -> list[tuple[str, Exception | None]]:
+        """
+        Download the mids and wait for every transfer to finish
+        ----------------------------
+        Parameters
+        ----------
+        midfiles(list[str]): the mids to download in the format 07180808_1558_F0001
+
+        Returns
+        -------
+        list[tuple[str, Exception|None]]: per mid, an exception if the input is invalid or the download failed, otherwise None
+        """
+        results = []
+        transfers = []
+        for midfile in midfiles:
+            if isvalid_midfile(midfile):
+                transfers.append(_MidTransfer(midfile))
+            else:
+                results.append((midfile, ValueError(f"[bold red]Must provide a valid mid file identifier,  i.e, 07180808_1558_F0001. File {midfile} is not valid[/bold red]")))
+
+        asyncio.run(self._download(transfers))
+        return results + [(transfer.mid, transfer.error) for transfer in transfers]
+
+    async def _download(self, transfers: list[_MidTransfer]):
+        limits = httpx.Limits(max_connections=self.max_connections + self.resolve_workers,
+                              max_keepalive_connections=self.max_connections + self.resolve_workers)
+        timeout = httpx.Timeout(TIMEOUT[1], connect=TIMEOUT[0])
+        self._connections = asyncio.Semaphore(self.max_connections)
+        self._lookups = asyncio.Semaphore(self.resolve_workers)
+        self._host_slots = {}
+        self._urls = {}
+        self._inflight = {}
+        self._progressed = defaultdict(int)
+        self._writer = _Writer(self.buffers)
+
+        slots = asyncio.Semaphore(self.lookahead)
+        reporter = asyncio.create_task(self._report())
+        try:
+            async with httpx.AsyncClient(limits=limits, timeout=timeout, follow_redirects=True) as client:
+                self._client = client
+                await asyncio.gather(*(self._mid(mid_transfer, slots) for mid_transfer in transfers))
+        finally:
+            reporter.cancel()
+            self._flush_progress()
+            self._writer.close()
+
+    ### SCHEDULING ###
+
+    def _host_slot(self, url: str) -> asyncio.Semaphore:
+        """
+        The semaphore limiting concurrent requests against the host of the url
+        """
+        host = urlparse(url).netloc
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.per_host)
+        return self._host_slots[host]
+
+    async def _with_retries(self, obj: _AsyncObjectTransfer, fn):
+        """
+        Await fn with the url of the object while holding a connection slot, retrying with exponential backoff when the
+        connection fails part way through a transfer. An expired url is resolved again before the next attempt.
+        """
+        refresh = False
+        for attempt in range(self.retries + 1):
+            url = (await self._resolve(obj.mid_transfer.mid, refresh=refresh))[obj.key]
+            try:
+                async with self._connections, self._host_slot(url):
+                    return await fn(url)
+            except (httpx.TransportError, InterruptedTransferError, ExpiredUrlError, _RetryableStatusError) as e:
+                if attempt == self.retries:
+                    raise
+                refresh = isinstance(e, ExpiredUrlError)
+                obj.metrics.retries += 1
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def _resolve(self, mid: str, refresh: bool = False) -> dict[str, str]:
+        """
+        The url of every object key of the mid, cached until shortly before they expire, concurrent lookups of the same
+        mid share one request
+        """
+        if not refresh and mid in self._urls:
+            urls, expires_at = self._urls[mid]
+            if expires_at is None or time.time() < expires_at - EXPIRY_MARGIN:
+                return urls
+
+        if mid not in self._inflight:
+            self._inflight[mid] = asyncio.ensure_future(self._fetch_urls(mid))
+            self._inflight[mid].add_done_callback(lambda _: self._inflight.pop(mid, None))
+        return await asyncio.shield(self._inflight[mid])
+
+    async def _fetch_urls(self, mid: str) -> dict[str, str]:
+        async with self._lookups:
+            started = time.monotonic()
+            for attempt in range(self.retries + 1):
+                try:
+                    response = await self._client.get(download.GEN_URL_ENDPOINT, params={"filename": mid})
+                    if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                        break
+                except httpx.TransportError:
+                    if attempt == self.retries:
+                        raise
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+            self.telemetry.resolved(mid, time.monotonic() - started)
+
+        if response.status_code != 200:
+            raise DownloadError(f"could not retrieve object resource {mid}: HTTP {response.status_code}")
+
+        urls = {kv['key']: kv['url'] for kv in response.json()['urls']}
+        if not urls:
+            raise DownloadError(f"no objects found for {mid}")
+
+        expiries = [expires_at for expires_at in map(url_expiry, urls.values()) if expires_at is not None]
+        self._urls[mid] = (urls, min(expiries) if expiries else None)
+        return urls
+
+    ### PROGRESS ###
+
+    def _advance(self, obj: _AsyncObjectTransfer, nbytes: int):
+        self._progressed[obj.task_id] += nbytes
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            self._flush_progress()
+
+    def _flush_progress(self):
+        progressed, self._progressed = self._progressed, defaultdict(int)
+        for task_id, nbytes in progressed.items():
+            self.progress.update(task_id, advance=nbytes)
+
+    ### TASKS ###
+
+    async def _mid(self, mid_transfer: _MidTransfer, slots: asyncio.Semaphore):
+        async with slots:
+            try:
+                await self._transfer_mid(mid_transfer)
+            except Exception as e:
+                mid_transfer.error = e
+            finally:
+                if mid_transfer.staging is not None:
+                    # a failed mid stays staged for the next run
+                    mid_transfer.staging.release()
+
+    async def _transfer_mid(self, mid_transfer: _MidTransfer):
+        """
+        Download every object of a mid into its staging directory and publish it
+        """
+        mid = mid_transfer.mid
+        if self.cache.contains(mid):
+            return
+
+        try:
+            mid_transfer.staging = await asyncio.to_thread(self.cache.stage, mid, False)
+        except CacheBusyError as e:
+            mid_transfer.error = e
+            return
+        if self.cache.contains(mid):
+            # published by another process meanwhile
+            return
+
+        mid_transfer.local_path = mid_transfer.staging.path
+        urls = await self._resolve(mid)
+        mid_transfer.recorded = read_checksums(mid_transfer.local_path)
+
+        objects = [_AsyncObjectTransfer(mid_transfer, key) for key in urls]
+        for obj in objects:
+            obj.metrics = self.telemetry.start_object(mid, obj.relpath)
+        results = await asyncio.gather(*(self._object(obj) for obj in objects), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        write_checksums(mid_transfer.local_path, mid_transfer.checksums)
+        # only a mid with every object in place is published and skipped on the next run
+        await asyncio.to_thread(mid_transfer.staging.publish)
+
+    async def _object(self, obj: _AsyncObjectTransfer):
+        error = None
+        try:
+            await self._transfer_object(obj)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if obj.metrics.status == "pending":
+                obj.metrics.finish(error)
+            if obj.fd is not None:
+                # after the writes still pending for the file
+                await self._writer.run(os.close, obj.fd)
+                obj.fd = None
+            if obj.task_id is not None:
+                self._progressed.pop(obj.task_id, None)
+                self.progress.remove_task(obj.task_id)
+                obj.task_id = None
+
+    async def _transfer_object(self, obj: _AsyncObjectTransfer):
+        """
+        Probe an object, download its byte ranges, or the whole object when ranges are not supported, and move it in place
+        """
+        # a single byte request tells the object size and whether ranges are supported
+        obj.metrics.begin()
+        status, headers = await self._with_retries(obj, lambda url: self._probe(obj, url))
+
+        ranged = status == 206
+        if ranged:
+            total_size = _content_range_size(headers.get("Content-Range", ""))
+        else:
+            total_size = int(headers.get("Content-Length", 0))
+
+        obj.size = obj.metrics.size = total_size
+        etag = headers.get("ETag", "").strip('"')
+        obj.etag = etag if re.match(MD5_ETAG_PATTERN, etag) else None
+
+        if total_size > 0 and os.path.exists(obj.target_path) and os.path.getsize(obj.target_path) == total_size:
+            recorded = obj.mid_transfer.recorded.get(obj.relpath)
+            if recorded is None or recorded["size"] != total_size:
+                # downloaded before checksums were recorded
+                sha256 = await self._writer.run(checksum_file, obj.target_path, download.PART_SIZE)
+                recorded = {"size": total_size, "block_size": download.PART_SIZE, "sha256": sha256}
+            with obj.mid_transfer.lock:
+                obj.mid_transfer.checksums[obj.relpath] = recorded
+            obj.metrics.finish(skipped=True)
+            return
+
+        os.makedirs(os.path.dirname(obj.target_path), exist_ok=True)
+
+        # keep track of progress for this file
+        obj.task_id = self.progress.add_task(
+            "download",
+            filename=f"{obj.mid_transfer.mid}/{obj.file}",
+            total=total_size
+        )
+
+        if ranged:
+            await self._transfer_ranges(obj)
+        else:
+            # without range support the object can only be streamed from the start
+            await self._with_retries(obj, lambda url: self._fetch_stream(obj, url))
+
+        await self._writer.run(self._finish_object, obj)
+
+    async def _probe(self, obj: _AsyncObjectTransfer, url: str) -> tuple[int, httpx.Headers]:
+        """
+        Request the first byte of an object, without reading the body of servers that ignore the range
+        """
+        started = time.monotonic()
+        async with self._client.stream("GET", url, headers={"Range": "bytes=0-0"}) as resp:
+            obj.metrics.ttfb_seconds = time.monotonic() - started
+            if resp.status_code == 206:
+                # consuming the body hands the connection back to the pool
+                await resp.aread()
+            if resp.status_code not in (200, 206):
+                raise _status_error(resp.status_code, "object resource")
+            return resp.status_code, resp.headers
+
+    async def _transfer_ranges(self, obj: _AsyncObjectTransfer):
+        manifest = await self._writer.run(_load_manifest, obj.manifest_path, obj.part_path, obj.size)
+        if manifest is None:
+            manifest = {"size": obj.size, "parts": _split_parts(obj.size, download.PART_SIZE)}
+            # preallocated, so every range is written at its offset
+            await self._writer.run(_preallocate, obj.part_path, obj.size)
+            await self._writer.run(_write_manifest, obj.manifest_path, manifest)
+        obj.manifest = manifest
+
+        # every range is a block of the object checksum, hashed as its bytes are written
+        parts = manifest["parts"]
+        obj.hashers = [hashlib.sha256() for _ in parts]
+        obj.md5 = hashlib.md5() if obj.etag is not None and len(parts) == 1 else None
+        for i, (start, _, done) in enumerate(parts):
+            if done > 0:
+                # bytes written by an interrupted run are hashed from disk
+                await self._writer.run(_hash_range, obj.part_path, start, done, self._part_hashers(obj, i))
+
+        self._advance(obj, sum(done for _, _, done in parts))
+        obj.fd = os.open(obj.part_path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+
+        pending = [i for i, (start, end, done) in enumerate(parts) if done < end - start]
+        results = await asyncio.gather(*(self._with_retries(obj, lambda url, i=i: self._fetch_part(obj, i, url))
+                                         for i in pending), return_exceptions=True)
+        # record what reached the file even if ranges failed
+        await self._writer.run(_write_manifest, obj.manifest_path, manifest)
+
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        if obj.write_error is not None:
+            raise obj.write_error
+
+    async def _fetch_part(self, obj: _AsyncObjectTransfer, i: int, url: str):
+        """
+        Download the remaining bytes of a range
+        """
+        # writes of an interrupted attempt land before the range to request is read
+        await self._writer.run(_noop)
+        start, end, done = obj.manifest["parts"][i]
+        if done == end - start:
+            return
+
+        async with self._client.stream("GET", url, headers={"Range": f"bytes={start + done}-{end - 1}"}) as resp:
+            if resp.status_code != 206:
+                raise _status_error(resp.status_code, f"range {start + done}-{end - 1}")
+            async for chunk in resp.aiter_bytes(download.CHUNK_SIZE):
+                await self._writer.submit(self._write_part, obj, i, chunk)
+                self._advance(obj, len(chunk))
+
+        await self._writer.run(_noop)
+        done = obj.manifest["parts"][i][2]
+        if obj.write_error is None and done != end - start:
+            raise InterruptedTransferError(f"range {start}-{end - 1} ended after {done} of {end - start} bytes")
+
+    async def _fetch_stream(self, obj: _AsyncObjectTransfer, url: str):
+        """
+        Download a complete object, a retried stream starts over
+        """
+        await self._writer.run(self._reset_stream, obj)
+        self._progressed.pop(obj.task_id, None)
+        self.progress.update(obj.task_id, completed=0)
+
+        async with self._client.stream("GET", url) as resp:
+            if resp.status_code != 200:
+                raise _status_error(resp.status_code, "object resource")
+            async for chunk in resp.aiter_bytes(download.CHUNK_SIZE):
+                await self._writer.submit(self._write_stream, obj, chunk)
+                self._advance(obj, len(chunk))
+
+        await self._writer.run(_noop)
+        if obj.write_error is not None:
+            raise obj.write_error
+
+    ### WRITER JOBS ###
+
+    def _part_hashers(self, obj: _AsyncObjectTransfer, i: int) -> list:
+        return [obj.hashers[i]] if i > 0 or obj.md5 is None else [obj.hashers[i], obj.md5]
+
+    def _write_part(self, obj: _AsyncObjectTransfer, i: int, chunk: bytes):
+        if obj.write_error is not None:
+            return
+
+        part = obj.manifest["parts"][i]
+        try:
+            _pwrite(obj.fd, chunk, part[0] + part[2])
+            self.telemetry.add_bytes(obj.metrics, len(chunk))
+            for hasher in self._part_hashers(obj, i):
+                hasher.update(chunk)
+            part[2] += len(chunk)
+
+            obj.unsaved += len(chunk)
+            if obj.unsaved >= download.MANIFEST_INTERVAL:
+                _write_manifest(obj.manifest_path, obj.manifest)
+                obj.unsaved = 0
+        except OSError as e:
+            obj.write_error = e
+
+    def _reset_stream(self, obj: _AsyncObjectTransfer):
+        if obj.fd is not None:
+            os.close(obj.fd)
+        obj.fd = os.open(obj.part_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+        obj.offset = 0
+        obj.write_error = None
+        obj.stream_hasher = BlockHasher(download.PART_SIZE)
+        obj.md5 = hashlib.md5() if obj.etag is not None and obj.size <= download.PART_SIZE else None
+
+    def _write_stream(self, obj: _AsyncObjectTransfer, chunk: bytes):
+        if obj.write_error is not None:
+            return
+
+        try:
+            _pwrite(obj.fd, chunk, obj.offset)
+            self.telemetry.add_bytes(obj.metrics, len(chunk))
+            obj.offset += len(chunk)
+            obj.stream_hasher.update(chunk)
+            if obj.md5 is not None:
+                obj.md5.update(chunk)
+        except OSError as e:
+            obj.write_error = e
+
+    def _finish_object(self, obj: _AsyncObjectTransfer):
+        """
+        Move a complete object into place
+        """
+        started = time.monotonic()
+        os.fsync(obj.fd)
+        obj.metrics.fsync_seconds += time.monotonic() - started
+        os.close(obj.fd)
+        obj.fd = None
+
+        if obj.md5 is not None and obj.md5.hexdigest() != obj.etag:
+            # the bytes on disk cannot be trusted, the next run starts over
+            os.remove(obj.part_path)
+            if os.path.exists(obj.manifest_path):
+                os.remove(obj.manifest_path)
+            raise DownloadError(f"checksum mismatch for {obj.key}: md5 {obj.md5.hexdigest()} does not match ETag {obj.etag}")
+
+        if obj.stream_hasher is not None:
+            digest = obj.stream_hasher.hexdigest()
+        else:
+            digest = tree_digest([hasher.digest() for hasher in obj.hashers])
+
+        os.replace(obj.part_path, obj.target_path)
+        if os.path.exists(obj.manifest_path):
+            os.remove(obj.manifest_path)
+        with obj.mid_transfer.lock:
+            obj.mid_transfer.checksums[obj.relpath] = {"size": obj.size, "block_size": download.PART_SIZE, "sha256": digest}
+
+
+def _status_error(status: int, what: str) -> DownloadError:
+    """
+    The error raised for an unexpected response status
+    """
+    if status == 403:
+        return ExpiredUrlError(f"storage rejected the url of the {what}")
+    if status in RETRY_STATUS:
+        return _RetryableStatusError(f"could not retrieve {what}: HTTP {status}")
+    return DownloadError(f"could not retrieve {what}: HTTP {status}")
+
+
+def _pwrite(fd: int, data: bytes, offset: int):
+    """
+    Write all of data at an offset of the file
+    """
+    if hasattr(os, "pwrite"):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+    else:
+        # only the writer thread touches the file position
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
+
+
+def _preallocate(path: str, size: int):
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+def _noop():
+    pass
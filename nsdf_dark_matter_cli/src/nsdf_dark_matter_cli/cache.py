@@ -0,0 +1,401 @@
+# Shared by the CLI and the dashboard, which mount the same idx volume and both import this module.
+import os
+import shutil
+import time
+import uuid
+import weakref
+from typing import NamedTuple
+
+try:
+    import fcntl
+except ImportError:
+    # locks are advisory and only enforced where flock is available
+    fcntl = None
+
+COMPLETE_MARKER = ".complete"
+CACHE_DIR = ".cache"
+
+
+class CacheBusyError(Exception):
+    """
+    Raised when a mid is already being staged by another process
+    """
+
+
+class CacheEntry(NamedTuple):
+    mid: str
+    size: int
+    last_access: float
+    pinned: bool
+
+
+class Lease:
+    """
+    A lock on a lock file, released explicitly or when leaving a with block
+
+    Locks are flock locks, so the kernel drops them if the process holding them dies and they never go stale. A lease
+    dropped without being released is released when it is garbage collected.
+    """
+
+    def __init__(self, path: str, exclusive: bool, blocking: bool = True):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            flags = (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB)
+            try:
+                fcntl.flock(self._fd, flags)
+            except BlockingIOError:
+                os.close(self._fd)
+                self._fd = None
+                raise
+        self._close = weakref.finalize(self, os.close, self._fd)
+
+    def release(self):
+        if self._fd is not None:
+            self._close()
+            self._fd = None
+
+    def __enter__(self) -> "Lease":
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Staging:
+    """
+    A directory a mid is written to before it is published into the cache
+
+    The staging directory of a mid has a stable path, so an interrupted download resumes from what it left behind. The
+    staging lock is held until the mid is published or the staging is released.
+
+    Attributes
+    ----------
+    cache(Cache): the cache the mid is published to
+    mid(str): the mid being staged
+    path(str): the staging directory
+
+    Methods
+    -------
+    publish(): move the staging directory into the cache
+    release(): give up the staging lock, keeping the directory for a later attempt
+    """
+
+    def __init__(self, cache: "Cache", mid: str, lease: Lease):
+        self.cache = cache
+        self.mid = mid
+        self.path = os.path.join(cache.root, CACHE_DIR, "staging", mid)
+        self._lease = lease
+
+    def publish(self):
+        self.cache.publish(self)
+
+    def release(self):
+        self._lease.release()
+
+    def __enter__(self) -> "Staging":
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Cache:
+    """
+    A directory of downloaded mids shared by every process that reads or writes it
+
+    Mids are published as <root>/<mid> directories carrying a .complete marker, the layout load_all_data reads. A mid
+    is written to a staging directory first and moved into place with a rename once complete, so readers never see a
+    partial mid. Bookkeeping lives under <root>/.cache:
+
+    - locks/: flock lock files, shared while a mid is in use, exclusive while it is staged or evicted
+    - meta/: the size in bytes of every published mid, the modification time of the file is its last access
+    - staging/ and trash/: mids being written and mids being deleted
+
+    When the published mids exceed the quota, the least recently used ones are evicted, skipping pinned mids and mids in
+    use by any process.
+
+    Attributes
+    ----------
+    root(str): the cache directory
+    quota(int|None): the number of bytes the published mids may take, unbounded if None
+
+    Methods
+    -------
+    path(mid): the directory of a published mid
+    contains(mid): whether a mid is published
+    lease(mid): keep a mid from being evicted or withdrawn
+    use(mid): mark a mid in use and accessed
+    stage(mid, blocking): start writing a mid
+    publish(staging): move a staged mid into place
+    withdraw(mid): move a published mid back to staging
+    pin(mid), unpin(mid): keep a mid from being evicted
+    refresh(mid): measure a published mid again after files were added to it
+    entries(): every published mid
+    size(): the bytes taken by the published mids
+    evict(quota): evict mids until the published mids fit the quota
+    """
+
+    def __init__(self, root: str, quota: int | None = None):
+        self.root = root
+        self.quota = quota
+        for name in ("locks", "meta", "staging", "trash"):
+            os.makedirs(os.path.join(root, CACHE_DIR, name), exist_ok=True)
+
+    def path(self, mid: str) -> str:
+        return os.path.join(self.root, mid)
+
+    def contains(self, mid: str) -> bool:
+        return os.path.exists(os.path.join(self.path(mid), COMPLETE_MARKER))
+
+    def lease(self, mid: str) -> Lease:
+        """
+        Hold a mid, published or not, without marking it accessed. It is not evicted or withdrawn until the lease is
+        released
+        ----------------------------
+        Parameters
+        ----------
+        mid(str): the mid in the format 07180808_1558_F0001
+
+        Returns
+        -------
+        Lease: the shared lock on the mid
+        """
+        return Lease(self._lock_path(mid), exclusive=False)
+
+    def use(self, mid: str) -> Lease:
+        """
+        Mark a mid in use, it is not evicted until the lease is released
+        ----------------------------
+        Parameters
+        ----------
+        mid(str): the mid in the format 07180808_1558_F0001
+
+        Returns
+        -------
+        Lease: the shared lock on the mid
+        """
+        lease = self.lease(mid)
+        if not self.contains(mid):
+            lease.release()
+            raise FileNotFoundError(f"{mid} is not in the cache")
+
+        self._touch(mid)
+        return lease
+
+    def stage(self, mid: str, blocking: bool = True) -> Staging:
+        """
+        Start writing a mid
+
+        A published mid without its .complete marker (a download interrupted before it was staged, or a mid being
+        repaired) is moved back to staging when no process uses it, so the files it holds are reused.
+        ----------------------------
+        Parameters
+        ----------
+        mid(str): the mid in the format 07180808_1558_F0001
+        blocking(bool): wait for another process staging the same mid, otherwise raise CacheBusyError
+
+        Returns
+        -------
+        Staging: the staging directory of the mid
+        """
+        try:
+            lease = Lease(self._lock_path(mid, "staging"), exclusive=True, blocking=blocking)
+        except BlockingIOError:
+            raise CacheBusyError(f"{mid} is being downloaded by another process")
+
+        staging = Staging(self, mid, lease)
+        if not os.path.exists(staging.path) and os.path.isdir(self.path(mid)) and not self.contains(mid):
+            try:
+                with Lease(self._lock_path(mid), exclusive=True, blocking=False):
+                    os.rename(self.path(mid), staging.path)
+            except BlockingIOError:
+                pass
+
+        os.makedirs(staging.path, exist_ok=True)
+        return staging
+
+    def publish(self, staging: Staging):
+        """
+        Move a staged mid into place, then evict down to the quota
+        ----------------------------
+        Parameters
+        ----------
+        staging(Staging): the staged mid
+        """
+        mid = staging.mid
+        with open(os.path.join(staging.path, COMPLETE_MARKER), "w"):
+            pass
+        size = _directory_size(staging.path)
+
+        with self._global_lock():
+            if os.path.exists(self.path(mid)):
+                # a stale copy, readers holding files open keep them until they close them
+                self._discard(self.path(mid))
+            os.rename(staging.path, self.path(mid))
+            self._write_meta(mid, size)
+
+        staging.release()
+        if self.quota is not None:
+            # the mid just published is in use until the eviction is done, so it is never the one evicted
+            with Lease(self._lock_path(mid), exclusive=False):
+                self.evict(self.quota)
+
+    def withdraw(self, mid: str) -> Staging:
+        """
+        Move a published mid back to staging, i.e, to replace its corrupt files
+
+        The .complete marker is removed before anything else, so the mid stops counting as published before any of its
+        files change. A mid being staged or in use by any process is left untouched and CacheBusyError is raised.
+        ----------------------------
+        Parameters
+        ----------
+        mid(str): the mid in the format 07180808_1558_F0001
+
+        Returns
+        -------
+        Staging: the staging directory holding the files of the mid
+        """
+        try:
+            lease = Lease(self._lock_path(mid, "staging"), exclusive=True, blocking=False)
+        except BlockingIOError:
+            raise CacheBusyError(f"{mid} is being downloaded by another process")
+
+        staging = Staging(self, mid, lease)
+        try:
+            with Lease(self._lock_path(mid), exclusive=True, blocking=False):
+                marker = os.path.join(self.path(mid), COMPLETE_MARKER)
+                if os.path.exists(marker):
+                    os.remove(marker)
+                if os.path.isdir(self.path(mid)):
+                    if os.path.exists(staging.path):
+                        # left behind by an older download, the published files supersede it
+                        self._discard(staging.path)
+                    os.rename(self.path(mid), staging.path)
+        except BlockingIOError:
+            staging.release()
+            raise CacheBusyError(f"{mid} is in use by another process")
+
+        os.makedirs(staging.path, exist_ok=True)
+        return staging
+
+    def refresh(self, mid: str):
+        # rewriting the size also marks the mid accessed
+        self._write_meta(mid, _directory_size(self.path(mid)))
+
+    def pin(self, mid: str):
+        with open(self._meta_path(mid) + ".pinned", "w"):
+            pass
+
+    def unpin(self, mid: str):
+        if os.path.exists(self._meta_path(mid) + ".pinned"):
+            os.remove(self._meta_path(mid) + ".pinned")
+
+    def entries(self) -> list[CacheEntry]:
+        """
+        List the published mids
+        ----------------------------
+        Returns
+        -------
+        list[CacheEntry]: every published mid, least recently used first
+        """
+        entries = []
+        for name in os.listdir(self.root):
+            if name.startswith(".") or not self.contains(name):
+                continue
+
+            meta_path = self._meta_path(name)
+            try:
+                with open(meta_path, "r") as f:
+                    size = int(f.read())
+                last_access = os.path.getmtime(meta_path)
+            except (OSError, ValueError):
+                # published before the cache kept track of it
+                size, last_access = _directory_size(self.path(name)), os.path.getmtime(self.path(name))
+                self._write_meta(name, size, last_access)
+
+            entries.append(CacheEntry(name, size, last_access, os.path.exists(meta_path + ".pinned")))
+
+        return sorted(entries, key=lambda entry: entry.last_access)
+
+    def size(self) -> int:
+        return sum(entry.size for entry in self.entries())
+
+    def evict(self, quota: int) -> list[str]:
+        """
+        Evict the least recently used mids until the published mids fit the quota
+        ----------------------------
+        Parameters
+        ----------
+        quota(int): the number of bytes the published mids may take
+
+        Returns
+        -------
+        list[str]: the evicted mids
+        """
+        evicted = []
+        with self._global_lock():
+            entries = self.entries()
+            total = sum(entry.size for entry in entries)
+            for entry in entries:
+                if total <= quota:
+                    break
+                if entry.pinned:
+                    continue
+
+                try:
+                    with Lease(self._lock_path(entry.mid), exclusive=True, blocking=False):
+                        self._discard(self.path(entry.mid))
+                except BlockingIOError:
+                    # in use
+                    continue
+
+                if os.path.exists(self._meta_path(entry.mid)):
+                    os.remove(self._meta_path(entry.mid))
+                total -= entry.size
+                evicted.append(entry.mid)
+
+        return evicted
+
+    def _discard(self, path: str):
+        """
+        Remove a directory, it disappears at once and is deleted afterwards
+        """
+        trash = os.path.join(self.root, CACHE_DIR, "trash", f"{os.path.basename(path)}.{uuid.uuid4().hex}")
+        os.rename(path, trash)
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def _global_lock(self) -> Lease:
+        return Lease(os.path.join(self.root, CACHE_DIR, "cache.lock"), exclusive=True)
+
+    def _lock_path(self, mid: str, kind: str = "use") -> str:
+        return os.path.join(self.root, CACHE_DIR, "locks", f"{mid}.{kind}.lock")
+
+    def _meta_path(self, mid: str) -> str:
+        return os.path.join(self.root, CACHE_DIR, "meta", mid)
+
+    def _write_meta(self, mid: str, size: int, last_access: float | None = None):
+        with open(self._meta_path(mid), "w") as f:
+            f.write(str(size))
+        if last_access is not None:
+            os.utime(self._meta_path(mid), (last_access, last_access))
+
+    def _touch(self, mid: str):
+        if not os.path.exists(self._meta_path(mid)):
+            self._write_meta(mid, _directory_size(self.path(mid)))
+        now = time.time()
+        os.utime(self._meta_path(mid), (now, now))
+
+
+def _directory_size(path: str) -> int:
+    """
+    The number of bytes taken by the files of a directory tree
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return total
@@ -0,0 +1,267 @@
+import bisect
+import csv
+import mmap
+import re
+import struct
+from importlib import resources
+from typing import Iterator
+
+CATALOG_FILE = "r_dataset.cat"
+CSV_FILE = "r_dataset.csv"
+
+MAGIC = b"NSDFCAT1"
+HEADER = struct.Struct("<8sIB")
+RSERIES = struct.Struct("<8s")
+# filename, size unit, rseries, size in thousandths of the unit
+RECORD = struct.Struct("<19sBBI")
+UNITS = ("B", "KiB", "MiB", "GiB", "TiB")
+SIZE_PATTERN = r"^(\d+)\.(\d{3})(B|KiB|MiB|GiB|TiB)$"
+QUERY_SIZE_PATTERN = r"^(\d+(?:\.\d+)?)\s*(B|KiB|MiB|GiB|TiB)?$"
+
+
+class DatasetCatalog:
+    """
+    The files available for download, read from a packaged binary catalog
+
+    The catalog is a header followed by fixed size records sorted by filename. It is memory mapped, so opening it does not
+    parse anything and prefix queries are a binary search over the records.
+
+    Attributes
+    ----------
+    path(str): the path to the catalog file
+    rseries(tuple[str]): the run series referenced by the records
+
+    Methods
+    -------
+    find(prefix, rseries, min_size, max_size, limit): the entries matching a query, in filename order
+    nbytes(index): the size in bytes of an entry
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self._count, n_rseries = HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a dataset catalog")
+
+        self.rseries = tuple(RSERIES.unpack_from(self._buf, HEADER.size + i * RSERIES.size)[0].rstrip(b"\0").decode()
+                             for i in range(n_rseries))
+        self._offset = HEADER.size + n_rseries * RSERIES.size
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> tuple[str, str, str]:
+        """
+        Get an entry
+        ----------------------------
+        Parameters
+        ----------
+        index(int): the position of the entry in filename order
+
+        Returns
+        -------
+        tuple[str, str, str]: the filename, size (i.e, 48.123MiB) and rseries of the entry
+        """
+        name, unit, rseries, milli = self._record(index)
+        return (name.decode(), f"{milli // 1000}.{milli % 1000:03d}{UNITS[unit]}", self.rseries[rseries])
+
+    def nbytes(self, index: int) -> int:
+        """
+        Get the size in bytes of an entry
+        ----------------------------
+        Parameters
+        ----------
+        index(int): the position of the entry in filename order
+
+        Returns
+        -------
+        int: the size in bytes
+        """
+        _, unit, _, milli = self._record(index)
+        return milli * 1024 ** unit // 1000
+
+    def find(self, prefix: str = "", rseries: str | None = None, min_size: int | None = None, max_size: int | None = None,
+             limit: int | None = None) -> Iterator[int]:
+        """
+        Query the catalog
+        ----------------------------
+        Parameters
+        ----------
+        prefix(str): keep the filenames that start with prefix
+        rseries(str|None): keep the entries of a run series, i.e, R76
+        min_size(int|None): keep the entries of at least min_size bytes
+        max_size(int|None): keep the entries of at most max_size bytes
+        limit(int|None): the number of entries to return, all of them if None
+
+        Returns
+        -------
+        Iterator[int]: the index of every matching entry, in filename order
+        """
+        lo, hi = self._prefix_range(prefix)
+        found = 0
+        for index in range(lo, hi):
+            if limit is not None and found >= limit:
+                return
+
+            _, unit, series, milli = self._record(index)
+            if rseries is not None and self.rseries[series] != rseries:
+                continue
+            size = milli * 1024 ** unit // 1000
+            if (min_size is not None and size < min_size) or (max_size is not None and size > max_size):
+                continue
+
+            found += 1
+            yield index
+
+    def lookup(self, filename: str) -> int | None:
+        """
+        Find an entry by filename
+        ----------------------------
+        Parameters
+        ----------
+        filename(str): the filename, i.e, 07180808_1558_F0001
+
+        Returns
+        -------
+        int | None: the index of the entry, None if the catalog does not list it
+        """
+        lo, hi = self._prefix_range(filename)
+        for index in range(lo, hi):
+            if self._name(index) == filename.encode():
+                return index
+        return None
+
+    def _record(self, index: int) -> tuple[bytes, int, int, int]:
+        if not 0 <= index < self._count:
+            raise IndexError(f"catalog index {index} out of range")
+        return RECORD.unpack_from(self._buf, self._offset + index * RECORD.size)
+
+    def _name(self, index: int) -> bytes:
+        start = self._offset + index * RECORD.size
+        return self._buf[start:start + 19]
+
+    def _prefix_range(self, prefix: str) -> tuple[int, int]:
+        """
+        The range of entries whose filename starts with prefix
+        """
+        if not prefix:
+            return 0, self._count
+
+        key = prefix.encode()
+        names = _Names(self, len(key))
+        return bisect.bisect_left(names, key), bisect.bisect_right(names, key)
+
+
+class _Names:
+    """
+    The filenames of a catalog truncated to a prefix length, as a sequence bisect can search
+    """
+
+    def __init__(self, catalog: DatasetCatalog, length: int):
+        self.catalog = catalog
+        self.length = length
+
+    def __len__(self) -> int:
+        return len(self.catalog)
+
+    def __getitem__(self, index: int) -> bytes:
+        return self.catalog._name(index)[:self.length]
+
+
+_catalog = None
+
+
+def load_catalog() -> DatasetCatalog:
+    """
+    Open the packaged catalog, once per process
+
+    Returns
+    -------
+    DatasetCatalog: the catalog of every available file
+    """
+    global _catalog
+    if _catalog is None:
+        with resources.as_file(resources.files("nsdf_dark_matter_cli").joinpath(CATALOG_FILE)) as path:
+            _catalog = DatasetCatalog(str(path))
+    return _catalog
+
+
+def parse_size(size: str) -> int:
+    """
+    Parse a size given on the command line
+    ----------------------------
+    Parameters
+    ----------
+    size(str): a number of bytes with an optional unit, i.e, 4096, 100MiB or 1.5GiB
+
+    Returns
+    -------
+    int: the size in bytes
+    """
+    match = re.match(QUERY_SIZE_PATTERN, size.strip())
+    if match is None:
+        raise ValueError(f"invalid size {size!r}, expected a number of bytes with an optional unit (B, KiB, MiB, GiB, TiB)")
+
+    value, unit = match.groups()
+    return int(float(value) * 1024 ** UNITS.index(unit or "B"))
+
+
+def format_size(nbytes: int) -> str:
+    """
+    Format a number of bytes in the largest unit that keeps it above 1, i.e, 1.500GiB
+    ----------------------------
+    Parameters
+    ----------
+    nbytes(int): the size in bytes
+
+    Returns
+    -------
+    str: the formatted size
+    """
+    unit = 0
+    while unit < len(UNITS) - 1 and nbytes >= 1024 ** (unit + 1):
+        unit += 1
+    return f"{nbytes / 1024 ** unit:.3f}{UNITS[unit]}"
+
+
+def build_catalog(csv_path: str, catalog_path: str):
+    """
+    Build the binary catalog from the dataset csv
+
+    The packaged catalog must be rebuilt whenever r_dataset.csv changes:
+    python -m nsdf_dark_matter_cli.catalog src/nsdf_dark_matter_cli/r_dataset.csv src/nsdf_dark_matter_cli/r_dataset.cat
+    ----------------------------
+    Parameters
+    ----------
+    csv_path(str): the path to a csv with filename, size and rseries columns
+    catalog_path(str): the path to write the catalog to
+    """
+    rows = []
+    rseries = []
+    with open(csv_path, "r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            match = re.match(SIZE_PATTERN, row["size"])
+            name = row["filename"].encode()
+            if match is None or len(name) != 19:
+                raise ValueError(f"cannot store {row['filename']},{row['size']} in the catalog")
+
+            if row["rseries"] not in rseries:
+                rseries.append(row["rseries"])
+            whole, fraction, unit = match.groups()
+            rows.append((name, UNITS.index(unit), rseries.index(row["rseries"]), int(whole) * 1000 + int(fraction)))
+
+    rows.sort()
+    with open(catalog_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(rows), len(rseries)))
+        for series in rseries:
+            f.write(RSERIES.pack(series.encode()))
+        for row in rows:
+            f.write(RECORD.pack(*row))
+
+
+if __name__ == "__main__":
+    import sys
+    build_catalog(sys.argv[1], sys.argv[2])
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from .cache import Cache
+
+CHECKSUMS_FILE = ".checksums.json"
+READ_SIZE = 1024 * 1024
+# mids held at once while their files are hashed, bounds the open lock files
+LEASE_WINDOW = 64
+
+
+class BlockHasher:
+    """
+    Incremental tree hash of a byte stream
+
+    The stream is cut into block_size blocks and the digest is the sha256 of the concatenated sha256 of every block. Blocks
+    are independent, so the byte ranges of an object downloaded in parallel are hashed as they arrive and combined with
+    tree_digest once every range is in place.
+
+    Attributes
+    ----------
+    block_size(int): the size of every block but the last
+
+    Methods
+    -------
+    update(data): hash the next bytes of the stream
+    hexdigest(): the tree digest of the stream so far
+    """
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self._blocks = []
+        self._block = hashlib.sha256()
+        self._filled = 0
+
+    def update(self, data: bytes):
+        view = memoryview(data)
+        while len(view) > 0:
+            n = min(len(view), self.block_size - self._filled)
+            self._block.update(view[:n])
+            self._filled += n
+            view = view[n:]
+
+            if self._filled == self.block_size:
+                self._blocks.append(self._block.digest())
+                self._block = hashlib.sha256()
+                self._filled = 0
+
+    def hexdigest(self) -> str:
+        blocks = self._blocks + ([self._block.digest()] if self._filled > 0 else [])
+        return tree_digest(blocks)
+
+
+def tree_digest(block_digests: list[bytes]) -> str:
+    """
+    Combine the digests of the blocks of an object
+    ----------------------------
+    Parameters
+    ----------
+    block_digests(list[bytes]): the sha256 digest of every block, in order
+
+    Returns
+    -------
+    str: the hex digest of the object
+    """
+    return hashlib.sha256(b"".join(block_digests)).hexdigest()
+
+
+def checksum_file(path: str, block_size: int) -> str:
+    """
+    Compute the tree digest of a file
+    ----------------------------
+    Parameters
+    ----------
+    path(str): the path to the file
+    block_size(int): the block size the digest was recorded with
+
+    Returns
+    -------
+    str: the hex digest of the file
+    """
+    hasher = BlockHasher(block_size)
+    with open(path, "rb") as f:
+        while chunk := f.read(READ_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def read_checksums(mid_dir: str) -> dict:
+    """
+    Read the checksums recorded for a mid directory
+    ----------------------------
+    Parameters
+    ----------
+    mid_dir(str): the path to the mid directory
+
+    Returns
+    -------
+    dict: per file relative to mid_dir, its size, block_size and sha256 tree digest. Empty if nothing was recorded.
+    """
+    path = os.path.join(mid_dir, CHECKSUMS_FILE)
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_checksums(mid_dir: str, checksums: dict):
+    """
+    Record the checksums of a mid directory
+    ----------------------------
+    Parameters
+    ----------
+    mid_dir(str): the path to the mid directory
+    checksums(dict): per file relative to mid_dir, its size, block_size and sha256 tree digest
+    """
+    path = os.path.join(mid_dir, CHECKSUMS_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checksums, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def verify(idx_dir: str, mids: list[str] | None = None, workers: int | None = None) -> dict[str, list[tuple[str, str]]]:
+    """
+    Check the files of downloaded mids against their recorded checksums
+
+    Files are hashed in parallel across processes. A mid is leased while its files are checked, so it is not evicted or
+    repaired meanwhile.
+    ----------------------------
+    Parameters
+    ----------
+    idx_dir(str): the directory mids are downloaded to
+    mids(list[str]|None): the mids to check, every mid directory of idx_dir if None
+    workers(int|None): the number of processes, the number of cores if None
+
+    Returns
+    -------
+    dict[str, list[tuple[str, str]]]: per mid, the (file, problem) of every file that failed the check. A mid without
+    recorded checksums reports a single problem with an empty file name.
+    """
+    if mids is None:
+        mids = sorted(name for name in os.listdir(idx_dir)
+                      if not name.startswith(".") and os.path.isdir(os.path.join(idx_dir, name)))
+
+    cache = Cache(idx_dir)
+    problems = {mid: [] for mid in mids}
+    # (mid, lease, [(file, expected, digest future)]) of the mids being hashed, oldest first
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            for mid in mids:
+                if len(pending) == LEASE_WINDOW:
+                    _collect(pending.popleft(), problems)
+
+                lease = cache.lease(mid)
+                jobs = []
+                pending.append((mid, lease, jobs))
+                mid_dir = os.path.join(idx_dir, mid)
+                checksums = read_checksums(mid_dir)
+                if not checksums:
+                    problems[mid].append(("", "no checksums recorded"))
+                    continue
+
+                for file, expected in sorted(checksums.items()):
+                    path = os.path.join(mid_dir, file)
+                    if not os.path.exists(path):
+                        problems[mid].append((file, "missing"))
+                    elif os.path.getsize(path) != expected["size"]:
+                        problems[mid].append((file, f"size {os.path.getsize(path)} does not match {expected['size']}"))
+                    else:
+                        jobs.append((file, expected, executor.submit(checksum_file, path, expected["block_size"])))
+
+            while pending:
+                _collect(pending.popleft(), problems)
+        finally:
+            for _, lease, _ in pending:
+                lease.release()
+
+    return problems
+
+
+def _collect(entry: tuple, problems: dict[str, list[tuple[str, str]]]):
+    """
+    Wait for the digests of a mid and release its lease
+    """
+    mid, lease, jobs = entry
+    try:
+        for file, expected, digest in jobs:
+            if digest.result() != expected["sha256"]:
+                problems[mid].append((file, "checksum mismatch"))
+    finally:
+        lease.release()
@@ -1,14 +1,14 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import typer
 from typing_extensions import Annotated
 import os
-import csv
-from importlib import resources
+from contextlib import nullcontext
+from enum import Enum
 from importlib.metadata import version as semver
 from rich import print as richprint
 from rich.console import Console
 from rich.progress import Progress, BarColumn, DownloadColumn, TransferSpeedColumn, TimeRemainingColumn, TextColumn
-from .download import download_routine
+from .catalog import DatasetCatalog, format_size, load_catalog, parse_size
+from .defaults import DRY_RUN_BANDWIDTH, MAX_CONNECTIONS, PER_HOST_CONNECTIONS, RESOLVE_WORKERS, RETRIES
 
 
 app = typer.Typer(no_args_is_help=True, help="NSDF Dark Matter CLI")
@@ -22,24 +22,34 @@ progress = Progress(
 )
 
 
-def load_dataset():
+class Engine(str, Enum):
+    threads = "threads"
+    asyncio = "async"
+
+
+def load_dataset() -> DatasetCatalog:
     """
     Load Available Dataset
     """
     try:
-        dataset = []
-        with resources.files("nsdf_dark_matter_cli").joinpath("r_dataset.csv").open("r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                dataset.append([row["filename"], row["size"], row["rseries"]])
+        return load_catalog()
     except Exception as e:
         richprint(f"[bold red]Failed to load dataset: {e}[/bold red]")
         raise typer.Exit(code=1)
 
-    return dataset
 
+def parse_size_option(size: str | None) -> int | None:
+    """
+    Parse a size option, i.e, 100MiB
+    """
+    if size is None:
+        return None
 
-DATASET = load_dataset()
+    try:
+        return parse_size(size)
+    except ValueError as e:
+        richprint(f"[bold red]{e}[/bold red]")
+        raise typer.Exit(code=1)
 
 
 @app.command()
@@ -52,30 +62,43 @@ def version():
 
 @app.command()
 def ls(prefix: Annotated[str, typer.Option("--prefix","-p",help="List all files that start with prefix")] = "",
-       limit: Annotated[int, typer.Option("--limit","-l",help="The number of files to show")] = None):
+       limit: Annotated[int, typer.Option("--limit","-l",help="The number of files to show")] = None,
+       rseries: Annotated[str, typer.Option("--rseries","-r",help="List the files of a run series, i.e, R76")] = None,
+       min_size: Annotated[str, typer.Option("--min-size",help="List files of at least this size, i.e, 100MiB")] = None,
+       max_size: Annotated[str, typer.Option("--max-size",help="List files of at most this size, i.e, 1GiB")] = None):
     """
     List all available files
     """
+    dataset = load_dataset()
+    filtered = prefix or rseries is not None or min_size is not None or max_size is not None
+    limit = (1_000_000 if filtered else 10) if (limit is None or limit < 0) else limit
 
-    is_match = (lambda f: f.startswith(prefix)) if prefix else (lambda _: True)
-    limit = (1_000_000 if prefix else 10) if (limit is None or limit < 0) else limit
-
-    for entry in DATASET:
-        if limit <= 0:
-            break
+    for index in dataset.find(prefix, rseries, parse_size_option(min_size), parse_size_option(max_size), limit):
+        filename, size, rseries = dataset[index]
+        richprint(f"[bold green]{filename}\t{size}\t{rseries}[/bold green]")
 
-        filename, size, rseries = entry
-        if is_match(filename):
-            richprint(f"[bold green]{filename}\t{size}\t{rseries}[/bold green]")
-            limit -= 1
-
-    richprint(f"[bold blue]Total Files Available: {len(DATASET)}[/bold blue]")
+    richprint(f"[bold blue]Total Files Available: {len(dataset)}[/bold blue]")
 
 
 @app.command()
 def download(
     filename: Annotated[ str, typer.Argument( help="The name of the file to download, i.e, 07180808_1558_F0001"), ] = "",
-    filelist: Annotated[str, typer.Option("--file-list", "-f", help="A path to a text file listing the files to download")] = ""
+    filelist: Annotated[str, typer.Option("--file-list", "-f", help="A path to a text file listing the files to download")] = "",
+    prefix: Annotated[str, typer.Option("--prefix", "-p", help="Download all files that start with prefix")] = "",
+    rseries: Annotated[str, typer.Option("--rseries", "-r", help="Download the files of a run series, i.e, R76")] = None,
+    min_size: Annotated[str, typer.Option("--min-size", help="Download files of at least this size, i.e, 100MiB")] = None,
+    max_size: Annotated[str, typer.Option("--max-size", help="Download files of at most this size, i.e, 1GiB")] = None,
+    limit: Annotated[int, typer.Option("--limit", "-l", min=0, help="The number of files selected by prefix, rseries and size")] = None,
+    dry_run: Annotated[bool, typer.Option("--dry-run", help="Show the files that would be downloaded and the estimated time")] = False,
+    bandwidth: Annotated[str, typer.Option("--bandwidth", help="The transfer rate per second used to estimate time, i.e, 100MiB")] = DRY_RUN_BANDWIDTH,
+    max_connections: Annotated[int, typer.Option("--max-connections", "-c", min=1, help="The number of concurrent requests")] = MAX_CONNECTIONS,
+    per_host: Annotated[int, typer.Option("--per-host", min=1, help="The number of concurrent requests against a single host")] = PER_HOST_CONNECTIONS,
+    retries: Annotated[int, typer.Option("--retries", min=0, help="The number of times a failed request is retried")] = RETRIES,
+    resolve_workers: Annotated[int, typer.Option("--resolve-workers", min=1, help="The number of concurrent download url lookups")] = RESOLVE_WORKERS,
+    cache_quota: Annotated[str, typer.Option("--cache-quota", help="Evict the least recently used datasets beyond this size, i.e, 500GiB")] = None,
+    engine: Annotated[Engine, typer.Option("--engine", help="The download engine, async requires nsdf-dark-matter-cli[async]")] = Engine.threads,
+    report: Annotated[str, typer.Option("--report", help="Write per file transfer metrics to a .json or .csv file")] = None,
+    stats_interval: Annotated[float, typer.Option("--stats-interval", min=0.1, help="Print a line of transfer stats every this many seconds, i.e, for batch jobs")] = None
 ):
     """
     Download a Dataset
@@ -87,27 +110,238 @@ def download(
         if os.path.exists(filelist):
             with open(filelist, "r") as f:
                 for line in f:
-                    files.add(line.strip())
+                    if line.strip():
+                        files.add(line.strip())
         else:
             errors.append(f"[bold red]path: {filelist} does not exists [/bold red]")
-    else:
+    elif filename.strip():
         files.add(filename.strip())
 
+    selected = prefix or rseries is not None or min_size is not None or max_size is not None
+    if limit is not None and not selected:
+        richprint("[bold red]--limit requires --prefix, --rseries, --min-size or --max-size[/bold red]")
+        raise typer.Exit(code=1)
+
+    dataset = load_dataset()
+    if selected:
+        indices = dataset.find(prefix, rseries, parse_size_option(min_size), parse_size_option(max_size), limit)
+        files.update(dataset[index][0] for index in indices)
+
     if len(files) < 1:
+        for err in errors:
+            richprint(err)
         richprint("[bold red]Must provide at least 1 file[/bold red]")
         return
 
-    with progress:
-        with ThreadPoolExecutor(max_workers=min(len(files), 16)) as executor:
-            futures = [executor.submit(download_routine, file, progress) for file in files]
+    plan = plan_downloads(dataset, files)
+    total = sum(nbytes for _, nbytes in plan if nbytes is not None)
+    unsized = sum(nbytes is None for _, nbytes in plan)
+    richprint(f"[bold blue]Planned {len(plan)} dataset(s), {format_size(total)} in total"
+              + (f" ({unsized} not in the catalog)" if unsized else "") + "[/bold blue]")
+
+    if dry_run:
+        for midfile, nbytes in plan:
+            size = format_size(nbytes) if nbytes is not None else "unknown size"
+            richprint(f"[bold green]{midfile}\t{size}[/bold green]")
+        rate = parse_size_option(bandwidth)
+        if rate <= 0:
+            richprint("[bold red]--bandwidth must be greater than 0[/bold red]")
+            raise typer.Exit(code=1)
+        richprint(f"[bold blue]Estimated transfer time: {format_duration(total / rate)} at {format_size(rate)}/s[/bold blue]")
+        return
+
+    from .cache import Cache
+    from .download import Downloader, IDX_FILES_DIR
 
-            for future in as_completed(futures):
-                midfile, result = future.result()
-                if isinstance(result, Exception):
-                    errors.append(f"[bold red] {result} [/bold red]")
+    if engine == Engine.asyncio:
+        try:
+            from .async_download import AsyncDownloader as Downloader
+        except ImportError as e:
+            richprint(f"[bold red]{e}[/bold red]")
+            raise typer.Exit(code=1)
+
+    from .telemetry import StatsReporter, Telemetry
+
+    cache = Cache(IDX_FILES_DIR, quota=parse_size_option(cache_quota))
+    telemetry = Telemetry()
+    downloader = Downloader(progress, max_connections=max_connections, per_host=per_host, retries=retries,
+                            resolve_workers=resolve_workers, cache=cache, telemetry=telemetry)
+    stats = nullcontext()
+    if stats_interval is not None:
+        stats = StatsReporter(telemetry, stats_interval, lambda line: progress.console.print(line, markup=False, highlight=False))
+    with progress, stats:
+        for midfile, result in downloader.download([midfile for midfile, _ in plan]):
+            if isinstance(result, Exception):
+                errors.append(f"[bold red] {result} [/bold red]")
+
+    if report:
+        telemetry.write_report(report)
+        richprint(f"[bold blue]Transfer report written to {report}[/bold blue]")
 
     if len(errors) > 0:
         for err in errors:
             richprint(err)
     else:
         richprint(f"[bold green]Successfully downloaded {len(files)} dataset(s)![/bold green]")
+
+
+def plan_downloads(dataset: DatasetCatalog, files: set[str]) -> list[tuple[str, int | None]]:
+    """
+    Order files largest first, so the longest transfers start early and parallel workers finish together
+    ----------------------------
+    Parameters
+    ----------
+    dataset(DatasetCatalog): the catalog to size files with
+    files(set[str]): the files to download, i.e, 07180808_1558_F0001 or 07180808_1558_F0001.mid.gz
+
+    Returns
+    -------
+    list[tuple[str, int|None]]: every file with its size in bytes, None if the catalog does not list it
+    """
+    plan = []
+    for midfile in files:
+        index = dataset.lookup(midfile.removesuffix(".mid.gz"))
+        plan.append((midfile, dataset.nbytes(index) if index is not None else None))
+
+    # unsized files go last
+    return sorted(plan, key=lambda entry: (entry[1] is None, -(entry[1] or 0), entry[0]))
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Format a duration, i.e, 1h 02m 05s
+    """
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m {seconds:02d}s"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
+
+
+@app.command()
+def verify(
+    mids: Annotated[list[str] | None, typer.Argument(help="The mids to verify, i.e, 07180808_1558_F0001. Every downloaded mid if none")] = None,
+    repair: Annotated[bool, typer.Option("--repair", "-r", help="Download corrupt and missing files again")] = False,
+    workers: Annotated[int | None, typer.Option("--workers", "-w", min=1, help="The number of processes hashing files")] = None
+):
+    """
+    Verify downloaded datasets against their checksums
+    """
+    from .cache import Cache, CacheBusyError
+    from .checksum import verify as verify_checksums
+    from .download import Downloader, IDX_FILES_DIR
+
+    if not os.path.isdir(IDX_FILES_DIR):
+        richprint(f"[bold red]path: {IDX_FILES_DIR} does not exists [/bold red]")
+        raise typer.Exit(code=1)
+
+    problems = verify_checksums(IDX_FILES_DIR, mids or None, workers)
+    corrupt = []
+    for mid, mid_problems in problems.items():
+        for file, problem in mid_problems:
+            if not file:
+                richprint(f"[bold yellow]{mid}: {problem}, download it again to record them[/bold yellow]")
+            else:
+                richprint(f"[bold red]{mid}/{file}: {problem}[/bold red]")
+        if any(file for file, _ in mid_problems):
+            corrupt.append(mid)
+
+    if corrupt and repair:
+        local_cache = Cache(IDX_FILES_DIR)
+        busy, withdrawn = [], []
+        for mid in corrupt:
+            # unpublished first, so no reader sees the mid while its corrupt files are removed
+            try:
+                staging = local_cache.withdraw(mid)
+            except CacheBusyError as e:
+                richprint(f"[bold yellow]{e}, not repaired[/bold yellow]")
+                busy.append(mid)
+                continue
+            with staging:
+                for file, _ in problems[mid]:
+                    if os.path.exists(os.path.join(staging.path, file)):
+                        os.remove(os.path.join(staging.path, file))
+            withdrawn.append(mid)
+
+        with progress:
+            results = Downloader(progress).download(withdrawn)
+
+        corrupt = busy
+        for mid, result in results:
+            if isinstance(result, Exception):
+                richprint(f"[bold red] {result} [/bold red]")
+                corrupt.append(mid)
+            else:
+                richprint(f"[bold green]Repaired {mid}[/bold green]")
+
+    if corrupt:
+        raise typer.Exit(code=1)
+
+    richprint(f"[bold green]Verified {len(problems)} dataset(s)![/bold green]")
+
+
+@app.command()
+def cache(
+    pin: Annotated[list[str] | None, typer.Option("--pin", help="Keep a dataset from being evicted, i.e, 07180808_1558_F0001")] = None,
+    unpin: Annotated[list[str] | None, typer.Option("--unpin", help="Allow a pinned dataset to be evicted again")] = None,
+    evict: Annotated[str, typer.Option("--evict", help="Evict the least recently used datasets beyond this size, i.e, 500GiB")] = None
+):
+    """
+    List and manage downloaded datasets
+    """
+    from .cache import Cache
+    from .download import IDX_FILES_DIR
+
+    local_cache = Cache(IDX_FILES_DIR)
+    for mid in pin or []:
+        if not local_cache.contains(mid):
+            richprint(f"[bold red]{mid} is not downloaded[/bold red]")
+            raise typer.Exit(code=1)
+        local_cache.pin(mid)
+    for mid in unpin or []:
+        local_cache.unpin(mid)
+
+    if evict is not None:
+        for mid in local_cache.evict(parse_size_option(evict)):
+            richprint(f"[bold yellow]Evicted {mid}[/bold yellow]")
+
+    entries = local_cache.entries()
+    for entry in reversed(entries):
+        pinned = "\tpinned" if entry.pinned else ""
+        richprint(f"[bold green]{entry.mid}\t{format_size(entry.size)}{pinned}[/bold green]")
+    richprint(f"[bold blue]{len(entries)} dataset(s), {format_size(sum(entry.size for entry in entries))} in total[/bold blue]")
+
+
+@app.command()
+def convert(
+    mids: Annotated[list[str] | None, typer.Argument(help="The mids to convert, i.e, 07180808_1558_F0001. Every downloaded mid if none")] = None
+):
+    """
+    Convert downloaded datasets to an uncompressed channel store for fast repeated loading
+    """
+    try:
+        from nsdf_dark_matter.idx import transcode_channels
+    except ImportError:
+        richprint("[bold red]convert requires the NSDF Dark Matter Library 0.4.0 or later, install or upgrade nsdf-dark-matter-cli\\[convert][/bold red]")
+        raise typer.Exit(code=1)
+    from .cache import Cache
+    from .download import IDX_FILES_DIR
+
+    local_cache = Cache(IDX_FILES_DIR)
+    failed = False
+    for mid in mids or [entry.mid for entry in local_cache.entries()]:
+        try:
+            # the mid is not evicted while it is converted
+            with local_cache.use(mid):
+                path = transcode_channels(local_cache.path(mid))
+                local_cache.refresh(mid)
+        except Exception as e:
+            richprint(f"[bold red]{mid}: {e}[/bold red]")
+            failed = True
+            continue
+        richprint(f"[bold green]Converted {mid} to {path}[/bold green]")
+
+    if failed:
+        raise typer.Exit(code=1)
@@ -0,0 +1,10 @@
+# Download defaults shared by the CLI options and the download engine. This module stays free of heavy imports so the CLI
+# can read them without loading the HTTP stack.
+
+MAX_CONNECTIONS = 16
+PER_HOST_CONNECTIONS = 8
+RETRIES = 5
+RESOLVE_WORKERS = 8
+
+# the transfer rate assumed by download --dry-run
+DRY_RUN_BANDWIDTH = "100MiB"
@@ -1,15 +1,56 @@
+import hashlib
+import json
 import os
 import re
+import threading
+import time
 import requests
-import typer
-from concurrent.futures import ThreadPoolExecutor
-from concurrent.futures import as_completed
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
 from rich.progress import Progress
+from urllib.parse import parse_qs, urlparse
+from urllib3.util import Retry
+from .cache import COMPLETE_MARKER, Cache, CacheBusyError
+from .checksum import BlockHasher, checksum_file, read_checksums, tree_digest, write_checksums
+from .telemetry import Telemetry
+from .defaults import MAX_CONNECTIONS, PER_HOST_CONNECTIONS, RESOLVE_WORKERS, RETRIES
 
 IDX_FILES_DIR = "./idx"
+GEN_URL_ENDPOINT = "https://services.nationalsciencedatafabric.org/api/v1/darkmatter/gen-url"
 MID_PATTERN = r"^\d{8}_\d{4}_F\d{4}$"
 FILE_PATTERN = r"^\d{8}_\d{4}_F\d{4}\.mid\.gz$"
 
+CHUNK_SIZE = 1024 * 1024
+PART_SIZE = 64 * 1024 * 1024
+MANIFEST_INTERVAL = 8 * 1024 * 1024
+CONTENT_RANGE_PATTERN = r"^bytes \d+-\d+/(\d+)$"
+MD5_ETAG_PATTERN = r"^[0-9a-f]{32}$"
+
+BACKOFF = 0.5
+TIMEOUT = (10, 60)
+RETRY_STATUS = (429, 500, 502, 503, 504)
+EXPIRY_MARGIN = 60
+
+
+class DownloadError(Exception):
+    """
+    Raised when an object cannot be retrieved from storage
+    """
+
+
+class ExpiredUrlError(DownloadError):
+    """
+    Raised when storage rejects a presigned url, usually because it expired
+    """
+
+
+class InterruptedTransferError(DownloadError):
+    """
+    Raised when a transfer stops part way through the body of a response
+    """
+
 
 def isvalid_midfile(filename: str) -> bool:
     """
@@ -22,28 +63,32 @@ def isvalid_midfile(filename: str) -> bool:
     return filename != "" and (re.match(MID_PATTERN, filename) != None or re.match(FILE_PATTERN, filename) != None)
 
 
-def download_routine(midfile: str, progress: Progress) -> tuple[str, Exception | None]:
+def create_session(max_connections: int = MAX_CONNECTIONS, retries: int = RETRIES, backoff: float = BACKOFF) -> requests.Session:
     """
-    UI Wrapper of download_dataset
+    Create the HTTP session shared by every request of a download
+
+    Connections are kept alive and reused across requests to the same host, and failed connections or throttled/5xx
+    responses are retried with exponential backoff. This is the only layer retrying requests, a transfer failing once its
+    response arrived is retried by the Downloader.
     ----------------------------
     Parameters
     ----------
-    midfile(str): the filename to download
-    progress: The rich Progress object to keep track of downloads
+    max_connections(int): the number of connections kept open per host
+    retries(int): the number of times a request is retried
+    backoff(float): the base of the exponential backoff between retries, in seconds
 
     Returns
     -------
-    Tuple(str, Exception|None): Returns an exception if input is invalid or operation failed, otherwise none.
+    requests.Session: the session
     """
-    if not isvalid_midfile(midfile):
-        return (midfile, ValueError(f"[bold red]Must provide a valid mid file identifier,  i.e, 07180808_1558_F0001. File {midfile} is not valid[/bold red]"))
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUS, allowed_methods=["GET"],
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_maxsize=max_connections, max_retries=retry)
 
-    try:
-        download_dataset(midfile, progress)
-        return (midfile, None)
-
-    except Exception as e:
-        return (midfile, e)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 
 def download_dataset(midfile: str, progress: Progress):
@@ -55,68 +100,805 @@ def download_dataset(midfile: str, progress: Progress):
     file(str): the mid file to download in the the format 07180808_1558_F0001
     progress: The rich Progress object to keep track of downloads
     """
-    local_path = os.path.join(IDX_FILES_DIR, midfile)
-    if os.path.exists(local_path):
-        return
+    [(_, error)] = Downloader(progress).download([midfile])
+    if error is not None:
+        raise error
+
+
+class _MidTransfer:
+    """
+    The state of a mid being downloaded
+    """
+
+    def __init__(self, mid: str):
+        self.mid = mid
+        self.staging = None
+        self.local_path = None
+        self.remaining = 0
+        self.error = None
+        self.recorded = {}
+        self.checksums = {}
+        self.lock = threading.Lock()
+
+
+class _ObjectTransfer:
+    """
+    The state of an object being downloaded, the .bin files go under a nested mid directory
+    """
+
+    def __init__(self, mid_transfer: _MidTransfer, key: str):
+        self.mid_transfer = mid_transfer
+        self.key = key
+        self.file = os.path.basename(self.key)
+        _, ext = os.path.splitext(self.file)
+
+        if ext == ".bin":
+            self.target_path = os.path.join(mid_transfer.local_path, mid_transfer.mid, self.file)
+        else:
+            self.target_path = os.path.join(mid_transfer.local_path, self.file)
+
+        self.relpath = os.path.relpath(self.target_path, mid_transfer.local_path)
+        self.part_path = self.target_path + ".part"
+        self.manifest_path = self.part_path + ".json"
+        self.manifest = None
+        self.size = 0
+        self.etag = None
+        self.hashers = []
+        self.stream_hasher = None
+        self.md5 = None
+        self.remaining = 0
+        self.error = None
+        self.task_id = None
+        self.metrics = None
+        self.lock = threading.Lock()
+
+
+class UrlResolver:
+    """
+    Resolve the presigned urls of mids through the gen-url endpoint
+
+    The endpoint answers a single mid per request, so lookups run concurrently on a pool of their own, apart from the
+    transfer workers, and are issued ahead of the transfers that need them. Resolved urls are cached until shortly before
+    they expire (from their X-Amz-Date and X-Amz-Expires parameters), concurrent lookups of the same mid share one
+    request.
+
+    Attributes
+    ----------
+    session(requests.Session): the session to request the endpoint with
+    workers(int): the number of concurrent lookups
+    margin(float): seconds before expiry at which a cached url is no longer handed out
+    telemetry(Telemetry|None): records the latency of every lookup
+
+    Methods
+    -------
+    submit(mid, refresh): start resolving a mid, returns a Future of the object key to url mapping
+    resolve(mid, refresh): resolve a mid and wait for the object key to url mapping
+    close(): stop the lookup workers
+    """
 
-    response = requests.get("https://services.nationalsciencedatafabric.org/api/v1/darkmatter/gen-url", params={"filename" : midfile})
+    def __init__(self, session: requests.Session, workers: int = RESOLVE_WORKERS, margin: float = EXPIRY_MARGIN,
+                 telemetry: Telemetry | None = None):
+        self.session = session
+        self.workers = workers
+        self.margin = margin
+        self.telemetry = telemetry
 
-    if response.status_code != 200:
-        typer.secho("could not retrieve object resource", fg=typer.colors.RED)
-        raise typer.Exit(code=1)
+        self._cache = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
 
-    urls = response.json()['urls']
-    os.makedirs(local_path, exist_ok=True)
+    def submit(self, mid: str, refresh: bool = False) -> Future:
+        """
+        Start resolving a mid
+        ----------------------------
+        Parameters
+        ----------
+        mid(str): the mid in the format 07180808_1558_F0001
+        refresh(bool): ignore the cached urls of the mid
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(download_file, local_path, midfile, kv, progress) for kv in urls]
+        Returns
+        -------
+        Future[dict[str, str]]: the url of every object key of the mid
+        """
+        with self._lock:
+            if not refresh and mid in self._cache:
+                urls, expires_at = self._cache[mid]
+                if expires_at is None or time.time() < expires_at - self.margin:
+                    future = Future()
+                    future.set_result(urls)
+                    return future
 
-        for future in as_completed(futures):
-            future.result()
+            if mid not in self._inflight:
+                self._inflight[mid] = self._executor.submit(self._fetch, mid)
+                self._inflight[mid].add_done_callback(lambda _: self._forget(mid))
+            return self._inflight[mid]
 
+    def resolve(self, mid: str, refresh: bool = False) -> dict[str, str]:
+        """
+        Resolve a mid
+        ----------------------------
+        Parameters
+        ----------
+        mid(str): the mid in the format 07180808_1558_F0001
+        refresh(bool): ignore the cached urls of the mid
 
-def download_file(local_path: str, midfile: str, kv, progress: Progress):
+        Returns
+        -------
+        dict[str, str]: the url of every object key of the mid
+        """
+        return self.submit(mid, refresh).result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _forget(self, mid: str):
+        with self._lock:
+            self._inflight.pop(mid, None)
+
+    def _fetch(self, mid: str) -> dict[str, str]:
+        started = time.monotonic()
+        response = self.session.get(GEN_URL_ENDPOINT, params={"filename" : mid}, timeout=TIMEOUT)
+        if self.telemetry is not None:
+            self.telemetry.resolved(mid, time.monotonic() - started)
+        if response.status_code != 200:
+            raise DownloadError(f"could not retrieve object resource {mid}: HTTP {response.status_code}")
+
+        urls = {kv['key']: kv['url'] for kv in response.json()['urls']}
+        if not urls:
+            raise DownloadError(f"no objects found for {mid}")
+
+        expiries = [expires_at for expires_at in map(url_expiry, urls.values()) if expires_at is not None]
+        with self._lock:
+            self._cache[mid] = (urls, min(expiries) if expiries else None)
+        return urls
+
+
+def url_expiry(url: str) -> float | None:
     """
-    Download a file from storage
+    Get the time a presigned url expires at
     ----------------------------
     Parameters
     ----------
-    local_path(str): the local path to write the file to
-    midfile(str): the midfile to download
-    kv: The key and url of the object
-    progress: The rich Progress object to keep track of downloads
+    url(str): the url, signed with AWS signature v4 query parameters
+
+    Returns
+    -------
+    float | None: the expiry as seconds since the epoch, None if the url does not carry one
     """
-    key, url = kv['key'], kv['url']
-    file = os.path.basename(key)
-    _, ext = os.path.splitext(file)
-
-    b_resp = requests.get(url, stream=True)
-    if b_resp.status_code != 200:
-        typer.secho("could not retrieve object resource", fg=typer.colors.RED)
-        raise typer.Exit(code=1)
-
-    total_size = int(b_resp.headers.get("Content-Length", 0))
-
-    target_path = ""
-    if ext == ".bin":
-        bin_dir = os.path.join(local_path, midfile)
-        os.makedirs(bin_dir, exist_ok=True)
-        target_path = os.path.join(bin_dir, file)
-    else:
-        target_path = os.path.join(local_path, file)
-
-    # keep track of progress for this file
-    task_id = progress.add_task(
-        "download",
-        filename=f"{midfile}/{file}",
-        total=total_size
-    )
-
-    with open(target_path, "wb") as f:
-        for chunk in b_resp.iter_content(chunk_size=1024*1024):
-            f.write(chunk)
-            # update task progress
-            progress.update(task_id, advance=len(chunk))
-
-    # finished file download task
-    progress.remove_task(task_id)
+    query = parse_qs(urlparse(url).query)
+    try:
+        signed_at = datetime.strptime(query["X-Amz-Date"][0], "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+        return signed_at.timestamp() + int(query["X-Amz-Expires"][0])
+    except (KeyError, ValueError):
+        return None
+
+
+class Downloader:
+    """
+    Download many mids over a single connection pool and work queue
+
+    Every object and byte range of every mid is a task on one shared queue served by max_connections workers, so the
+    number of open sockets is bounded regardless of how many mids are requested. On top of that, at most per_host requests
+    run against the same host at a time. Urls are resolved by a UrlResolver up to lookahead mids ahead of the transfers,
+    so transfer workers do not wait on the gen-url endpoint, and are resolved again once expired.
+
+    Large objects are downloaded as parallel byte ranges into a <file>.part file, renamed into place once complete. The
+    progress of every range is persisted in a <file>.part.json manifest, interrupted ranges are retried with exponential
+    backoff and an interrupted run resumes from the manifest. A mid gets a .complete marker once every object is in place
+    and is skipped by later runs, files already matching the size of the remote object are not downloaded again.
+
+    Mids are written to the staging directory of the cache and published into it once complete, so other processes
+    sharing the cache never see a partial mid. A mid staged by another process at the same time fails with
+    CacheBusyError.
+
+    Attributes
+    ----------
+    progress(Progress): the rich Progress object to keep track of downloads
+    session(requests.Session): the session shared by every request
+    resolver(UrlResolver): resolves and caches the urls of every mid
+    cache(Cache): the cache the mids are published to
+    telemetry(Telemetry): the metrics of every lookup and object transfer
+    max_connections(int): the number of concurrent requests
+    per_host(int): the number of concurrent requests against a single host
+    lookahead(int): the number of mids being resolved or transferred at a time
+    retries(int): the number of times a request or range is retried
+    backoff(float): the base of the exponential backoff between retries, in seconds
+
+    Methods
+    -------
+    download(midfiles): download every mid and report the outcome of each
+    """
+
+    def __init__(self, progress: Progress, max_connections: int = MAX_CONNECTIONS, per_host: int = PER_HOST_CONNECTIONS,
+                 retries: int = RETRIES, backoff: float = BACKOFF, resolve_workers: int = RESOLVE_WORKERS,
+                 lookahead: int | None = None, cache: Cache | None = None, telemetry: Telemetry | None = None):
+        if max_connections < 1 or per_host < 1 or resolve_workers < 1:
+            raise ValueError(f"connection limits must be at least 1, got max_connections={max_connections} "
+                             f"per_host={per_host} resolve_workers={resolve_workers}")
+
+        self.progress = progress
+        self.max_connections = max_connections
+        self.per_host = per_host
+        self.lookahead = lookahead if lookahead is not None else 2 * max_connections + resolve_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.session = create_session(max_connections + resolve_workers, retries, backoff)
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.resolver = UrlResolver(self.session, workers=resolve_workers, telemetry=self.telemetry)
+        self.cache = cache if cache is not None else Cache(IDX_FILES_DIR)
+
+        self._host_slots = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._queue = deque()
+        self._active = 0
+        self._executor = None
+
+    def download(self, midfiles: list[str]) -> list[tuple[str, Exception | None]]:
+        """
+        Download the mids and wait for every transfer to finish
+        ----------------------------
+        Parameters
+        ----------
+        midfiles(list[str]): the mids to download in the format 07180808_1558_F0001
+
+        Returns
+        -------
+        list[tuple[str, Exception|None]]: per mid, an exception if the input is invalid or the download failed, otherwise None
+        """
+        results = []
+        transfers = []
+        for midfile in midfiles:
+            if isvalid_midfile(midfile):
+                transfers.append(_MidTransfer(midfile))
+            else:
+                results.append((midfile, ValueError(f"[bold red]Must provide a valid mid file identifier,  i.e, 07180808_1558_F0001. File {midfile} is not valid[/bold red]")))
+
+        with ThreadPoolExecutor(max_workers=self.max_connections) as executor:
+            self._executor = executor
+            with self._lock:
+                self._queue.extend(transfers)
+                self._pending += 1
+            # the extra hold keeps the queue from reading as drained until every mid has been fed
+            self._feed()
+            self._release()
+
+            with self._idle:
+                self._idle.wait_for(lambda: self._pending == 0)
+            self._executor = None
+
+        return results + [(transfer.mid, transfer.error) for transfer in transfers]
+
+    ### SCHEDULING ###
+
+    def _feed(self):
+        """
+        Start resolving queued mids while fewer than lookahead mids are in flight
+        """
+        while True:
+            with self._lock:
+                if not self._queue or self._active >= self.lookahead:
+                    return
+                mid_transfer = self._queue.popleft()
+                self._active += 1
+                self._pending += 1
+
+            if self.cache.contains(mid_transfer.mid):
+                with self._lock:
+                    self._active -= 1
+                self._release()
+                continue
+
+            try:
+                mid_transfer.staging = self.cache.stage(mid_transfer.mid, blocking=False)
+                mid_transfer.local_path = mid_transfer.staging.path
+            except (CacheBusyError, OSError) as e:
+                mid_transfer.error = e
+                # finished here rather than through _mid_done, which feeds again and would recurse once per mid
+                self._settle(mid_transfer)
+                continue
+
+            if self.cache.contains(mid_transfer.mid):
+                # published by another process meanwhile
+                self._settle(mid_transfer)
+                continue
+
+            future = self.resolver.submit(mid_transfer.mid)
+            future.add_done_callback(lambda future, mid_transfer=mid_transfer: self._resolved(mid_transfer, future))
+
+    def _submit(self, fn, done, *args):
+        """
+        Queue a task, done is called with the exception it raised or None once it returns
+        """
+        with self._lock:
+            self._pending += 1
+        self._executor.submit(self._run, fn, done, *args)
+
+    def _run(self, fn, done, *args):
+        error = None
+        try:
+            fn(*args)
+        except Exception as e:
+            error = e
+
+        try:
+            done(error)
+        finally:
+            self._release()
+
+    def _release(self):
+        with self._idle:
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle.notify_all()
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        """
+        The semaphore limiting concurrent requests against the host of the url
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def _with_retries(self, obj: _ObjectTransfer, fn):
+        """
+        Call fn with the url of the object, retrying with exponential backoff when the connection fails part way through a
+        transfer. An expired url is resolved again before the next attempt. Failed connections and error statuses are
+        already retried by the session (see create_session), so they are not retried again here.
+        """
+        refresh = False
+        for attempt in range(self.retries + 1):
+            url = self.resolver.resolve(obj.mid_transfer.mid, refresh=refresh)[obj.key]
+            try:
+                with self._host_slot(url):
+                    return fn(url)
+            except (InterruptedTransferError, ExpiredUrlError) as e:
+                if attempt == self.retries:
+                    raise
+                refresh = isinstance(e, ExpiredUrlError)
+                obj.metrics.retries += 1
+                time.sleep(self.backoff * 2 ** attempt)
+
+    ### TASKS ###
+
+    def _resolved(self, mid_transfer: _MidTransfer, future: Future):
+        """
+        Queue the objects of a resolved mid
+        """
+        try:
+            urls = future.result()
+            os.makedirs(mid_transfer.local_path, exist_ok=True)
+            mid_transfer.recorded = read_checksums(mid_transfer.local_path)
+        except Exception as e:
+            mid_transfer.error = e
+            self._mid_done(mid_transfer)
+            self._release()
+            return
+
+        mid_transfer.remaining = len(urls)
+        for key in urls:
+            obj = _ObjectTransfer(mid_transfer, key)
+            obj.metrics = self.telemetry.start_object(mid_transfer.mid, obj.relpath)
+            self._submit(self._start_object, lambda error, obj=obj: self._start_done(obj, error), obj)
+        self._release()
+
+    def _start_object(self, obj: _ObjectTransfer):
+        """
+        Probe an object and queue its byte ranges
+        """
+        # a single byte request tells the object size and whether ranges are supported
+        obj.metrics.begin()
+        resp = self._with_retries(obj, lambda url: _probe(url, self.session))
+        obj.metrics.ttfb_seconds = resp.elapsed.total_seconds()
+
+        ranged = resp.status_code == 206
+        if ranged:
+            total_size = _content_range_size(resp.headers.get("Content-Range", ""))
+        else:
+            total_size = int(resp.headers.get("Content-Length", 0))
+
+        obj.size = obj.metrics.size = total_size
+        etag = resp.headers.get("ETag", "").strip('"')
+        obj.etag = etag if re.match(MD5_ETAG_PATTERN, etag) else None
+
+        if total_size > 0 and os.path.exists(obj.target_path) and os.path.getsize(obj.target_path) == total_size:
+            recorded = obj.mid_transfer.recorded.get(obj.relpath)
+            if recorded is None or recorded["size"] != total_size:
+                # downloaded before checksums were recorded
+                recorded = {"size": total_size, "block_size": PART_SIZE, "sha256": checksum_file(obj.target_path, PART_SIZE)}
+            self._record(obj, recorded)
+            obj.metrics.finish(skipped=True)
+            self._object_done(obj, None)
+            return
+
+        os.makedirs(os.path.dirname(obj.target_path), exist_ok=True)
+
+        # keep track of progress for this file
+        obj.task_id = self.progress.add_task(
+            "download",
+            filename=f"{obj.mid_transfer.mid}/{obj.file}",
+            total=total_size
+        )
+
+        if not ranged:
+            # without range support the object can only be streamed from the start
+            obj.remaining = 1
+            self._submit(self._fetch_stream, lambda error: self._part_done(obj, error), obj)
+            return
+
+        obj.manifest = _load_manifest(obj.manifest_path, obj.part_path, total_size)
+        if obj.manifest is None:
+            obj.manifest = {"size": total_size, "parts": _split_parts(total_size, PART_SIZE)}
+            with open(obj.part_path, "wb") as f:
+                f.truncate(total_size)
+            _write_manifest(obj.manifest_path, obj.manifest)
+
+        # every range is a block of the object checksum, hashed as its bytes arrive
+        parts = obj.manifest["parts"]
+        obj.hashers = [hashlib.sha256() for _ in parts]
+        obj.md5 = hashlib.md5() if obj.etag is not None and len(parts) == 1 else None
+        for hasher, (start, _, done) in zip(obj.hashers, parts):
+            if done > 0:
+                # bytes written by an interrupted run are hashed from disk
+                _hash_range(obj.part_path, start, done, [hasher] if start > 0 or obj.md5 is None else [hasher, obj.md5])
+
+        self.progress.update(obj.task_id, completed=sum(done for _, _, done in parts))
+        pending = [(i, part) for i, part in enumerate(parts) if part[2] < part[1] - part[0]]
+        if not pending:
+            self._finish_object(obj)
+            return
+
+        obj.remaining = len(pending)
+        for i, part in pending:
+            self._submit(self._fetch_part, lambda error: self._part_done(obj, error), obj, i, part)
+
+    def _start_done(self, obj: _ObjectTransfer, error: Exception | None):
+        # once started, the object is finished by its ranges
+        if error is not None:
+            self._object_done(obj, error)
+
+    def _fetch_part(self, obj: _ObjectTransfer, i: int, part: list[int]):
+        hashers = [obj.hashers[i]] if i > 0 or obj.md5 is None else [obj.hashers[i], obj.md5]
+        self._with_retries(obj, lambda url: _download_part(url, self.session, obj.part_path, part, obj.manifest,
+                                                           obj.manifest_path, obj.lock,
+                                                           lambda chunk: self._consume(obj, hashers, chunk)))
+
+    def _fetch_stream(self, obj: _ObjectTransfer):
+        def attempt(url: str):
+            # a retried stream starts over
+            with obj.lock:
+                self.progress.update(obj.task_id, completed=0)
+            obj.stream_hasher = BlockHasher(PART_SIZE)
+            obj.md5 = hashlib.md5() if obj.etag is not None and obj.size <= PART_SIZE else None
+            hashers = [obj.stream_hasher] + ([obj.md5] if obj.md5 is not None else [])
+            _download_stream(url, self.session, obj.part_path, lambda chunk: self._consume(obj, hashers, chunk))
+
+        self._with_retries(obj, attempt)
+
+    def _consume(self, obj: _ObjectTransfer, hashers: list, chunk: bytes):
+        for hasher in hashers:
+            hasher.update(chunk)
+        self.telemetry.add_bytes(obj.metrics, len(chunk))
+        with obj.lock:
+            self.progress.update(obj.task_id, advance=len(chunk))
+
+    def _part_done(self, obj: _ObjectTransfer, error: Exception | None):
+        with obj.lock:
+            obj.remaining -= 1
+            if obj.error is None:
+                obj.error = error
+            last = obj.remaining == 0
+        if last:
+            self._finish_object(obj)
+
+    def _finish_object(self, obj: _ObjectTransfer):
+        """
+        Move a complete object into place, a failed one keeps its partial file and manifest for the next run
+        """
+        error = obj.error
+        if error is None:
+            try:
+                if obj.md5 is not None and obj.md5.hexdigest() != obj.etag:
+                    # the bytes on disk cannot be trusted, the next run starts over
+                    os.remove(obj.part_path)
+                    if os.path.exists(obj.manifest_path):
+                        os.remove(obj.manifest_path)
+                    raise DownloadError(f"checksum mismatch for {obj.key}: md5 {obj.md5.hexdigest()} does not match ETag {obj.etag}")
+
+                if obj.stream_hasher is not None:
+                    digest = obj.stream_hasher.hexdigest()
+                else:
+                    digest = tree_digest([hasher.digest() for hasher in obj.hashers])
+
+                started = time.monotonic()
+                _fsync(obj.part_path)
+                obj.metrics.fsync_seconds += time.monotonic() - started
+
+                os.replace(obj.part_path, obj.target_path)
+                if os.path.exists(obj.manifest_path):
+                    os.remove(obj.manifest_path)
+                self._record(obj, {"size": obj.size, "block_size": PART_SIZE, "sha256": digest})
+            except (OSError, DownloadError) as e:
+                error = e
+
+        self._object_done(obj, error)
+
+    def _record(self, obj: _ObjectTransfer, checksum: dict):
+        with obj.mid_transfer.lock:
+            obj.mid_transfer.checksums[obj.relpath] = checksum
+
+    def _object_done(self, obj: _ObjectTransfer, error: Exception | None):
+        # finished file download task
+        with obj.lock:
+            if obj.task_id is not None:
+                self.progress.remove_task(obj.task_id)
+                obj.task_id = None
+
+        if obj.metrics.status == "pending":
+            obj.metrics.finish(error)
+
+        mid_transfer = obj.mid_transfer
+        with mid_transfer.lock:
+            mid_transfer.remaining -= 1
+            if mid_transfer.error is None:
+                mid_transfer.error = error
+            last = mid_transfer.remaining == 0
+
+        if last:
+            if mid_transfer.error is None:
+                try:
+                    write_checksums(mid_transfer.local_path, mid_transfer.checksums)
+                    # only a mid with every object in place is published and skipped on the next run
+                    mid_transfer.staging.publish()
+                except OSError as e:
+                    mid_transfer.error = e
+            self._mid_done(mid_transfer)
+
+    def _mid_done(self, mid_transfer: _MidTransfer):
+        self._settle(mid_transfer, released=False)
+        self._feed()
+
+    def _settle(self, mid_transfer: _MidTransfer, released: bool = True):
+        """
+        Give up the staging and the lookahead slot of a mid, and the pending count taken by _feed unless released is False
+        """
+        if mid_transfer.staging is not None:
+            # a failed mid stays staged for the next run
+            mid_transfer.staging.release()
+        with self._lock:
+            self._active -= 1
+        if released:
+            self._release()
+
+
+### RANGE FUNCTIONS ###
+
+
+def _probe(url: str, session: requests.Session) -> requests.Response:
+    """
+    Request the first byte of an object, the response tells its size and whether ranges are supported
+    ----------------------------
+    Parameters
+    ----------
+    url(str): the url of the object
+    session(requests.Session): the session to request the object with
+
+    Returns
+    -------
+    requests.Response: the closed response, 206 if ranges are supported, otherwise 200
+    """
+    resp = session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=TIMEOUT)
+    if resp.status_code == 206:
+        # consuming the body hands the connection back to the pool
+        resp.content
+    resp.close()
+
+    if resp.status_code == 403:
+        raise ExpiredUrlError("storage rejected the url of the object")
+    if resp.status_code not in (200, 206):
+        raise DownloadError(f"could not retrieve object resource: HTTP {resp.status_code}")
+
+    return resp
+
+
+def _content_range_size(content_range: str) -> int:
+    """
+    Get the complete length of an object from a Content-Range header
+    ----------------------------
+    Parameters
+    ----------
+    content_range(str): the header value, i.e, bytes 0-0/1024
+
+    Returns
+    -------
+    int: the size of the object in bytes
+    """
+    match = re.match(CONTENT_RANGE_PATTERN, content_range.strip())
+    if match is None:
+        raise DownloadError(f"unexpected Content-Range header: {content_range!r}")
+
+    return int(match.group(1))
+
+
+def _split_parts(total_size: int, part_size: int) -> list[list[int]]:
+    """
+    Split an object into byte ranges
+    ----------------------------
+    Parameters
+    ----------
+    total_size(int): the size of the object in bytes
+    part_size(int): the size of every range but the last
+
+    Returns
+    -------
+    list[list[int]]: [start, end, done] per range, end is exclusive and done counts the bytes already written
+    """
+    return [[start, min(start + part_size, total_size), 0] for start in range(0, total_size, part_size)]
+
+
+def _load_manifest(manifest_path: str, part_path: str, total_size: int) -> dict | None:
+    """
+    Load the manifest of an interrupted download
+    ----------------------------
+    Parameters
+    ----------
+    manifest_path(str): the path to the manifest
+    part_path(str): the path to the partial file the manifest describes
+    total_size(int): the size of the remote object in bytes
+
+    Returns
+    -------
+    dict | None: the manifest, or None if there is nothing to resume from
+    """
+    if not os.path.exists(manifest_path) or not os.path.exists(part_path):
+        return None
+
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    # the remote object changed since the transfer started
+    if manifest.get("size") != total_size or os.path.getsize(part_path) != total_size:
+        return None
+
+    return manifest
+
+
+def _write_manifest(manifest_path: str, manifest: dict):
+    """
+    Persist the progress of a download
+    ----------------------------
+    Parameters
+    ----------
+    manifest_path(str): the path to the manifest
+    manifest(dict): the size of the object and its ranges
+    """
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def _download_part(url: str, session: requests.Session, part_path: str, part: list[int], manifest: dict, manifest_path: str,
+                   lock: threading.Lock, consume):
+    """
+    Download the remaining bytes of a range into the partial file
+    ----------------------------
+    Parameters
+    ----------
+    url(str): the url of the object
+    session(requests.Session): the session to request the range with
+    part_path(str): the path to the partial file
+    part(list[int]): the [start, end, done] range, updated in place
+    manifest(dict): the manifest the range belongs to
+    manifest_path(str): the path to the manifest
+    lock(threading.Lock): serializes manifest writes across ranges
+    consume(Callable[[bytes], None]): called with every chunk written
+    """
+    start, end, done = part
+    resp = session.get(url, headers={"Range": f"bytes={start + done}-{end - 1}"}, stream=True, timeout=TIMEOUT)
+    if resp.status_code == 403:
+        resp.close()
+        raise ExpiredUrlError(f"storage rejected the url of range {start + done}-{end - 1}")
+    if resp.status_code != 206:
+        resp.close()
+        raise DownloadError(f"could not retrieve range {start + done}-{end - 1}: HTTP {resp.status_code}")
+
+    unsaved = 0
+    try:
+        with resp, open(part_path, "r+b") as f:
+            f.seek(start + done)
+            for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                done += len(chunk)
+                unsaved += len(chunk)
+                consume(chunk)
+
+                if unsaved >= MANIFEST_INTERVAL:
+                    f.flush()
+                    with lock:
+                        part[2] = done
+                        _write_manifest(manifest_path, manifest)
+                    unsaved = 0
+    except requests.RequestException as e:
+        raise InterruptedTransferError(f"range {start}-{end - 1} interrupted after {done} of {end - start} bytes") from e
+    finally:
+        # record what reached the file even if the connection dropped
+        with lock:
+            part[2] = done
+            _write_manifest(manifest_path, manifest)
+
+    if done != end - start:
+        raise InterruptedTransferError(f"range {start}-{end - 1} ended after {done} of {end - start} bytes")
+
+
+def _download_stream(url: str, session: requests.Session, part_path: str, consume):
+    """
+    Download a complete object into the partial file
+    ----------------------------
+    Parameters
+    ----------
+    url(str): the url of the object
+    session(requests.Session): the session to request the object with
+    part_path(str): the path to the partial file
+    consume(Callable[[bytes], None]): called with every chunk written
+    """
+    resp = session.get(url, stream=True, timeout=TIMEOUT)
+    if resp.status_code == 403:
+        resp.close()
+        raise ExpiredUrlError("storage rejected the url of the object")
+    if resp.status_code != 200:
+        resp.close()
+        raise DownloadError(f"could not retrieve object resource: HTTP {resp.status_code}")
+
+    try:
+        with resp, open(part_path, "wb") as f:
+            for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                # update task progress
+                consume(chunk)
+    except requests.RequestException as e:
+        raise InterruptedTransferError("object transfer interrupted") from e
+
+
+def _hash_range(path: str, start: int, length: int, hashers: list):
+    """
+    Hash a byte range of a file
+    ----------------------------
+    Parameters
+    ----------
+    path(str): the path to the file
+    start(int): the offset of the range
+    length(int): the size of the range
+    hashers(list): the hash objects to update
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                raise DownloadError(f"{path} ended before offset {start + length}")
+            for hasher in hashers:
+                hasher.update(chunk)
+            length -= len(chunk)
+
+
+def _fsync(path: str):
+    """
+    Flush a file to disk, so it is complete on disk before it is renamed into place
+    ----------------------------
+    Parameters
+    ----------
+    path(str): the path to the file
+    """
+    fd = os.open(path, os.O_RDWR)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
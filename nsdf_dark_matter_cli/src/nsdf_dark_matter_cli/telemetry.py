@@ -0,0 +1,239 @@
+import csv
+import json
+import math
+import threading
+import time
+from datetime import datetime
+from .catalog import format_size
+
+OBJECT_FIELDS = ["mid", "file", "status", "size", "bytes_written", "retries", "resolve_seconds", "ttfb_seconds",
+                 "transfer_seconds", "throughput", "fsync_seconds", "error"]
+
+
+class ObjectMetrics:
+    """
+    The metrics of an object transfer
+
+    Attributes
+    ----------
+    mid(str): the mid the object belongs to
+    file(str): the path of the object relative to the mid directory
+    status(str): pending, downloaded, skipped (already on disk) or failed
+    size(int): the size of the remote object in bytes
+    bytes_written(int): the bytes written to disk by this run
+    retries(int): the number of requests retried
+    resolve_seconds(float|None): the latency of the gen-url lookup that resolved the mid
+    ttfb_seconds(float|None): the time from sending the first request of the object to its response headers
+    transfer_seconds(float|None): the time from the first request to the object being in place
+    fsync_seconds(float): the time spent flushing the object to disk
+    error(str|None): the reason the transfer failed
+    """
+
+    def __init__(self, mid: str, file: str):
+        self.mid = mid
+        self.file = file
+        self.status = "pending"
+        self.size = 0
+        self.bytes_written = 0
+        self.retries = 0
+        self.resolve_seconds = None
+        self.ttfb_seconds = None
+        self.transfer_seconds = None
+        self.fsync_seconds = 0.0
+        self.error = None
+        self._started = None
+
+    @property
+    def throughput(self) -> float | None:
+        """
+        Bytes written per second of transfer
+        """
+        if not self.transfer_seconds or not self.bytes_written:
+            return None
+        return self.bytes_written / self.transfer_seconds
+
+    def begin(self):
+        """
+        Start timing the transfer, right before its first request
+        """
+        self._started = time.monotonic()
+
+    def finish(self, error: Exception | None = None, skipped: bool = False):
+        if self._started is not None:
+            self.transfer_seconds = time.monotonic() - self._started
+        if error is not None:
+            self.status, self.error = "failed", str(error)
+        else:
+            self.status = "skipped" if skipped else "downloaded"
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in OBJECT_FIELDS}
+
+
+class Telemetry:
+    """
+    Collect the metrics of a download, shared by every worker of a Downloader or AsyncDownloader
+
+    The metrics tell apart the three places a large pull can be bound by: the gen-url endpoint (resolve latency), the
+    object store (time to first byte and throughput per object) and the local disk (fsync time).
+
+    Attributes
+    ----------
+    objects(list[ObjectMetrics]): the metrics of every object, in the order they started
+
+    Methods
+    -------
+    resolved(mid, seconds): record a gen-url lookup
+    start_object(mid, file): start the metrics of an object
+    add_bytes(metrics, nbytes): count bytes written for an object
+    summary(): the aggregated metrics
+    stats_line(): a one line digest of the summary
+    write_report(path): write the metrics as JSON, or CSV if the path ends with .csv
+    """
+
+    def __init__(self):
+        self.objects = []
+        self._lookups = {}
+        self._lookup_seconds = []
+        self._bytes = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def resolved(self, mid: str, seconds: float):
+        with self._lock:
+            self._lookups.setdefault(mid, seconds)
+            self._lookup_seconds.append(seconds)
+
+    def start_object(self, mid: str, file: str) -> ObjectMetrics:
+        metrics = ObjectMetrics(mid, file)
+        with self._lock:
+            metrics.resolve_seconds = self._lookups.get(mid)
+            self.objects.append(metrics)
+        return metrics
+
+    def add_bytes(self, metrics: ObjectMetrics, nbytes: int):
+        with self._lock:
+            metrics.bytes_written += nbytes
+            self._bytes += nbytes
+
+    def summary(self) -> dict:
+        """
+        Aggregate the metrics of every object
+        ----------------------------
+        Returns
+        -------
+        dict: totals, and the median, 95th percentile and maximum of the latencies
+        """
+        with self._lock:
+            objects = list(self.objects)
+            lookups = list(self._lookup_seconds)
+            written = self._bytes
+        elapsed = time.monotonic() - self._started
+
+        statuses = {status: sum(metrics.status == status for metrics in objects)
+                    for status in ("pending", "downloaded", "skipped", "failed")}
+        return {
+            "elapsed_seconds": elapsed,
+            "objects": len(objects),
+            **statuses,
+            "bytes_written": written,
+            "throughput": written / elapsed if elapsed > 0 else None,
+            "retries": sum(metrics.retries for metrics in objects),
+            "lookups": len(lookups),
+            "resolve_seconds": _distribution(lookups),
+            "ttfb_seconds": _distribution([m.ttfb_seconds for m in objects if m.ttfb_seconds is not None]),
+            "object_throughput": _distribution([m.throughput for m in objects if m.throughput is not None]),
+            "fsync_seconds": sum(metrics.fsync_seconds for metrics in objects),
+        }
+
+    def stats_line(self) -> str:
+        """
+        A one line digest of the summary, for logs of batch jobs
+        ----------------------------
+        Returns
+        -------
+        str: the digest, i.e, 12:00:00 objects 10/40 done 1 failed, 1.500GiB written at 85.000MiB/s, ...
+        """
+        summary = self.summary()
+        done = summary["downloaded"] + summary["skipped"]
+        throughput = format_size(int(summary["throughput"] or 0))
+        return (f"{datetime.now().strftime('%H:%M:%S')} objects {done}/{summary['objects']} done "
+                f"{summary['failed']} failed, {format_size(summary['bytes_written'])} written at {throughput}/s, "
+                f"resolve p50 {_milliseconds(summary['resolve_seconds']['p50'])}, "
+                f"ttfb p50 {_milliseconds(summary['ttfb_seconds']['p50'])}, "
+                f"retries {summary['retries']}, fsync {summary['fsync_seconds']:.2f}s")
+
+    def write_report(self, path: str):
+        """
+        Write the metrics of every object
+        ----------------------------
+        Parameters
+        ----------
+        path(str): the report path, a .csv path gets one row per object, any other path a JSON document with the summary
+                   and the objects
+        """
+        with self._lock:
+            objects = [metrics.to_dict() for metrics in self.objects]
+
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=OBJECT_FIELDS)
+                writer.writeheader()
+                writer.writerows(objects)
+        else:
+            with open(path, "w") as f:
+                json.dump({"summary": self.summary(), "objects": objects}, f, indent=2)
+
+
+class StatsReporter:
+    """
+    Emit the stats line of a Telemetry at a fixed interval from a background thread
+
+    Methods
+    -------
+    start(): start emitting
+    stop(): stop emitting, a last line is emitted
+    """
+
+    def __init__(self, telemetry: Telemetry, interval: float, emit):
+        self.telemetry = telemetry
+        self.interval = interval
+        self.emit = emit
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.emit(self.telemetry.stats_line())
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.emit(self.telemetry.stats_line())
+
+    def __enter__(self) -> "StatsReporter":
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _distribution(values: list[float]) -> dict:
+    """
+    The median, 95th percentile and maximum of values, None when there are none
+    """
+    if not values:
+        return {"p50": None, "p95": None, "max": None}
+
+    values = sorted(values)
+    # nearest rank
+    rank = lambda q: values[max(0, math.ceil(q * len(values)) - 1)]
+    return {"p50": rank(0.5), "p95": rank(0.95), "max": values[-1]}
+
+
+def _milliseconds(seconds: float | None) -> str:
+    return "n/a" if seconds is None else f"{seconds * 1000:.0f}ms"
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import pytest
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class ObjectStore:
+    """
+    In-memory object storage served over HTTP for download tests
+
+    Attributes
+    ----------
+    objects(dict): object key to content
+    ranges(bool): whether Range requests are honored
+    fail_after(int|None): when set, object responses are cut after this many bytes of body
+    failures(int|None): the number of object responses to cut, None cuts all of them
+    delay(float): seconds to wait before answering an object request
+    lookup_delay(float): seconds to wait before answering a gen-url request
+    url_expires(int|None): when set, urls are presigned to expire this many seconds after the gen-url request, expired urls
+                           are rejected with 403
+    expired_lookups(int): the number of gen-url responses to answer with urls that already expired
+    etags(str|None): "md5" sends the md5 of objects as their ETag, "corrupt" sends a wrong one, None sends none
+    requests(list): (path, Range header) of every request received
+    connections(int): the number of connections accepted
+    max_active(int): the highest number of object requests served at once
+    max_lookups(int): the highest number of gen-url requests served at once
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.ranges = True
+        self.fail_after = None
+        self.failures = None
+        self.delay = 0.0
+        self.status = None
+        self.drop = False
+        self.short_ranges = 0
+        self.lookup_delay = 0.0
+        self.url_expires = None
+        self.expired_lookups = 0
+        self.etags = None
+        self.requests = []
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+        self.lookups = 0
+        self.max_lookups = 0
+        self.lock = threading.Lock()
+        self.url = ""
+
+    def add_mid(self, mid: str, objects: dict[str, bytes]):
+        """
+        Add the objects of a mid, keys are relative to the mid i.e, 0000.bin
+        """
+        for name, content in objects.items():
+            self.objects[f"{mid}/{name}"] = content
+
+    def gen_url_endpoint(self) -> str:
+        return f"{self.url}/gen-url"
+
+
+def _make_handler(store: ObjectStore):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body go out in separate writes, which Nagle would hold back on kept-alive connections
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def setup(self):
+            super().setup()
+            with store.lock:
+                store.connections += 1
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            with store.lock:
+                store.requests.append((parsed.path, self.headers.get("Range")))
+
+            if parsed.path == "/gen-url":
+                with store.lock:
+                    store.lookups += 1
+                    store.max_lookups = max(store.max_lookups, store.lookups)
+                try:
+                    time.sleep(store.lookup_delay)
+                    self._send_urls(parse_qs(parsed.query)["filename"][0])
+                finally:
+                    with store.lock:
+                        store.lookups -= 1
+                return
+
+            key = parsed.path.removeprefix("/objects/")
+            if key not in store.objects:
+                self._send(404, b"")
+                return
+
+            query = parse_qs(parsed.query)
+            if "X-Amz-Date" in query:
+                signed_at = datetime.strptime(query["X-Amz-Date"][0], "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+                if signed_at.timestamp() + int(query["X-Amz-Expires"][0]) < time.time():
+                    self._send(403, b"")
+                    return
+
+            if store.drop:
+                # the connection closes before a response is sent
+                self.close_connection = True
+                return
+            if store.status is not None:
+                self._send(store.status, b"")
+                return
+
+            with store.lock:
+                store.active += 1
+                store.max_active = max(store.max_active, store.active)
+            try:
+                time.sleep(store.delay)
+                self._send_object(store.objects[key])
+            finally:
+                with store.lock:
+                    store.active -= 1
+
+        def _send_urls(self, mid: str):
+            query = ""
+            if store.url_expires is not None:
+                signed_at = datetime.now(timezone.utc)
+                with store.lock:
+                    if store.expired_lookups > 0:
+                        store.expired_lookups -= 1
+                        signed_at -= timedelta(seconds=store.url_expires + 1)
+                query = f"?X-Amz-Date={signed_at.strftime('%Y%m%dT%H%M%SZ')}&X-Amz-Expires={store.url_expires}"
+
+            urls = [{"key": f"cdms/{key}", "url": f"{store.url}/objects/{key}{query}"}
+                    for key in store.objects if key.startswith(f"{mid}/")]
+            if not urls:
+                self._send(404, b"")
+                return
+            self._send(200, json.dumps({"urls": urls}).encode(), content_type="application/json")
+
+        def _send_object(self, content: bytes):
+            headers = {}
+            if store.etags is not None:
+                etag = hashlib.md5(content + (b"corrupt" if store.etags == "corrupt" else b"")).hexdigest()
+                headers["ETag"] = f'"{etag}"'
+
+            range_header = self.headers.get("Range")
+            match = re.match(r"^bytes=(\d+)-(\d+)$", range_header or "")
+            if store.ranges and match:
+                start, end = int(match.group(1)), min(int(match.group(2)), len(content) - 1)
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+                body = content[start:end + 1]
+                with store.lock:
+                    if store.short_ranges > 0 and len(body) > 1:
+                        # a complete response that ends before the requested range does
+                        store.short_ranges -= 1
+                        body = body[:len(body) // 2]
+                self._send(206, body, headers=headers, truncate=True)
+            else:
+                self._send(200, content, headers=headers, truncate=True)
+
+        def _send(self, status: int, body: bytes, content_type: str = "application/octet-stream", headers: dict | None = None,
+                  truncate: bool = False):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+
+            if truncate and self._should_fail(body):
+                # announce the full body but drop the connection part way through it
+                self.wfile.write(body[:store.fail_after])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+            self.wfile.write(body)
+
+        def _should_fail(self, body: bytes) -> bool:
+            with store.lock:
+                if store.fail_after is None or len(body) <= store.fail_after or store.failures == 0:
+                    return False
+                if store.failures is not None:
+                    store.failures -= 1
+                return True
+
+    return Handler
+
+
+@pytest.fixture
+def object_store():
+    """
+    Serve an ObjectStore on a local port, along with a gen-url endpoint that mirrors the production one
+    """
+    store = ObjectStore()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(store))
+    store.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield store
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,135 @@
+import os
+import pytest
+from typer.testing import CliRunner
+from nsdf_dark_matter_cli.cache import CACHE_DIR
+from nsdf_dark_matter_cli.checksum import checksum_file, read_checksums
+from nsdf_dark_matter_cli.cli import app
+from nsdf_dark_matter_cli.download import COMPLETE_MARKER, Downloader, DownloadError
+from nsdf_dark_matter_cli.telemetry import Telemetry
+from .test_download import MID, OTHER_MID, _expected_files, _local_files, idx_dir, objects, progress
+
+pytest.importorskip("httpx")
+from nsdf_dark_matter_cli.async_download import AsyncDownloader
+
+runner = CliRunner()
+
+
+class TestAsyncDownloader:
+    def test_download_in_parts(self, idx_dir, object_store, objects, progress):
+        [(_, error)] = AsyncDownloader(progress).download([MID])
+
+        assert error is None
+        assert _local_files(idx_dir) == _expected_files(objects)
+        bin_ranges = {r for path, r in object_store.requests if path.endswith("0000.bin")}
+        assert {"bytes=0-999", "bytes=1000-1999", "bytes=4000-4499"} <= bin_ranges
+
+    def test_download_without_range_support(self, idx_dir, object_store, objects, progress):
+        object_store.ranges = False
+        [(_, error)] = AsyncDownloader(progress).download([MID])
+
+        assert error is None
+        assert _local_files(idx_dir) == _expected_files(objects)
+
+    def test_checksums_match_threads(self, idx_dir, object_store, objects, progress):
+        """Both engines record the same checksums"""
+        object_store.add_mid(OTHER_MID, objects)
+        AsyncDownloader(progress).download([MID])
+        Downloader(progress).download([OTHER_MID])
+
+        async_checksums = read_checksums(os.path.join(idx_dir, MID))
+        thread_checksums = read_checksums(os.path.join(idx_dir, OTHER_MID))
+        assert async_checksums[f"{MID}.txt"] == thread_checksums[f"{MID}.txt"]
+        assert async_checksums[os.path.join(MID, "0000.bin")] == thread_checksums[os.path.join(OTHER_MID, "0000.bin")]
+        for file, recorded in async_checksums.items():
+            assert recorded["sha256"] == checksum_file(os.path.join(idx_dir, MID, file), recorded["block_size"])
+
+    def test_resume_after_interrupt(self, idx_dir, object_store, objects, progress):
+        """An interrupted transfer resumes from the manifest offsets, across engines"""
+        object_store.fail_after = 300
+        [(_, error)] = AsyncDownloader(progress, retries=0).download([MID])
+        assert error is not None
+        assert os.path.exists(os.path.join(idx_dir, CACHE_DIR, "staging", MID, MID, "0000.bin.part.json"))
+
+        object_store.fail_after = None
+        object_store.requests.clear()
+        [(_, error)] = Downloader(progress).download([MID])
+
+        assert error is None
+        assert _local_files(idx_dir) == _expected_files(objects)
+        bin_ranges = {r for path, r in object_store.requests if path.endswith("0000.bin")}
+        assert "bytes=300-999" in bin_ranges
+        assert "bytes=0-999" not in bin_ranges
+
+    def test_interrupted_ranges_are_retried(self, idx_dir, object_store, objects, progress):
+        object_store.fail_after = 300
+        object_store.failures = 3
+        [(_, error)] = AsyncDownloader(progress, backoff=0).download([MID])
+
+        assert error is None
+        assert _local_files(idx_dir) == _expected_files(objects)
+
+    def test_truncated_ranges_are_retried(self, idx_dir, object_store, objects, progress):
+        """A range response that ends early is resumed, as the threaded engine does"""
+        object_store.short_ranges = 2
+        [(_, error)] = AsyncDownloader(progress, backoff=0).download([MID])
+
+        assert error is None
+        assert _local_files(idx_dir) == _expected_files(objects)
+
+    def test_many_small_objects(self, idx_dir, object_store, progress):
+        """Hundreds of small objects share a bounded number of connections"""
+        mids = [f"07180808_1558_F{i:04d}" for i in range(2, 102)]
+        for mid in mids:
+            object_store.add_mid(mid, {f"{mid}.txt": b"metadata", f"{mid}.csv": b"event,metadata"})
+        object_store.delay = 0.005
+
+        results = AsyncDownloader(progress, max_connections=4, per_host=4).download(mids + ["not_a_mid"])
+        errors = dict(results)
+        assert isinstance(errors.pop("not_a_mid"), ValueError)
+        assert all(error is None for error in errors.values())
+        assert all(os.path.exists(os.path.join(idx_dir, mid, COMPLETE_MARKER)) for mid in mids)
+        assert object_store.max_active <= 4
+        assert object_store.connections <= 4 + 8
+
+    def test_rejected_urls_are_refreshed(self, idx_dir, object_store, objects, progress):
+        object_store.url_expires = 3600
+        object_store.expired_lookups = 1
+        [(_, error)] = AsyncDownloader(progress, backoff=0).download([MID])
+
+        assert error is None
+        assert _local_files(idx_dir) == _expected_files(objects)
+        assert [path for path, _ in object_store.requests].count("/gen-url") == 2
+
+    def test_etag_mismatch(self, idx_dir, object_store, progress):
+        object_store.etags = "corrupt"
+        [(_, error)] = AsyncDownloader(progress, retries=0).download([MID])
+
+        assert isinstance(error, DownloadError)
+        assert "checksum mismatch" in str(error)
+        assert not os.path.exists(os.path.join(idx_dir, MID))
+
+    def test_missing_mid(self, idx_dir, progress):
+        [(_, error)] = AsyncDownloader(progress).download([OTHER_MID])
+        assert isinstance(error, DownloadError)
+
+    def test_small_write_buffer(self, idx_dir, object_store, objects, progress):
+        """A single buffer holds every read until the previous chunk is on disk"""
+        [(_, error)] = AsyncDownloader(progress, buffers=1).download([MID])
+
+        assert error is None
+        assert _local_files(idx_dir) == _expected_files(objects)
+
+    def test_engine_option(self, idx_dir, object_store, objects):
+        result = runner.invoke(app, ["download", MID, "--engine", "async"])
+
+        assert result.exit_code == 0
+        assert _local_files(idx_dir) == _expected_files(objects)
+
+    def test_telemetry(self, idx_dir, object_store, objects, progress):
+        telemetry = Telemetry()
+        [(_, error)] = AsyncDownloader(progress, telemetry=telemetry).download([MID])
+
+        assert error is None
+        assert {metrics.status for metrics in telemetry.objects} == {"downloaded"}
+        assert all(metrics.ttfb_seconds is not None and metrics.resolve_seconds is not None for metrics in telemetry.objects)
+        assert telemetry.summary()["bytes_written"] == sum(len(content) for content in objects.values())
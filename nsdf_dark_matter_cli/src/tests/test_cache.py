@@ -0,0 +1,169 @@
+import os
+import subprocess
+import sys
+import pytest
+from typer.testing import CliRunner
+from nsdf_dark_matter_cli import cli, download
+from nsdf_dark_matter_cli.cache import CACHE_DIR, COMPLETE_MARKER, Cache, CacheBusyError, Lease
+
+runner = CliRunner()
+
+MIDS = ["07180808_1558_F0001", "07180808_1600_F0002", "07180808_1602_F0003"]
+
+
+def _publish(cache: Cache, mid: str, size: int = 1000, last_access: float | None = None):
+    with cache.stage(mid) as staging:
+        os.makedirs(os.path.join(staging.path, mid), exist_ok=True)
+        with open(os.path.join(staging.path, mid, "0000.bin"), "wb") as f:
+            f.write(b"\0" * size)
+        staging.publish()
+    if last_access is not None:
+        os.utime(cache._meta_path(mid), (last_access, last_access))
+
+
+class TestCache:
+    def test_publish(self, tmp_path):
+        """A staged mid is only visible once published"""
+        cache = Cache(str(tmp_path))
+        staging = cache.stage(MIDS[0])
+        with open(os.path.join(staging.path, "file.idx"), "wb") as f:
+            f.write(b"x" * 10)
+        assert not cache.contains(MIDS[0])
+        assert not os.path.exists(cache.path(MIDS[0]))
+
+        staging.publish()
+        assert cache.contains(MIDS[0])
+        assert os.path.exists(os.path.join(cache.path(MIDS[0]), COMPLETE_MARKER))
+        assert not os.path.exists(staging.path)
+        assert [(entry.mid, entry.size) for entry in cache.entries()] == [(MIDS[0], 10)]
+
+    def test_stage_is_exclusive(self, tmp_path):
+        cache = Cache(str(tmp_path))
+        with cache.stage(MIDS[0]):
+            with pytest.raises(CacheBusyError):
+                cache.stage(MIDS[0], blocking=False)
+        cache.stage(MIDS[0], blocking=False).release()
+
+    def test_stage_reuses_incomplete_mid(self, tmp_path):
+        """A mid directory without its marker is moved back to staging with its files"""
+        os.makedirs(tmp_path / MIDS[0])
+        (tmp_path / MIDS[0] / "file.idx").write_bytes(b"x")
+        cache = Cache(str(tmp_path))
+
+        with cache.stage(MIDS[0]) as staging:
+            assert os.path.exists(os.path.join(staging.path, "file.idx"))
+            assert not os.path.exists(cache.path(MIDS[0]))
+
+    def test_withdraw(self, tmp_path):
+        """A withdrawn mid is unpublished and its files moved to staging"""
+        cache = Cache(str(tmp_path))
+        _publish(cache, MIDS[0])
+
+        with cache.withdraw(MIDS[0]) as staging:
+            assert not cache.contains(MIDS[0])
+            assert not os.path.exists(cache.path(MIDS[0]))
+            assert os.path.exists(os.path.join(staging.path, MIDS[0], "0000.bin"))
+            assert not os.path.exists(os.path.join(staging.path, COMPLETE_MARKER))
+
+    def test_withdraw_in_use(self, tmp_path):
+        """A mid in use is not touched"""
+        cache = Cache(str(tmp_path))
+        _publish(cache, MIDS[0])
+
+        with cache.use(MIDS[0]):
+            with pytest.raises(CacheBusyError):
+                cache.withdraw(MIDS[0])
+            assert cache.contains(MIDS[0])
+        with cache.stage(MIDS[1]):
+            with pytest.raises(CacheBusyError):
+                cache.withdraw(MIDS[1])
+        cache.withdraw(MIDS[0]).release()
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        cache = Cache(str(tmp_path))
+        for i, mid in enumerate(MIDS):
+            _publish(cache, mid, last_access=1000 + i)
+        cache.use(MIDS[0]).release()
+
+        assert cache.evict(2000) == [MIDS[1]]
+        assert not os.path.exists(cache.path(MIDS[1]))
+        assert [entry.mid for entry in cache.entries()] == [MIDS[2], MIDS[0]]
+        assert os.listdir(os.path.join(tmp_path, CACHE_DIR, "trash")) == []
+
+    def test_pinned_and_used_are_kept(self, tmp_path):
+        cache = Cache(str(tmp_path))
+        for i, mid in enumerate(MIDS):
+            _publish(cache, mid, last_access=1000 + i)
+        cache.pin(MIDS[0])
+
+        with cache.use(MIDS[1]):
+            assert cache.evict(0) == [MIDS[2]]
+        cache.unpin(MIDS[0])
+        assert cache.evict(0) == [MIDS[0], MIDS[1]]
+        assert cache.entries() == []
+
+    def test_quota_on_publish(self, tmp_path):
+        """Publishing past the quota evicts older mids, never the one just published"""
+        cache = Cache(str(tmp_path), quota=1500)
+        _publish(cache, MIDS[0], last_access=1000)
+        _publish(cache, MIDS[1])
+        assert [entry.mid for entry in cache.entries()] == [MIDS[1]]
+
+        cache.quota = 500
+        _publish(cache, MIDS[2])
+        assert [entry.mid for entry in cache.entries()] == [MIDS[2]]
+
+    def test_use_missing(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            Cache(str(tmp_path)).use(MIDS[0])
+
+    def test_untracked_mid(self, tmp_path):
+        """A mid published before the cache kept track of it is measured on first listing"""
+        os.makedirs(tmp_path / MIDS[0])
+        (tmp_path / MIDS[0] / COMPLETE_MARKER).write_bytes(b"")
+        (tmp_path / MIDS[0] / "file.idx").write_bytes(b"x" * 10)
+
+        [entry] = Cache(str(tmp_path)).entries()
+        assert (entry.mid, entry.size, entry.pinned) == (MIDS[0], 10, False)
+
+    def test_dropped_lease_is_released(self, tmp_path):
+        """A lease that is never released does not keep its lock once collected"""
+        path = str(tmp_path / "lock")
+        lease = Lease(path, exclusive=True)
+        with pytest.raises(BlockingIOError):
+            Lease(path, exclusive=True, blocking=False)
+
+        del lease
+        Lease(path, exclusive=True, blocking=False).release()
+
+    def test_lock_released_on_exit(self, tmp_path):
+        """A process dying while staging does not leave the mid locked"""
+        code = ("import os, sys; from nsdf_dark_matter_cli.cache import Cache; "
+                "Cache(sys.argv[1]).stage(sys.argv[2]); os._exit(1)")
+        subprocess.run([sys.executable, "-c", code, str(tmp_path), MIDS[0]], env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)})
+        Cache(str(tmp_path)).stage(MIDS[0], blocking=False).release()
+
+
+class TestCacheCommand:
+    @pytest.fixture(autouse=True)
+    def idx_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(download, "IDX_FILES_DIR", str(tmp_path))
+        cache = Cache(str(tmp_path))
+        for i, mid in enumerate(MIDS):
+            _publish(cache, mid, last_access=1000 + i)
+        return cache
+
+    def test_list(self):
+        result = runner.invoke(cli.app, ["cache"])
+        assert result.exit_code == 0
+        assert "3 dataset(s), 2.930KiB in total" in result.stdout
+
+    def test_pin_and_evict(self, idx_dir):
+        result = runner.invoke(cli.app, ["cache", "--pin", MIDS[0], "--evict", "1KiB"])
+        assert result.exit_code == 0
+        assert f"Evicted {MIDS[1]}" in result.stdout
+        assert [(entry.mid, entry.pinned) for entry in idx_dir.entries()] == [(MIDS[0], True)]
+
+    def test_pin_missing(self):
+        result = runner.invoke(cli.app, ["cache", "--pin", "07180808_0000_F0009"])
+        assert result.exit_code == 1
@@ -0,0 +1,99 @@
+import csv
+import os
+import subprocess
+import sys
+import pytest
+from importlib import resources
+from typer.testing import CliRunner
+from nsdf_dark_matter_cli.catalog import CSV_FILE, DatasetCatalog, build_catalog, load_catalog, parse_size
+from nsdf_dark_matter_cli.cli import app
+
+runner = CliRunner()
+
+
+@pytest.fixture(scope="module")
+def rows() -> list[list[str]]:
+    with resources.files("nsdf_dark_matter_cli").joinpath(CSV_FILE).open("r", encoding="utf-8") as f:
+        return [[row["filename"], row["size"], row["rseries"]] for row in csv.DictReader(f)]
+
+
+@pytest.fixture
+def small_catalog(tmp_path) -> DatasetCatalog:
+    csv_path = tmp_path / "dataset.csv"
+    csv_path.write_text("filename,size,rseries\n"
+                        "07180808_1558_F0002,188.189MiB,R68\n"
+                        "07180808_1558_F0001,48.123MiB,R68\n"
+                        "07220702_1055_F0001,512.000KiB,R76\n"
+                        "07220702_1055_F0002,1.500GiB,R76\n")
+    build_catalog(str(csv_path), str(tmp_path / "dataset.cat"))
+    return DatasetCatalog(str(tmp_path / "dataset.cat"))
+
+
+class TestCatalog:
+    def test_packaged_catalog_matches_csv(self, rows):
+        """The packaged catalog must be rebuilt with build_catalog whenever the csv changes"""
+        catalog = load_catalog()
+        assert len(catalog) == len(rows)
+        assert [catalog[i] for i in range(len(catalog))] == [tuple(row) for row in sorted(rows)]
+
+    @pytest.mark.parametrize("prefix", ["", "0", "072", "07220702_1055", "07220702_1055_F0003", "0999", "z"])
+    def test_prefix_search(self, rows, prefix):
+        """Binary search finds the same files as a linear scan"""
+        catalog = load_catalog()
+        expected = [row[0] for row in rows if row[0].startswith(prefix)]
+        assert [catalog[i][0] for i in catalog.find(prefix)] == expected
+
+    def test_entries_are_sorted(self, small_catalog):
+        assert [small_catalog[i] for i in range(len(small_catalog))] == [
+            ("07180808_1558_F0001", "48.123MiB", "R68"),
+            ("07180808_1558_F0002", "188.189MiB", "R68"),
+            ("07220702_1055_F0001", "512.000KiB", "R76"),
+            ("07220702_1055_F0002", "1.500GiB", "R76"),
+        ]
+        assert small_catalog.rseries == ("R68", "R76")
+        with pytest.raises(IndexError):
+            small_catalog[4]
+
+    def test_filters(self, small_catalog):
+        names = lambda indices: [small_catalog[i][0][-5:] for i in indices]
+        assert names(small_catalog.find(rseries="R76")) == ["F0001", "F0002"]
+        assert names(small_catalog.find(min_size=parse_size("100MiB"))) == ["F0002", "F0002"]
+        assert names(small_catalog.find(max_size=parse_size("1MiB"))) == ["F0001"]
+        assert names(small_catalog.find("0718", limit=1)) == ["F0001"]
+        assert small_catalog.nbytes(3) == 1536 * 1024 ** 2
+
+    def test_parse_size(self):
+        assert parse_size("4096") == 4096
+        assert parse_size("1.5 KiB") == 1536
+        assert parse_size("2GiB") == 2 * 1024 ** 3
+        with pytest.raises(ValueError):
+            parse_size("2GB")
+
+    def test_invalid_rows(self, tmp_path):
+        csv_path = tmp_path / "dataset.csv"
+        csv_path.write_text("filename,size,rseries\n07180808_1558_F0001,48MiB,R68\n")
+        with pytest.raises(ValueError):
+            build_catalog(str(csv_path), str(tmp_path / "dataset.cat"))
+
+
+class TestListFilters:
+    def test_ls_rseries_and_size(self):
+        result = runner.invoke(app, ["ls", "--prefix", "0722", "--rseries", "R76", "--min-size", "20MiB", "--limit", "3"])
+        assert result.exit_code == 0
+
+        lines = result.stdout.splitlines()
+        assert len(lines) == 4
+        for line in lines[:-1]:
+            _, size, rseries = line.split()
+            assert rseries == "R76" and size.endswith("MiB") and float(size[:-3]) >= 20
+
+    def test_ls_invalid_size(self):
+        result = runner.invoke(app, ["ls", "--max-size", "lots"])
+        assert result.exit_code == 1
+
+    def test_startup_is_lazy(self):
+        """Importing the CLI neither reads the catalog nor loads the HTTP stack"""
+        code = ("import sys, nsdf_dark_matter_cli.cli, nsdf_dark_matter_cli.catalog as c; "
+                "assert 'requests' not in sys.modules and c._catalog is None")
+        env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+        subprocess.run([sys.executable, "-c", code], check=True, env=env)
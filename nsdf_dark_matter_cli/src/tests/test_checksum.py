@@ -0,0 +1,126 @@
+import hashlib
+import os
+import pytest
+from typer.testing import CliRunner
+from nsdf_dark_matter_cli import cli, download
+from nsdf_dark_matter_cli.cache import COMPLETE_MARKER, Cache
+from nsdf_dark_matter_cli.checksum import BlockHasher, checksum_file, read_checksums, tree_digest, verify, write_checksums
+
+runner = CliRunner()
+
+MID = "07180808_1558_F0001"
+BLOCK_SIZE = 1000
+
+
+@pytest.fixture
+def objects() -> dict[str, bytes]:
+    return {f"{MID}.txt": b"channel metadata\n" * 10, "0000.bin": os.urandom(4500)}
+
+
+@pytest.fixture
+def idx_dir(tmp_path, objects) -> str:
+    """A downloaded mid with recorded checksums"""
+    mid_dir = tmp_path / MID
+    (mid_dir / MID).mkdir(parents=True)
+    checksums = {}
+    for name, content in objects.items():
+        file = os.path.join(MID, name) if name.endswith(".bin") else name
+        (mid_dir / file).write_bytes(content)
+        checksums[file] = {"size": len(content), "block_size": BLOCK_SIZE, "sha256": checksum_file(str(mid_dir / file), BLOCK_SIZE)}
+    write_checksums(str(mid_dir), checksums)
+    return str(tmp_path)
+
+
+class TestBlockHasher:
+    def test_blocks_match_ranges(self):
+        """Hashing a stream in any chunking matches hashing its ranges separately"""
+        data = os.urandom(4500)
+        hasher = BlockHasher(BLOCK_SIZE)
+        for i in range(0, len(data), 333):
+            hasher.update(data[i:i + 333])
+
+        ranges = [hashlib.sha256(data[i:i + BLOCK_SIZE]).digest() for i in range(0, len(data), BLOCK_SIZE)]
+        assert hasher.hexdigest() == tree_digest(ranges)
+
+    def test_empty(self):
+        assert BlockHasher(BLOCK_SIZE).hexdigest() == tree_digest([])
+
+    def test_checksum_file(self, tmp_path):
+        data = os.urandom(2500)
+        (tmp_path / "file").write_bytes(data)
+        hasher = BlockHasher(BLOCK_SIZE)
+        hasher.update(data)
+        assert checksum_file(str(tmp_path / "file"), BLOCK_SIZE) == hasher.hexdigest()
+
+
+class TestVerify:
+    def test_intact(self, idx_dir):
+        assert verify(idx_dir, workers=2) == {MID: []}
+
+    def test_corrupt(self, idx_dir):
+        """Flipped bytes, truncation and missing files are reported per file"""
+        mid_dir = os.path.join(idx_dir, MID)
+        with open(os.path.join(mid_dir, MID, "0000.bin"), "r+b") as f:
+            f.seek(2000)
+            f.write(b"\x00\x01\x02")
+        assert verify(idx_dir, workers=2) == {MID: [(os.path.join(MID, "0000.bin"), "checksum mismatch")]}
+
+        with open(os.path.join(mid_dir, MID, "0000.bin"), "r+b") as f:
+            f.truncate(100)
+        os.remove(os.path.join(mid_dir, f"{MID}.txt"))
+        assert verify(idx_dir, workers=2) == {MID: [
+            (f"{MID}.txt", "missing"),
+            (os.path.join(MID, "0000.bin"), "size 100 does not match 4500"),
+        ]}
+
+    def test_no_checksums(self, tmp_path):
+        (tmp_path / MID).mkdir()
+        assert read_checksums(str(tmp_path / MID)) == {}
+        assert verify(str(tmp_path)) == {MID: [("", "no checksums recorded")]}
+
+
+class TestVerifyCommand:
+    @pytest.fixture(autouse=True)
+    def use_idx_dir(self, idx_dir, monkeypatch):
+        monkeypatch.setattr(download, "IDX_FILES_DIR", idx_dir)
+
+    def test_verify(self):
+        result = runner.invoke(cli.app, ["verify"])
+        assert result.exit_code == 0
+        assert "Verified 1 dataset(s)!" in result.stdout
+
+    def test_verify_corrupt(self, idx_dir):
+        os.remove(os.path.join(idx_dir, MID, f"{MID}.txt"))
+        result = runner.invoke(cli.app, ["verify", MID])
+        assert result.exit_code == 1
+        assert f"{MID}/{MID}.txt: missing" in result.stdout
+
+    def test_repair(self, idx_dir, objects, object_store, monkeypatch):
+        """Corrupt files are removed and downloaded again"""
+        object_store.add_mid(MID, objects)
+        monkeypatch.setattr(download, "GEN_URL_ENDPOINT", object_store.gen_url_endpoint())
+        monkeypatch.setattr(download, "PART_SIZE", BLOCK_SIZE)
+        bin_path = os.path.join(idx_dir, MID, MID, "0000.bin")
+        with open(bin_path, "r+b") as f:
+            f.write(b"corrupt")
+
+        result = runner.invoke(cli.app, ["verify", "--repair"])
+        assert result.exit_code == 0, result.stdout
+        assert f"Repaired {MID}" in result.stdout
+        with open(bin_path, "rb") as f:
+            assert f.read() == objects["0000.bin"]
+        assert verify(idx_dir) == {MID: []}
+
+    def test_repair_in_use(self, idx_dir):
+        """A mid in use is reported and left as it is"""
+        open(os.path.join(idx_dir, MID, COMPLETE_MARKER), "w").close()
+        bin_path = os.path.join(idx_dir, MID, MID, "0000.bin")
+        with open(bin_path, "r+b") as f:
+            f.write(b"corrupt")
+
+        with Cache(idx_dir).use(MID):
+            result = runner.invoke(cli.app, ["verify", "--repair"])
+        assert result.exit_code == 1
+        assert f"{MID} is in use by another process, not repaired" in result.stdout
+        assert os.path.exists(bin_path)
+        assert Cache(idx_dir).contains(MID)
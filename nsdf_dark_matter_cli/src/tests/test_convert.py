@@ -0,0 +1,51 @@
+import os
+import sys
+import pytest
+from typer.testing import CliRunner
+from nsdf_dark_matter_cli import download
+from nsdf_dark_matter_cli.cache import Cache
+from nsdf_dark_matter_cli.cli import app
+
+runner = CliRunner()
+
+MID = "07180808_1558_F0001"
+
+
+@pytest.fixture
+def idx_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "IDX_FILES_DIR", str(tmp_path))
+    return tmp_path
+
+
+class TestConvertCommand:
+    def test_requires_library(self, idx_dir, monkeypatch):
+        monkeypatch.setitem(sys.modules, "nsdf_dark_matter.idx", None)
+        result = runner.invoke(app, ["convert"])
+
+        assert result.exit_code == 1
+        assert "nsdf-dark-matter-cli[convert]" in result.stdout
+
+    def test_convert(self, idx_dir):
+        numpy = pytest.importorskip("numpy")
+        ov = pytest.importorskip("OpenVisus")
+        pytest.importorskip("nsdf_dark_matter.idx")
+
+        cache = Cache(str(idx_dir))
+        with cache.stage(MID) as staging:
+            data = numpy.arange(16 * 64, dtype=numpy.uint16).reshape(16, 64)
+            db = ov.CreateIdx(url=os.path.join(staging.path, f"{MID}.idx"), dims=[64, 16], fields=[ov.Field("data", "uint16")],
+                              compression=["zip"])
+            db.write(data)
+            staging.publish()
+        size = cache.entries()[0].size
+
+        result = runner.invoke(app, ["convert"])
+        assert result.exit_code == 0
+        assert f"Converted {MID}" in result.stdout
+        assert os.path.exists(os.path.join(idx_dir, MID, f"{MID}.idx.npy"))
+        assert cache.entries()[0].size > size
+
+    def test_convert_missing_mid(self, idx_dir):
+        pytest.importorskip("nsdf_dark_matter.idx")
+        result = runner.invoke(app, ["convert", MID])
+        assert result.exit_code == 1
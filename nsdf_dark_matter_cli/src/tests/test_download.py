@@ -0,0 +1,352 @@
+import os
+import pytest
+from datetime import datetime, timezone
+from rich.progress import Progress, TextColumn
+from typer.testing import CliRunner
+from nsdf_dark_matter_cli import download
+from nsdf_dark_matter_cli.cli import app
+from nsdf_dark_matter_cli.cache import CACHE_DIR, Cache, CacheBusyError
+from nsdf_dark_matter_cli.checksum import CHECKSUMS_FILE, checksum_file, read_checksums
+from nsdf_dark_matter_cli.download import (COMPLETE_MARKER, Downloader, DownloadError, UrlResolver, create_session,
+                                           download_dataset, url_expiry)
+
+MID = "07180808_1558_F0001"
+OTHER_MID = "07180808_1600_F0002"
+
+runner = CliRunner()
+
+
+@pytest.fixture
+def objects() -> dict[str, bytes]:
+    return {
+        f"{MID}.idx": b"idx header",
+        f"{MID}.txt": b"channel metadata\n" * 10,
+        "0000.bin": os.urandom(4500),
+    }
+
+
+@pytest.fixture
+def idx_dir(tmp_path, monkeypatch, object_store, objects):
+    object_store.add_mid(MID, objects)
+    monkeypatch.setattr(download, "IDX_FILES_DIR", str(tmp_path))
+    monkeypatch.setattr(download, "GEN_URL_ENDPOINT", object_store.gen_url_endpoint())
+    monkeypatch.setattr(download, "PART_SIZE", 1000)
+    monkeypatch.setattr(download, "CHUNK_SIZE", 100)
+    monkeypatch.setattr(download, "MANIFEST_INTERVAL", 100)
+    return tmp_path
+
+
+@pytest.fixture
+def progress() -> Progress:
+    return Progress(TextColumn("{task.fields[filename]}"), disable=True)
+
+
+def _local_files(idx_dir, mid: str = MID) -> dict[str, bytes]:
+    files = {}
+    for root, _, names in os.walk(os.path.join(idx_dir, mid)):
+        for name in names:
+            if name == CHECKSUMS_FILE:
+                continue
+            with open(os.path.join(root, name), "rb") as f:
+                files[os.path.relpath(os.path.join(root, name), idx_dir)] = f.read()
+    return files
+
+
+def _expected_files(objects, mid: str = MID) -> dict[str, bytes]:
+    expected = {os.path.join(mid, COMPLETE_MARKER): b""}
+    for name, content in objects.items():
+        path = os.path.join(mid, mid, name) if name.endswith(".bin") else os.path.join(mid, name)
+        expected[path] = content
+    return expected
+
+
+class TestRangeDownload:
+    def test_download_in_parts(self, idx_dir, object_store, objects, progress):
+        """Large objects are fetched as parallel byte ranges and assembled in place"""
+        download_dataset(MID, progress)
+
+        assert _local_files(idx_dir) == _expected_files(objects)
+        bin_ranges = {r for path, r in object_store.requests if path.endswith("0000.bin")}
+        assert {"bytes=0-999", "bytes=1000-1999", "bytes=4000-4499"} <= bin_ranges
+
+    def test_download_without_range_support(self, idx_dir, object_store, objects, progress):
+        """Servers that ignore Range fall back to a single stream"""
+        object_store.ranges = False
+        download_dataset(MID, progress)
+
+        assert _local_files(idx_dir) == _expected_files(objects)
+
+    def test_resume_after_interrupt(self, idx_dir, object_store, objects, progress):
+        """An interrupted transfer keeps its partial file and resumes from the manifest offsets"""
+        object_store.fail_after = 300
+        [(_, error)] = Downloader(progress, retries=0).download([MID])
+        assert error is not None
+
+        assert not os.path.exists(os.path.join(idx_dir, MID))
+        local = os.path.join(idx_dir, CACHE_DIR, "staging", MID)
+        assert os.path.exists(os.path.join(local, MID, "0000.bin.part.json"))
+        assert not os.path.exists(os.path.join(local, MID, "0000.bin"))
+
+        object_store.fail_after = None
+        object_store.requests.clear()
+        download_dataset(MID, progress)
+
+        assert _local_files(idx_dir) == _expected_files(objects)
+        bin_ranges = {r for path, r in object_store.requests if path.endswith("0000.bin")}
+        assert "bytes=300-999" in bin_ranges
+        assert "bytes=0-999" not in bin_ranges
+
+    def test_complete_mid_is_skipped(self, idx_dir, object_store, progress):
+        """A mid with a completion marker is not requested again"""
+        download_dataset(MID, progress)
+        object_store.requests.clear()
+
+        download_dataset(MID, progress)
+        assert object_store.requests == []
+
+    def test_existing_files_are_not_downloaded(self, idx_dir, object_store, objects, progress):
+        """Without a marker, files already matching the remote size are only probed"""
+        download_dataset(MID, progress)
+        os.remove(os.path.join(idx_dir, MID, COMPLETE_MARKER))
+        object_store.requests.clear()
+
+        download_dataset(MID, progress)
+        assert _local_files(idx_dir) == _expected_files(objects)
+        assert {r for path, r in object_store.requests if path.startswith("/objects/")} == {"bytes=0-0"}
+
+    def test_missing_mid(self, idx_dir, progress):
+        """Failed gen-url requests surface as a DownloadError"""
+        with pytest.raises(DownloadError):
+            download_dataset(OTHER_MID, progress)
+
+
+class TestDownloader:
+    def test_many_mids(self, idx_dir, object_store, objects, progress):
+        """Every mid is downloaded from a single work queue, invalid mids are reported"""
+        object_store.add_mid(OTHER_MID, objects)
+        results = dict(Downloader(progress).download([MID, OTHER_MID, "not_a_mid"]))
+
+        assert results[MID] is None and results[OTHER_MID] is None
+        assert isinstance(results["not_a_mid"], ValueError)
+        assert _local_files(idx_dir, MID) == _expected_files(objects, MID)
+        assert _local_files(idx_dir, OTHER_MID) == _expected_files(objects, OTHER_MID)
+
+    def test_connections_are_reused(self, idx_dir, object_store, objects, progress):
+        """A sequential download runs every request over one kept-alive connection"""
+        Downloader(progress, max_connections=1).download([MID])
+
+        assert _local_files(idx_dir) == _expected_files(objects)
+        assert len(object_store.requests) > 1
+        assert object_store.connections == 1
+
+    def test_per_host_limit(self, idx_dir, object_store, progress):
+        """No more than per_host requests run against the same host"""
+        object_store.add_mid(OTHER_MID, {"0000.bin": os.urandom(4500)})
+        object_store.delay = 0.05
+        Downloader(progress, max_connections=8, per_host=2).download([MID, OTHER_MID])
+
+        assert object_store.max_active == 2
+
+    def test_interrupted_ranges_are_retried(self, idx_dir, object_store, objects, progress):
+        """Ranges cut part way through are retried from their last offset within the same run"""
+        object_store.fail_after = 300
+        object_store.failures = 3
+        [(_, error)] = Downloader(progress, backoff=0).download([MID])
+
+        assert error is None
+        assert _local_files(idx_dir) == _expected_files(objects)
+        # every cut range resumes 300 bytes into its 1000 byte part
+        starts = [int(r.split("=")[1].split("-")[0]) for path, r in object_store.requests if path.endswith("0000.bin")]
+        assert len([start for start in starts if start % 1000 == 300]) == 3
+
+    def test_truncated_ranges_are_retried(self, idx_dir, object_store, objects, progress):
+        """A range response that ends early is resumed from the bytes it did send"""
+        object_store.short_ranges = 2
+        [(_, error)] = Downloader(progress, backoff=0).download([MID])
+
+        assert error is None
+        assert _local_files(idx_dir) == _expected_files(objects)
+
+    def test_error_statuses_are_retried_once(self, idx_dir, object_store, progress):
+        """Error statuses are retried by the session alone, not again by the downloader"""
+        object_store.status = 503
+        [(_, error)] = Downloader(progress, retries=2, backoff=0).download([MID])
+
+        assert isinstance(error, DownloadError)
+        requests = [path for path, _ in object_store.requests if path.endswith("0000.bin")]
+        assert len(requests) == 3
+
+    def test_failed_connections_are_retried_once(self, idx_dir, object_store, progress):
+        """Connections dropped before a response are retried by the session alone, not again by the downloader"""
+        object_store.drop = True
+        [(_, error)] = Downloader(progress, retries=2, backoff=0).download([MID])
+
+        assert error is not None
+        requests = [path for path, _ in object_store.requests if path.endswith("0000.bin")]
+        assert len(requests) == 3
+
+    def test_busy_mids(self, idx_dir, progress):
+        """Mids staged by another run are reported without recursing once per mid"""
+        class BusyCache(Cache):
+            def stage(self, mid, blocking=True):
+                raise CacheBusyError(f"{mid} is being downloaded by another process")
+
+        mids = [f"07180808_{i:04d}_F0001" for i in range(1500)]
+        results = Downloader(progress, cache=BusyCache(str(idx_dir))).download(mids)
+
+        assert len(results) == len(mids)
+        assert all(isinstance(error, CacheBusyError) for _, error in results)
+
+    def test_invalid_limits(self, progress):
+        with pytest.raises(ValueError):
+            Downloader(progress, max_connections=0)
+
+
+class TestUrlResolver:
+    def test_url_expiry(self):
+        url = "https://storage/0000.bin?X-Amz-Algorithm=AWS4-HMAC-SHA256&X-Amz-Date=20240101T000000Z&X-Amz-Expires=3600"
+        assert url_expiry(url) == datetime(2024, 1, 1, 1, tzinfo=timezone.utc).timestamp()
+        assert url_expiry("https://storage/0000.bin") is None
+
+    def test_urls_are_cached(self, idx_dir, object_store):
+        """A mid is looked up once while its urls are valid"""
+        object_store.url_expires = 3600
+        resolver = UrlResolver(create_session())
+
+        urls = resolver.resolve(MID)
+        assert set(urls) == {f"cdms/{MID}/{name}" for name in (f"{MID}.idx", f"{MID}.txt", "0000.bin")}
+        assert resolver.resolve(MID) == urls
+        assert set(resolver.resolve(MID, refresh=True)) == set(urls)
+        assert [path for path, _ in object_store.requests].count("/gen-url") == 2
+
+    def test_expired_urls_are_resolved_again(self, idx_dir, object_store):
+        """Cached urls within the expiry margin are not handed out"""
+        object_store.url_expires = 30
+        resolver = UrlResolver(create_session(), margin=60)
+
+        resolver.resolve(MID)
+        resolver.resolve(MID)
+        assert [path for path, _ in object_store.requests].count("/gen-url") == 2
+
+    def test_lookups_run_ahead_concurrently(self, idx_dir, object_store, progress):
+        """Mids are resolved concurrently, away from the transfer workers"""
+        mids = [f"07180808_1558_F{i:04d}" for i in range(2, 10)]
+        for mid in mids:
+            object_store.add_mid(mid, {f"{mid}.txt": b"metadata"})
+        object_store.lookup_delay = 0.1
+
+        results = Downloader(progress, max_connections=1, resolve_workers=4).download(mids)
+        assert all(error is None for _, error in results)
+        assert object_store.max_lookups == 4
+
+    def test_rejected_urls_are_refreshed(self, idx_dir, object_store, objects, progress):
+        """Urls rejected by storage are resolved again and the transfer carries on"""
+        object_store.url_expires = 3600
+        object_store.expired_lookups = 1
+        [(_, error)] = Downloader(progress, backoff=0).download([MID])
+
+        assert error is None
+        assert _local_files(idx_dir) == _expected_files(objects)
+        assert [path for path, _ in object_store.requests].count("/gen-url") == 2
+
+
+class TestChecksums:
+    def test_checksums_are_recorded(self, idx_dir, object_store, objects, progress):
+        """Checksums hashed while downloading match the files on disk, for ranged and streamed objects"""
+        object_store.add_mid(OTHER_MID, objects)
+        download_dataset(MID, progress)
+        object_store.ranges = False
+        download_dataset(OTHER_MID, progress)
+
+        for mid in (MID, OTHER_MID):
+            mid_dir = os.path.join(idx_dir, mid)
+            checksums = read_checksums(mid_dir)
+            assert set(checksums) == {f"{MID}.idx", f"{MID}.txt", os.path.join(mid, "0000.bin")}
+            for file, recorded in checksums.items():
+                assert recorded["size"] == os.path.getsize(os.path.join(mid_dir, file))
+                assert recorded["sha256"] == checksum_file(os.path.join(mid_dir, file), recorded["block_size"])
+
+    def test_resumed_checksums(self, idx_dir, object_store, progress):
+        """Bytes written before an interruption are part of the checksum"""
+        object_store.fail_after = 300
+        Downloader(progress, retries=0).download([MID])
+        object_store.fail_after = None
+        download_dataset(MID, progress)
+
+        mid_dir = os.path.join(idx_dir, MID)
+        recorded = read_checksums(mid_dir)[os.path.join(MID, "0000.bin")]
+        assert recorded["sha256"] == checksum_file(os.path.join(mid_dir, MID, "0000.bin"), recorded["block_size"])
+
+    def test_etag_mismatch(self, idx_dir, object_store, progress):
+        """Objects that do not match the md5 ETag reported by storage are discarded"""
+        object_store.etags = "corrupt"
+        [(_, error)] = Downloader(progress, retries=0).download([MID])
+
+        assert isinstance(error, DownloadError)
+        assert "checksum mismatch" in str(error)
+        assert not os.path.exists(os.path.join(idx_dir, MID, f"{MID}.txt"))
+        assert not os.path.exists(os.path.join(idx_dir, MID, f"{MID}.txt.part"))
+
+        object_store.etags = "md5"
+        [(_, error)] = Downloader(progress, retries=0).download([MID])
+        assert error is None
+
+
+class TestDownloadSelection:
+    def test_dry_run(self):
+        """A dry run lists the selected files largest first with their total size and estimated time"""
+        result = runner.invoke(app, ["download", "--prefix", "07180808_1558_F000", "--limit", "3", "--dry-run",
+                                     "--bandwidth", "1MiB"])
+        assert result.exit_code == 0
+
+        lines = result.stdout.splitlines()
+        assert lines[0] == "Planned 3 dataset(s), 418.714MiB in total"
+        assert [line.split() for line in lines[1:4]] == [
+            ["07180808_1558_F0002", "188.189MiB"],
+            ["07180808_1558_F0003", "182.402MiB"],
+            ["07180808_1558_F0001", "48.123MiB"],
+        ]
+        assert lines[4] == "Estimated transfer time: 6m 59s at 1.000MiB/s"
+
+    def test_unknown_files_go_last(self):
+        result = runner.invoke(app, ["download", "07180808_1558_F9999", "--prefix", "07180808_1558_F0001", "--dry-run"])
+        assert result.exit_code == 0
+
+        lines = result.stdout.splitlines()
+        assert lines[0] == "Planned 2 dataset(s), 48.123MiB in total (1 not in the catalog)"
+        assert lines[1].split()[0] == "07180808_1558_F0001"
+        assert lines[2].split() == ["07180808_1558_F9999", "unknown", "size"]
+
+    def test_limit_requires_a_selection(self):
+        """--limit only applies to files selected from the catalog"""
+        for args in (["07180808_1558_F0001", "--limit", "3"], ["--limit", "3"]):
+            result = runner.invoke(app, ["download", *args, "--dry-run"])
+            assert result.exit_code == 1
+            assert "--limit requires --prefix, --rseries, --min-size or --max-size" in result.stdout
+
+    def test_limit_with_file(self):
+        """A named file is downloaded on top of the limited selection"""
+        result = runner.invoke(app, ["download", "07180808_1558_F9999", "--prefix", "07180808_1558_F000", "--limit", "1",
+                                     "--dry-run"])
+        assert result.exit_code == 0
+
+        lines = result.stdout.splitlines()
+        assert lines[0] == "Planned 2 dataset(s), 48.123MiB in total (1 not in the catalog)"
+
+    def test_download_selection(self, idx_dir, object_store, objects, monkeypatch):
+        """Selected files are handed to the downloader largest first"""
+        object_store.add_mid("07180808_1558_F0002", objects)
+        requested = []
+        download_mids = Downloader.download
+
+        def spy(self, midfiles):
+            requested.extend(midfiles)
+            return download_mids(self, midfiles)
+
+        monkeypatch.setattr(Downloader, "download", spy)
+        result = runner.invoke(app, ["download", "--prefix", "07180808_1558_F000", "--limit", "2"])
+
+        assert result.exit_code == 0
+        assert requested == ["07180808_1558_F0002", MID]
+        assert "Successfully downloaded 2 dataset(s)!" in result.stdout
+        assert _local_files(idx_dir) == _expected_files(objects)
@@ -0,0 +1,90 @@
+import csv
+import json
+import os
+from typer.testing import CliRunner
+from nsdf_dark_matter_cli.cli import app
+from nsdf_dark_matter_cli.download import Downloader
+from nsdf_dark_matter_cli.telemetry import OBJECT_FIELDS, StatsReporter, Telemetry, _distribution
+from .test_download import MID, idx_dir, objects, progress
+
+runner = CliRunner()
+
+
+class TestTelemetry:
+    def test_distribution(self):
+        assert _distribution([]) == {"p50": None, "p95": None, "max": None}
+        assert _distribution([float(i) for i in range(1, 101)]) == {"p50": 50.0, "p95": 95.0, "max": 100.0}
+
+    def test_object_metrics(self):
+        telemetry = Telemetry()
+        telemetry.resolved(MID, 0.25)
+        metrics = telemetry.start_object(MID, "0000.bin")
+        metrics.begin()
+        telemetry.add_bytes(metrics, 1000)
+        metrics.finish()
+
+        assert metrics.resolve_seconds == 0.25
+        assert metrics.status == "downloaded"
+        assert metrics.throughput == 1000 / metrics.transfer_seconds
+        summary = telemetry.summary()
+        assert (summary["objects"], summary["downloaded"], summary["bytes_written"]) == (1, 1, 1000)
+        assert summary["resolve_seconds"]["p50"] == 0.25
+
+    def test_failed_object(self):
+        metrics = Telemetry().start_object(MID, "0000.bin")
+        metrics.finish(ValueError("boom"))
+        assert (metrics.status, metrics.error, metrics.throughput) == ("failed", "boom", None)
+
+    def test_stats_reporter(self):
+        lines = []
+        with StatsReporter(Telemetry(), 0.01, lines.append):
+            while len(lines) < 2:
+                pass
+        assert all("objects 0/0 done 0 failed" in line for line in lines)
+
+
+class TestDownloadTelemetry:
+    def test_downloader_metrics(self, idx_dir, object_store, objects, progress):
+        """Every object reports its lookup, first byte, bytes written and retries"""
+        object_store.fail_after = 300
+        object_store.failures = 1
+        telemetry = Telemetry()
+        [(_, error)] = Downloader(progress, backoff=0, telemetry=telemetry).download([MID])
+        assert error is None
+
+        by_file = {metrics.file: metrics for metrics in telemetry.objects}
+        assert set(by_file) == {f"{MID}.idx", f"{MID}.txt", os.path.join(MID, "0000.bin")}
+        for metrics in by_file.values():
+            assert metrics.status == "downloaded"
+            assert metrics.resolve_seconds is not None
+            assert metrics.ttfb_seconds is not None
+            assert metrics.fsync_seconds > 0
+            assert metrics.size == metrics.bytes_written
+        assert sum(metrics.retries for metrics in by_file.values()) == 1
+        assert telemetry.summary()["lookups"] == 1
+
+        telemetry = Telemetry()
+        os.remove(os.path.join(idx_dir, MID, ".complete"))
+        Downloader(progress, telemetry=telemetry).download([MID])
+        assert {metrics.status for metrics in telemetry.objects} == {"skipped"}
+        assert telemetry.summary()["bytes_written"] == 0
+
+    def test_report(self, idx_dir, object_store, tmp_path):
+        result = runner.invoke(app, ["download", MID, "--report", str(tmp_path / "report.json"), "--stats-interval", "60"])
+        assert result.exit_code == 0
+        assert "objects 3/3 done 0 failed" in result.stdout
+
+        with open(tmp_path / "report.json") as f:
+            report = json.load(f)
+        assert report["summary"]["downloaded"] == 3
+        assert report["summary"]["bytes_written"] == sum(obj["bytes_written"] for obj in report["objects"])
+        assert set(report["objects"][0]) == set(OBJECT_FIELDS)
+
+    def test_csv_report(self, idx_dir, object_store, tmp_path):
+        result = runner.invoke(app, ["download", MID, "--report", str(tmp_path / "report.csv")])
+        assert result.exit_code == 0
+
+        with open(tmp_path / "report.csv", newline="") as f:
+            rows = list(csv.DictReader(f))
+        assert len(rows) == 3
+        assert {row["status"] for row in rows} == {"downloaded"}